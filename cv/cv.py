@@ -1,60 +1,48 @@
+# Tracks the pen marker in a video and prints its box every frame.
+# Usage: python -m cv.cv [video] [--show] [--kcf] [--skip N]
+from argparse import ArgumentParser
+
 import cv2
-import numpy as np
-
-vid = cv2.VideoCapture('pen_video.mov')
-tracker = None
-
-#for skip in range(5):
-#    _, _ = vid.read()
-
-while True:
-    ret, frame = vid.read()
-    if ret is False:
-        break
-
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Create a binary mask where the black areas are white
-    # Here we define "black" as pixels with intensity < 50 (you can adjust this threshold)
-    _, mask = cv2.threshold(gray, 25, 255, cv2.THRESH_BINARY_INV)
-    bg = np.zeros_like(frame)
-    cv2.imshow('Filtered', mask)
-
-    if tracker is None:
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        cv2.drawContours(frame, contours, -1, (255, 0, 0), 3)
-        max_c = None
-        max_area = 0
-        for c in contours:
-            area = cv2.contourArea(c)
-            if area > max_area:
-                max_area = area
-                max_c = c
-
-        if max_c is None:
-            continue
-        else:
-            box = cv2.boundingRect(max_c)
-            print('Init', box)
-            x, y, w, h = [int(v) for v in box]
-            tracker = cv2.TrackerKCF_create()
-            tracker.init(frame, box)
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
-    else:
-        success, box = tracker.update(frame)
-        if success:
-            print(box)
-            x, y, w, h = [int(v) for v in box]
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
-        else:
-            print('Failed: ', box)
-            tracker = None
-
-    cv2.imshow('objs', frame)
-
-    key = cv2.waitKey(0)
-    if key == ord('q'):
-        break
-
-vid.release()
-cv2.destroyAllWindows()
+
+from .pipeline import PenTracker
+
+
+def main():
+    parser = ArgumentParser(prog="cv", description="Track the pen marker in a video")
+    parser.add_argument("video", nargs="?", default="pen_video.mov")
+    parser.add_argument(
+        "--show", action="store_true", default=False, help="Show frames in a window."
+    )
+    parser.add_argument(
+        "--kcf",
+        action="store_true",
+        default=False,
+        help="Track the box with KCF between detections.",
+    )
+    parser.add_argument("--skip", type=int, default=0, help="Frames to skip at the start.")
+    args = parser.parse_args()
+
+    tracker = PenTracker(args.video, kcf=args.kcf)
+    tracker.reader.skip(args.skip)
+    try:
+        for det in tracker:
+            print(det.box if det.box is not None else "Lost")
+            if args.show:
+                frame = det.image
+                if det.box is not None:
+                    x, y, w, h = det.box
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
+                cv2.imshow("objs", frame)
+                # Don't block on every frame
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+    finally:
+        tracker.close()
+        if args.show:
+            cv2.destroyAllWindows()
+
+    print(tracker.summary())
+
+
+if __name__ == "__main__":
+    main()
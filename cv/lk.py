@@ -1,77 +1,232 @@
+# Lucas-Kanade optical flow over a fixed budget of Shi-Tomasi corners.
+# Usage: python -m cv.lk [video] [--skip N] [--show]
+from argparse import ArgumentParser
+from typing import Optional
+
 import cv2
 import numpy as np
 
-def lucas_kanade_method(video_path, skip_frames):
-    # Read the video 
-    cap = cv2.VideoCapture(video_path)
-
-    for _ in range(skip_frames):
-        ret, _ = cap.read()  # Read and discard `skip_frames` number of frames
- 
-    # Parameters for ShiTomasi corner detection
-    feature_params = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
- 
-    # Parameters for Lucas Kanade optical flow
-    lk_params = dict(
-        winSize=(15, 15),
-        maxLevel=2,
-        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
-    )
- 
-    # Create random colors
-    color = np.random.randint(0, 255, (100, 3))
- 
-    # Take first frame and find corners in it
-    ret, old_frame = cap.read()
-    old_gray = cv2.cvtColor(old_frame, cv2.COLOR_BGR2GRAY)
-    p0 = cv2.goodFeaturesToTrack(old_gray, mask=None, **feature_params)
- 
-    # Create a mask image for drawing purposes
-    mask = np.zeros_like(old_frame)
-
-    # Highlight the good features to track
-    for i in range(len(p0)):
-        x, y = p0[i].ravel().astype(int)  # Get the coordinates of each corner
-        cv2.circle(old_frame, (x, y), 5, (0, 255, 0), -1)  # Draw a circle on each good feature
-    
-    # Display the initial frame with highlighted feature points
-    cv2.imshow("Good Features to Track", old_frame)
-    cv2.waitKey(0)  # Wait until a key is pressed before closing the window
-
-    while True:
-        # Read new frame
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-     
-        # Calculate Optical Flow
-        p1, st, err = cv2.calcOpticalFlowPyrLK(
-            old_gray, frame_gray, p0, None, **lk_params
+from .pipeline import Box, FrameReader, StageTimer
+
+
+class PointTracker:
+    # Maximum number of points tracked at once
+    budget: int
+    # The frame is split into a grid and points are topped up per cell,
+    # so new corners only get detected where old ones were lost
+    grid: tuple[int, int]
+    # Points whose forward-backward error is bigger than this (px) are dropped
+    fb_thresh: float
+    # Frames between top-ups
+    redetect: int
+    # Only seed points inside this box if set
+    roi: Optional[Box]
+    feature_params: dict
+    lk_params: dict
+
+    # (N, 1, 2) float32, like OpenCV wants
+    pts: np.ndarray
+    # Grayscale buffers swapped every frame instead of copied
+    prev: Optional[np.ndarray]
+    cur: Optional[np.ndarray]
+    # Seeding masks, reused between top-ups
+    mask: Optional[np.ndarray]
+    blocked: Optional[np.ndarray]
+    kernel: np.ndarray
+    frame: int
+    timer: StageTimer
+
+    def __init__(
+        self,
+        budget: int = 100,
+        grid: tuple[int, int] = (4, 4),
+        fb_thresh: float = 1.0,
+        redetect: int = 5,
+        timer: Optional[StageTimer] = None,
+    ):
+        self.budget = budget
+        self.grid = grid
+        self.fb_thresh = fb_thresh
+        self.redetect = redetect
+        self.roi = None
+        self.feature_params = dict(qualityLevel=0.3, minDistance=7, blockSize=7)
+        self.lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
         )
+        self.pts = np.empty((0, 1, 2), dtype=np.float32)
+        self.prev = None
+        self.cur = None
+        self.mask = None
+        self.blocked = None
+        d = self.feature_params["minDistance"]
+        self.kernel = np.ones((2 * d + 1, 2 * d + 1), dtype=np.uint8)
+        self.frame = 0
+        self.timer = StageTimer() if timer is None else timer
 
-        if p1 is not None and st is not None:
-            good_new = p1[st == 1]
-            good_old = p0[st == 1]
-    
-            # Draw the tracks
-            for i, (new, old) in enumerate(zip(good_new, good_old)):
-                a, b = new.ravel().astype(int)  # Convert to integers
-                c, d = old.ravel().astype(int)  # Convert to integers
-                mask = cv2.line(mask, (a, b), (c, d), color[i].tolist(), 2)
-                frame = cv2.circle(frame, (a, b), 5, color[i].tolist(), -1)
+    def reset(self):
+        self.pts = np.empty((0, 1, 2), dtype=np.float32)
+
+    def to_gray(self, frame: np.ndarray) -> np.ndarray:
+        # Swap buffers so the previous frame stays around without a copy
+        self.prev, self.cur = self.cur, self.prev
+        if self.cur is None or self.cur.shape != frame.shape[:2]:
+            self.cur = np.empty(frame.shape[:2], dtype=np.uint8)
+        if frame.ndim == 2:
+            np.copyto(self.cur, frame)
         else:
-            print("Optical flow tracking failed for this frame.")
-     
-        # Display the demo
-        img = cv2.add(frame, mask)
-        cv2.imshow("frame", img)
-        k = cv2.waitKey(25) & 0xFF
-        if k == 27:
-            break
-     
-        # Update the previous frame and previous points
-        old_gray = frame_gray.copy()
-        p0 = good_new.reshape(-1, 1, 2)
-
-lucas_kanade_method('pen_video.mov', 50)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.cur)
+        return self.cur
+
+    def flow(self, prev: np.ndarray, cur: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Returns the (N, 1, 2) tracked points and the (N,) mask of ones that survived
+        off = np.zeros(2, dtype=np.float32)
+        if self.roi is not None:
+            # Building the pyramids is most of the cost, so only build them for the
+            # region around the points plus however far the search can reach
+            h, w = cur.shape
+            reach = self.lk_params["winSize"][0] << self.lk_params["maxLevel"]
+            pts = self.pts.reshape(-1, 2)
+            x0, y0 = np.maximum(pts.min(axis=0).astype(int) - reach, 0)
+            x1, y1 = pts.max(axis=0).astype(int) + reach
+            prev, cur = prev[y0:y1, x0:x1], cur[y0:y1, x0:x1]
+            off[:] = (x0, y0)
+
+        p0 = self.pts - off
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(prev, cur, p0, None, **self.lk_params)
+        if p1 is None:
+            return self.pts, np.zeros(len(self.pts), dtype=bool)
+        p0r, st_back, _ = cv2.calcOpticalFlowPyrLK(cur, prev, p1, None, **self.lk_params)
+        fb = np.linalg.norm((p0 - p0r).reshape(-1, 2), axis=1)
+        good = (st.ravel() == 1) & (st_back.ravel() == 1) & (fb < self.fb_thresh)
+        return p1 + off, good
+
+    def top_up(self, gray: np.ndarray):
+        h, w = gray.shape
+        x0, y0, x1, y1 = 0, 0, w, h
+        if self.roi is not None:
+            rx, ry, rw, rh = self.roi
+            x0, y0 = max(rx, 0), max(ry, 0)
+            x1, y1 = min(rx + rw, w), min(ry + rh, h)
+            if x1 <= x0 or y1 <= y0:
+                return
+
+        gx, gy = self.grid
+        per_cell = max(self.budget // (gx * gy), 1)
+        cw, ch = (x1 - x0) / gx, (y1 - y0) / gy
+
+        # Count the points already in each cell
+        pts = self.pts.reshape(-1, 2)
+        cx = ((pts[:, 0] - x0) // cw).astype(int)
+        cy = ((pts[:, 1] - y0) // ch).astype(int)
+        inside = (cx >= 0) & (cx < gx) & (cy >= 0) & (cy < gy)
+        counts = np.bincount(cy[inside] * gx + cx[inside], minlength=gx * gy)
+        missing = np.flatnonzero(counts < per_cell // 2 + 1)
+        if len(missing) == 0:
+            return
+
+        wanted = self.budget - len(pts)
+        if wanted <= 0:
+            return
+
+        # Corner detection costs the same with or without a mask, so only run it
+        # on the region we're seeding
+        sub = gray[y0:y1, x0:x1]
+        if self.mask is None or self.mask.shape != sub.shape:
+            self.mask = np.empty(sub.shape, dtype=np.uint8)
+            self.blocked = np.empty(sub.shape, dtype=np.uint8)
+        self.mask.fill(0)
+        for cell in missing:
+            r, c = divmod(int(cell), gx)
+            self.mask[
+                int(r * ch) : int((r + 1) * ch),
+                int(c * cw) : int((c + 1) * cw),
+            ] = 255
+        # Don't detect corners right on top of the ones we have: punch holes where
+        # the points are and grow them with an erosion
+        if inside.any():
+            assert self.blocked is not None
+            self.blocked.fill(255)
+            xs = np.clip(pts[inside, 0].astype(int) - x0, 0, x1 - x0 - 1)
+            ys = np.clip(pts[inside, 1].astype(int) - y0, 0, y1 - y0 - 1)
+            self.blocked[ys, xs] = 0
+            cv2.erode(self.blocked, self.kernel, dst=self.blocked)
+            cv2.bitwise_and(self.mask, self.blocked, dst=self.mask)
+
+        new = cv2.goodFeaturesToTrack(
+            sub, mask=self.mask, maxCorners=wanted, **self.feature_params
+        )
+        if new is not None:
+            new = new.astype(np.float32) + np.array([x0, y0], dtype=np.float32)
+            self.pts = np.concatenate((self.pts, new))
+
+    # Drops the points and seeds new ones inside roi, in the frame that was last
+    # passed to update, so a frame that's already been tracked isn't read twice
+    def reseed(self, roi: Box):
+        self.reset()
+        self.roi = roi
+        if self.cur is not None:
+            with self.timer.stage("seed"):
+                self.top_up(self.cur)
+
+    # Returns the (N, 2) points that were tracked into this frame from the last one,
+    # and where they came from
+    def update(self, frame: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        gray = self.to_gray(frame)
+        old = new = np.empty((0, 2), dtype=np.float32)
+
+        if self.prev is not None and len(self.pts) > 0:
+            with self.timer.stage("flow"):
+                p1, good = self.flow(self.prev, gray)
+            old = self.pts[good].reshape(-1, 2)
+            self.pts = p1[good].reshape(-1, 1, 2)
+            new = self.pts.reshape(-1, 2)
+
+        if self.frame % self.redetect == 0 or len(self.pts) < self.budget // 2:
+            with self.timer.stage("seed"):
+                self.top_up(gray)
+
+        self.frame += 1
+        return new, old
+
+
+def lucas_kanade_method(video_path: str, skip_frames: int, show: bool = False):
+    reader = FrameReader(video_path)
+    reader.skip(skip_frames)
+    tracker = PointTracker(timer=reader.timer)
+
+    try:
+        for frame in reader:
+            new, old = tracker.update(frame.image)
+            if not show:
+                continue
+
+            img = frame.image
+            # One call per frame instead of one per point
+            segs = np.stack((new, old), axis=1).astype(np.int32)
+            cv2.polylines(img, list(segs), False, (0, 0, 255), 2)
+            # Zero length lines draw as dots
+            dots = np.stack((new, new), axis=1).astype(np.int32)
+            cv2.polylines(img, list(dots), False, (0, 255, 0), 6)
+            cv2.imshow("frame", img)
+            if cv2.waitKey(1) & 0xFF == 27:
+                break
+    finally:
+        reader.close()
+        if show:
+            cv2.destroyAllWindows()
+
+    print(f"{tracker.frame} frames, {len(tracker.pts)} points at the end")
+    print(tracker.timer.summary())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="lk", description="Optical flow over a video")
+    parser.add_argument("video", nargs="?", default="pen_video.mov")
+    parser.add_argument("--skip", type=int, default=50, help="Frames to skip at the start.")
+    parser.add_argument(
+        "--show", action="store_true", default=False, help="Show frames in a window."
+    )
+    args = parser.parse_args()
+    lucas_kanade_method(args.video, args.skip, args.show)
@@ -0,0 +1,355 @@
+# Frame processing for camera-based pen tracking.
+#
+# Frames are read on a background thread into a bounded queue. The marker (the darkest
+# blob in the frame) is searched for in a downscaled region around where it was last
+# seen, and the whole frame is only searched again once it's lost. Nothing here
+# opens a window unless asked to.
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+
+import cv2
+import numpy as np
+
+if TYPE_CHECKING:
+    from .lk import PointTracker
+
+# (x, y, w, h) in full-frame pixels
+Box = tuple[int, int, int, int]
+
+
+class StageTimer:
+    # Total seconds, call count and worst case per stage
+    total: defaultdict[str, float]
+    count: defaultdict[str, int]
+    worst: defaultdict[str, float]
+
+    def __init__(self):
+        self.total = defaultdict(float)
+        self.count = defaultdict(int)
+        self.worst = defaultdict(float)
+
+    def add(self, stage: str, secs: float):
+        self.total[stage] += secs
+        self.count[stage] += 1
+        if secs > self.worst[stage]:
+            self.worst[stage] = secs
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start)
+
+    def summary(self) -> str:
+        lines = []
+        for stage in self.total:
+            if stage == "total":
+                continue
+            mean = self.total[stage] / self.count[stage] * 1000
+            lines.append(
+                f"{stage:>10}: {mean:7.3f} ms avg, {self.worst[stage] * 1000:7.3f} ms max "
+                f"({self.count[stage]} calls)"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class Frame:
+    index: int
+    # Seconds (perf_counter) when the frame was read
+    t: float
+    image: np.ndarray
+
+
+class FrameReader:
+    cap: cv2.VideoCapture
+    queue: Queue[Optional[Frame]]
+    # Live cameras drop the oldest frame when we fall behind,
+    # video files wait instead so every frame gets processed
+    drop: bool
+    dropped: int
+    timer: StageTimer
+    stop: Event
+    thread: Thread
+
+    def __init__(
+        self,
+        source: Union[str, int],
+        size: int = 4,
+        drop: Optional[bool] = None,
+        timer: Optional[StageTimer] = None,
+    ):
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise FileNotFoundError(f"Couldn't open video source {source}")
+        self.queue = Queue(size)
+        self.drop = isinstance(source, int) if drop is None else drop
+        self.dropped = 0
+        self.timer = StageTimer() if timer is None else timer
+        self.stop = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def fps(self) -> float:
+        return self.cap.get(cv2.CAP_PROP_FPS)
+
+    def skip(self, frames: int):
+        for _ in range(frames):
+            self.get()
+
+    def run(self):
+        index = 0
+        while not self.stop.is_set():
+            start = perf_counter()
+            ret, image = self.cap.read()
+            now = perf_counter()
+            self.timer.add("read", now - start)
+            if not ret:
+                break
+
+            frame = Frame(index, now, image)
+            index += 1
+            if self.drop:
+                while True:
+                    try:
+                        self.queue.put_nowait(frame)
+                        break
+                    except Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.dropped += 1
+                        except Empty:
+                            pass
+            else:
+                while not self.stop.is_set():
+                    try:
+                        self.queue.put(frame, timeout=0.1)
+                        break
+                    except Full:
+                        pass
+
+        # Tells the consumer the video is over. After close() nobody reads the queue
+        # anymore, so don't wait for room there
+        while True:
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except Full:
+                if self.stop.is_set():
+                    break
+
+    # None once the video is over
+    def get(self) -> Optional[Frame]:
+        return self.queue.get()
+
+    def __iter__(self) -> Iterator[Frame]:
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        self.stop.set()
+        # Unblock the reader if it's waiting on a full queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+        self.thread.join()
+        self.cap.release()
+
+
+class MarkerDetector:
+    # Pixels darker than this are considered part of the marker
+    threshold: int
+    # Downscale factor applied before thresholding
+    scale: float
+    # Size of the search region around the last box, in multiples of the box size
+    margin: float
+    # Blobs smaller than this (full-frame pixels) are noise
+    min_area: int
+    last: Optional[Box]
+    # Reused between frames
+    gray: Optional[np.ndarray]
+    full_searches: int
+
+    def __init__(
+        self,
+        threshold: int = 25,
+        scale: float = 0.5,
+        margin: float = 2.0,
+        min_area: int = 64,
+    ):
+        self.threshold = threshold
+        self.scale = scale
+        self.margin = margin
+        self.min_area = min_area
+        self.last = None
+        self.gray = None
+        self.full_searches = 0
+
+    def to_gray(self, frame: np.ndarray) -> np.ndarray:
+        if frame.ndim == 2:
+            return frame
+        if self.gray is None or self.gray.shape != frame.shape[:2]:
+            self.gray = np.empty(frame.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    def search(self, gray: np.ndarray, x0: int, y0: int) -> Optional[Box]:
+        small = cv2.resize(
+            gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA
+        )
+        _, mask = cv2.threshold(small, self.threshold, 255, cv2.THRESH_BINARY_INV)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if n <= 1:
+            return None
+
+        # Label 0 is the background
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        best = int(np.argmax(areas))
+        if areas[best] / (self.scale * self.scale) < self.min_area:
+            return None
+
+        x, y, w, h = stats[best + 1, :4] / self.scale
+        return (int(x) + x0, int(y) + y0, int(np.ceil(w)), int(np.ceil(h)))
+
+    def detect(self, frame: np.ndarray) -> Optional[Box]:
+        gray = self.to_gray(frame)
+        box = None
+        if self.last is not None:
+            x, y, w, h = self.last
+            fh, fw = gray.shape
+            mx, my = int(w * self.margin), int(h * self.margin)
+            x0, y0 = max(x - mx, 0), max(y - my, 0)
+            x1, y1 = min(x + w + mx, fw), min(y + h + my, fh)
+            box = self.search(gray[y0:y1, x0:x1], x0, y0)
+
+        if box is None:
+            # Lost it (or never had it), look everywhere
+            self.full_searches += 1
+            box = self.search(gray, 0, 0)
+
+        self.last = box
+        return box
+
+
+@dataclass
+class Detection:
+    index: int
+    # When the frame was read (perf_counter seconds)
+    t: float
+    box: Optional[Box]
+    image: np.ndarray
+
+    def center(self) -> Optional[tuple[float, float]]:
+        if self.box is None:
+            return None
+        x, y, w, h = self.box
+        return (x + w / 2, y + h / 2)
+
+
+class PenTracker:
+    reader: FrameReader
+    detector: MarkerDetector
+    timer: StageTimer
+    # KCF tracks the box between detections if enabled
+    kcf: bool
+    tracker: Optional[cv2.Tracker]
+    # Or Lucas-Kanade optical flow over corners around the marker
+    points: Optional["PointTracker"]
+    min_points: int
+    frames: int
+
+    def __init__(
+        self,
+        source: Union[str, int],
+        detector: Optional[MarkerDetector] = None,
+        kcf: bool = False,
+        queue: int = 4,
+        drop: Optional[bool] = None,
+        flow: bool = False,
+        min_points: int = 4,
+    ):
+        self.timer = StageTimer()
+        self.reader = FrameReader(source, queue, drop, self.timer)
+        self.detector = MarkerDetector() if detector is None else detector
+        self.kcf = kcf
+        self.tracker = None
+        self.points = None
+        if flow:
+            # Circular import otherwise
+            from .lk import PointTracker
+
+            self.points = PointTracker(budget=30, grid=(2, 2), timer=self.timer)
+        self.min_points = min_points
+        self.frames = 0
+
+    def seed_roi(self, box: Box) -> Box:
+        x, y, w, h = box
+        return (x - w // 2, y - h // 2, 2 * w, 2 * h)
+
+    def process(self, frame: Frame) -> Detection:
+        box = None
+        # Whether the point tracker has already seen this frame
+        flowed = False
+        if self.tracker is not None:
+            with self.timer.stage("track"):
+                ok, found = self.tracker.update(frame.image)
+            if ok:
+                box = tuple(int(v) for v in found)
+                self.detector.last = box  # type: ignore
+            else:
+                self.tracker = None
+        elif self.points is not None and self.detector.last is not None:
+            new, old = self.points.update(frame.image)
+            flowed = True
+            if len(new) >= self.min_points:
+                # The median is robust to the odd corner that was on the background
+                dx, dy = np.median(new - old, axis=0)
+                x, y, w, h = self.detector.last
+                box = (int(round(x + dx)), int(round(y + dy)), w, h)
+                self.detector.last = box
+                self.points.roi = self.seed_roi(box)
+
+        if box is None:
+            with self.timer.stage("detect"):
+                box = self.detector.detect(frame.image)
+            if box is not None and self.kcf:
+                self.tracker = cv2.TrackerKCF_create()
+                self.tracker.init(frame.image, box)
+            elif box is not None and self.points is not None:
+                if flowed:
+                    self.points.reseed(self.seed_roi(box))
+                else:
+                    self.points.reset()
+                    self.points.roi = self.seed_roi(box)
+                    self.points.update(frame.image)
+
+        self.frames += 1
+        return Detection(frame.index, frame.t, box, frame.image)  # type: ignore
+
+    def __iter__(self) -> Iterator[Detection]:
+        start = perf_counter()
+        for frame in self.reader:
+            yield self.process(frame)
+        self.timer.add("total", perf_counter() - start)
+
+    def close(self):
+        self.reader.close()
+
+    def summary(self) -> str:
+        total = self.timer.total["total"]
+        fps = self.frames / total if total > 0 else 0.0
+        return (
+            f"{self.frames} frames at {fps:.1f} fps, {self.reader.dropped} dropped, "
+            f"{self.detector.full_searches} full-frame searches\n{self.timer.summary()}"
+        )
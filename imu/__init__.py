@@ -0,0 +1 @@
+# Nothing
@@ -0,0 +1,143 @@
+# Streaming analysis of IMU captures (the points.csv files written by host.py).
+#
+# Captures are read in fixed-size chunks so multi-hour recordings can be processed
+# in constant memory, and the Kalman filter runs over every sensor and axis at once.
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+# One column per sensor reading, in the order the pen sends them
+SENSOR_COLUMNS = [
+    f"{kind}{axis}{sensor}"
+    for sensor in (1, 2)
+    for kind in ("acc", "gyr", "mag")
+    for axis in ("x", "y", "z")
+]
+COLUMNS = SENSOR_COLUMNS + ["delay"]
+
+# Gravity (m/s^2)
+G = 9.8
+
+
+def _units() -> tuple[np.ndarray, np.ndarray]:
+    scale = np.ones(len(SENSOR_COLUMNS))
+    offset = np.zeros(len(SENSOR_COLUMNS))
+    for i, name in enumerate(SENSOR_COLUMNS):
+        if name.startswith("acc"):
+            # Accelerometers report milli-g
+            scale[i] = G / 1000
+            # Assume X is the axis facing downwards
+            if name[3] == "x":
+                offset[i] = G
+    return scale, offset
+
+
+# converted = raw * SCALE + OFFSET, applied to a whole (N, 18) block at once
+SCALE, OFFSET = _units()
+
+
+def column(name: str) -> int:
+    return SENSOR_COLUMNS.index(name)
+
+
+@dataclass
+class Chunk:
+    # Seconds since the start of the capture, shape (N,)
+    t: np.ndarray
+    # Time since the previous sample in seconds, shape (N,)
+    dt: np.ndarray
+    # Sensor readings in SI-ish units (m/s^2, dps, uT), shape (N, 18)
+    data: np.ndarray
+
+
+# Pass offset=False to keep gravity in the accelerometer readings
+def convert(raw: np.ndarray, offset: bool = True) -> np.ndarray:
+    return raw * SCALE + OFFSET if offset else raw * SCALE
+
+
+def read_chunks(path: str, rows: int = 4096, offset: bool = True) -> Iterator[Chunk]:
+    elapsed = 0.0
+    with open(path, "r") as f:
+        header = f.readline().strip().split(",")
+        # Be lenient about column order as long as every column is there
+        order = [header.index(name) for name in COLUMNS]
+
+        while True:
+            lines = list(islice(f, rows))
+            if len(lines) == 0:
+                break
+
+            raw = np.loadtxt(lines, delimiter=",", ndmin=2)[:, order]
+            dt = raw[:, -1] * 1e-6
+            t = elapsed + np.cumsum(dt)
+            elapsed = float(t[-1])
+
+            yield Chunk(t, dt, convert(raw[:, :-1], offset))
+
+
+class BatchKalman:
+    # Constant-velocity Kalman filter run independently on C channels at once.
+    # Every channel has state [value, rate] and measures only the value.
+
+    # Shape (C, 2)
+    x: Optional[np.ndarray]
+    # Shape (C, 2, 2)
+    P: np.ndarray
+    # Measurement noise, shape (C,)
+    R: np.ndarray
+    # Process noise, shape (2, 2)
+    Q: np.ndarray
+
+    def __init__(self, R: np.ndarray, q: float = 1.0):
+        self.R = np.asarray(R, dtype=float)
+        self.x = None
+        self.P = np.tile(np.eye(2), (len(self.R), 1, 1))
+        self.Q = np.eye(2) * q
+
+    # Filter a (N, C) block of measurements, returns the (N, C) filtered values.
+    # State carries over between calls so chunks can be fed one after another.
+    def filter(self, z: np.ndarray, dt: np.ndarray) -> np.ndarray:
+        out = np.empty_like(z, dtype=float)
+        if len(z) == 0:
+            return out
+
+        if self.x is None:
+            self.x = np.column_stack((z[0], np.zeros(z.shape[1])))
+
+        x = self.x
+        P = self.P
+        for i in range(len(z)):
+            d = dt[i]
+            # Predict: x' = F x, P' = F P F^T + Q with F = [[1, dt], [0, 1]]
+            x[:, 0] += d * x[:, 1]
+            p00, p01, p11 = P[:, 0, 0].copy(), P[:, 0, 1].copy(), P[:, 1, 1].copy()
+            P[:, 0, 0] = p00 + 2 * d * p01 + d * d * p11
+            P[:, 0, 1] = P[:, 1, 0] = p01 + d * p11
+            P += self.Q
+
+            # Update with H = [1, 0]
+            S = P[:, 0, 0] + self.R
+            K = P[:, :, 0] / S[:, None]
+            x += K * (z[i] - x[:, 0])[:, None]
+            P -= K[:, :, None] * P[:, None, 0, :]
+
+            out[i] = x[:, 0]
+
+        return out
+
+
+def default_filter() -> BatchKalman:
+    # Noise values carried over from the old filterpy scripts
+    R = np.array([200.0 if name.startswith("acc") else 100.0 for name in SENSOR_COLUMNS])
+    return BatchKalman(R)
+
+
+def filtered(
+    chunks: Iterable[Chunk], kf: Optional[BatchKalman] = None
+) -> Iterator[tuple[Chunk, np.ndarray]]:
+    if kf is None:
+        kf = default_filter()
+    for chunk in chunks:
+        yield chunk, kf.filter(chunk.data, chunk.dt)
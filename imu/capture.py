@@ -0,0 +1,161 @@
+# Raw binary capture of IMU notifications.
+#
+# Every notification from the pen is 18 floats (two sensors of accel, gyro and
+# magnetometer readings) followed by the microseconds since the previous reading,
+# 80 bytes in total. Captures store these packets back to back without any parsing
+# so the BLE callback only has to copy bytes, and convert to the CSV layout later.
+# Usage: python -m imu.capture <capture.bin> <points.csv>
+from mmap import mmap
+from struct import Struct
+from typing import Optional, TextIO
+import os
+import sys
+
+import numpy as np
+
+from .analysis import COLUMNS
+
+PACKET = Struct("=18fQ")
+PACKET_SIZE = PACKET.size
+# Same layout as PACKET, for reading whole captures at once
+DTYPE = np.dtype([("sensors", "<f4", (18,)), ("delay", "<u8")])
+
+assert PACKET_SIZE == DTYPE.itemsize == 80
+
+
+class PacketBuffer:
+    file: str
+    fd: int
+    mm: Optional[mmap]
+    # Number of packets that fit in the file before it needs to grow
+    capacity: int
+    count: int
+    # Packets that weren't the right size and were thrown away
+    bad: int
+
+    def __init__(self, file: str, capacity: int = 1 << 16):
+        self.file = file
+        self.fd = os.open(file, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.mm = None
+        self.capacity = 0
+        self.count = 0
+        self.bad = 0
+        self.grow(capacity)
+
+    def grow(self, capacity: int):
+        if self.mm is not None:
+            self.mm.close()
+        os.ftruncate(self.fd, capacity * PACKET_SIZE)
+        self.mm = mmap(self.fd, capacity * PACKET_SIZE)
+        self.capacity = capacity
+
+    # Called from the BLE callback, so keep this cheap
+    def append(self, data: bytes):
+        if len(data) != PACKET_SIZE:
+            self.bad += 1
+            return
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+        off = self.count * PACKET_SIZE
+        self.mm[off : off + PACKET_SIZE] = data  # type: ignore
+        self.count += 1
+
+    def latest(self) -> Optional[tuple]:
+        if self.count == 0 or self.mm is None:
+            return None
+        return PACKET.unpack_from(self.mm, (self.count - 1) * PACKET_SIZE)
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+        # Chop off the preallocated space that wasn't used
+        os.ftruncate(self.fd, self.count * PACKET_SIZE)
+        os.close(self.fd)
+
+    def __enter__(self) -> "PacketBuffer":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class CsvFile:
+    # Same interface as PacketBuffer, but writes the points.csv layout directly
+    f: TextIO
+    last: Optional[tuple]
+    bad: int
+
+    def __init__(self, file: str):
+        self.f = open(file, "w")
+        self.f.write(",".join(COLUMNS) + "\n")
+        self.last = None
+        self.bad = 0
+
+    def append(self, data: bytes):
+        if len(data) != PACKET_SIZE:
+            self.bad += 1
+            return
+        self.last = PACKET.unpack(data)
+        self.f.write(",".join(map(str, self.last)) + "\n")
+
+    def latest(self) -> Optional[tuple]:
+        return self.last
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self) -> "CsvFile":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def format_packet(values: tuple) -> str:
+    (
+        accx1, accy1, accz1, gyrx1, gyry1, gyrz1, magx1, magy1, magz1,
+        accx2, accy2, accz2, gyrx2, gyry2, gyrz2, magx2, magy2, magz2,
+        micros,
+    ) = values  # fmt: skip
+    return (
+        f"--- sensor 1 ---\n"
+        f"accel: ({accx1:>25}, {accy1:>25}, {accz1:>25})\n"
+        f"gyro: ({gyrx1:>25}, {gyry1:>25}, {gyrz1:>25})\n"
+        f"magnet: ({magx1:>25}, {magy1:>25}, {magz1:>25})\n"
+        f"--- sensor 2 ---\n"
+        f"accel: ({accx2:>25}, {accy2:>25}, {accz2:>25})\n"
+        f"gyro: ({gyrx2:>25}, {gyry2:>25}, {gyrz2:>25})\n"
+        f"magnet: ({magx2:>25}, {magy2:>25}, {magz2:>25})\n"
+        f"delay: {micros:>25} us"
+    )
+
+
+def read_packets(file: str) -> np.ndarray:
+    # Memory mapped, so this doesn't read the whole file up front
+    if os.path.getsize(file) == 0:
+        return np.empty(0, dtype=DTYPE)
+    return np.memmap(file, dtype=DTYPE, mode="r")
+
+
+def to_csv(capture: str, csv: str, rows: int = 1 << 16) -> int:
+    packets = read_packets(capture)
+    # %.9g round trips float32 exactly
+    fmt = ["%.9g"] * 18 + ["%d"]
+    with open(csv, "w") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for start in range(0, len(packets), rows):
+            block = packets[start : start + rows]
+            table = np.column_stack((block["sensors"], block["delay"]))
+            np.savetxt(f, table, fmt=fmt, delimiter=",")
+    return len(packets)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m imu.capture <capture.bin> <points.csv>")
+        sys.exit(1)
+    n = to_csv(sys.argv[1], sys.argv[2])
+    print(f"Converted {n} packets")
@@ -0,0 +1,364 @@
+# Long running IMU collection over BLE.
+#
+# Notifications are pushed onto a bounded asyncio.Queue by the BLE callback and
+# written to disk by a separate task, so a slow disk never stalls the callback.
+# The collector reconnects whenever the pen drops off and runs until it's told to
+# stop (SIGINT / SIGTERM) or the optional duration runs out.
+#
+# A fake backend replays recorded captures so throughput and reconnect handling
+# can be checked without the pen:
+# Usage: python -m imu.collector <capture.bin> [disconnect_every]
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from struct import Struct
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING, Callable, Optional, Protocol, Sequence
+from time import perf_counter
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+import numpy as np
+
+from .capture import PACKET_SIZE, PacketBuffer, read_packets
+
+SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
+IMU_UUID = "22222222-1111-7688-b7f5-ea07361b26a8"
+
+# The micros field sits after the 18 floats
+DELAY = Struct("=Q")
+DELAY_OFFSET = 18 * 4
+
+if TYPE_CHECKING:
+    from bleak import BleakClient
+
+log = logging.getLogger(__name__)
+
+OnPacket = Callable[[bytes], None]
+
+
+class Sink(Protocol):
+    def append(self, data: bytes): ...
+
+    def close(self): ...
+
+
+class Backend(ABC):
+    # Connect to the pen. Raises EOFError if there's nothing left to connect to
+    # (only fake backends run out), anything else is retried.
+    @abstractmethod
+    async def connect(self):
+        pass
+
+    @abstractmethod
+    async def start(self, on_packet: OnPacket):
+        pass
+
+    # Returns once the connection is lost
+    @abstractmethod
+    async def wait_disconnect(self):
+        pass
+
+    @abstractmethod
+    async def disconnect(self):
+        pass
+
+
+class BleakBackend(Backend):
+    address: Optional[str]
+    timeout: float
+    client: Optional["BleakClient"]
+    lost: asyncio.Event
+
+    def __init__(self, address: Optional[str] = None, timeout: float = 10.0):
+        self.address = address
+        self.timeout = timeout
+        self.client = None
+        self.lost = asyncio.Event()
+
+    async def connect(self):
+        from bleak import BleakClient, BleakScanner
+
+        if self.address is not None:
+            device = await BleakScanner.find_device_by_address(
+                self.address, timeout=self.timeout
+            )
+        else:
+            device = await BleakScanner.find_device_by_filter(
+                lambda _, adv: SERVICE_UUID in adv.service_uuids,
+                timeout=self.timeout,
+            )
+        if device is None:
+            raise ConnectionError("Pen not found")
+
+        log.info(f"Found device {device}")
+        self.lost.clear()
+        self.client = BleakClient(device, disconnected_callback=self.on_lost)
+        await self.client.connect()
+
+    def on_lost(self, _):
+        self.lost.set()
+
+    async def start(self, on_packet: OnPacket):
+        assert self.client is not None
+        await self.client.start_notify(IMU_UUID, lambda _, data: on_packet(data))
+
+    async def wait_disconnect(self):
+        await self.lost.wait()
+
+    async def disconnect(self):
+        if self.client is not None and self.client.is_connected:
+            await self.client.disconnect()
+        self.client = None
+
+
+class FakeBackend(Backend):
+    # Feeds recorded packets to the collector like the pen would.
+    packets: Sequence[bytes]
+    # Packets per second, or None to go as fast as possible
+    rate: Optional[float]
+    # Simulate the pen dropping off after this many packets
+    disconnect_every: Optional[int]
+    pos: int
+    lost: asyncio.Event
+    feeder: Optional[asyncio.Task]
+    connects: int
+
+    def __init__(
+        self,
+        packets: Sequence[bytes],
+        rate: Optional[float] = None,
+        disconnect_every: Optional[int] = None,
+    ):
+        self.packets = packets
+        self.rate = rate
+        self.disconnect_every = disconnect_every
+        self.pos = 0
+        self.lost = asyncio.Event()
+        self.feeder = None
+        self.connects = 0
+
+    @staticmethod
+    def from_capture(file: str, **kwargs) -> "FakeBackend":
+        packets = read_packets(file)
+        return FakeBackend([p.tobytes() for p in packets], **kwargs)
+
+    async def connect(self):
+        if self.pos >= len(self.packets):
+            raise EOFError("No more recorded packets")
+        self.lost.clear()
+        self.connects += 1
+
+    async def start(self, on_packet: OnPacket):
+        self.feeder = asyncio.create_task(self.feed(on_packet))
+
+    async def feed(self, on_packet: OnPacket):
+        sent = 0
+        while self.pos < len(self.packets):
+            on_packet(self.packets[self.pos])
+            self.pos += 1
+            sent += 1
+            if self.disconnect_every is not None and sent >= self.disconnect_every:
+                break
+            if self.rate is not None:
+                await asyncio.sleep(1 / self.rate)
+            elif sent % 64 == 0:
+                # Let the writer run every once in a while
+                await asyncio.sleep(0)
+        self.lost.set()
+
+    async def wait_disconnect(self):
+        await self.lost.wait()
+
+    async def disconnect(self):
+        if self.feeder is not None:
+            self.feeder.cancel()
+            self.feeder = None
+
+
+@dataclass
+class Stats:
+    received: int = 0
+    written: int = 0
+    # Thrown away because the writer couldn't keep up
+    dropped: int = 0
+    # Packets whose delay field was much longer than the nominal interval
+    late: int = 0
+    # Readings the pen would have taken during those long delays
+    missed: int = 0
+    reconnects: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"received {self.received}, written {self.written}, dropped {self.dropped}, "
+            f"late {self.late} (~{self.missed} readings missed), "
+            f"reconnects {self.reconnects}"
+        )
+
+
+class Collector:
+    backend: Backend
+    sink: Sink
+    queue: asyncio.Queue[Optional[bytes]]
+    stats: Stats
+    # Delay between readings (us). Estimated from the data if not given.
+    nominal: Optional[float]
+    fixed_nominal: bool
+    # The estimate starts from the median of this many delays, so one odd packet
+    # at the start (the first one after connecting often is) can't skew it
+    seed_count: int
+    seed: list[float]
+    late_factor: float
+    stop: asyncio.Event
+    # Whether we've been connected before, to tell connects and reconnects apart
+    connected: bool
+
+    def __init__(
+        self,
+        backend: Backend,
+        sink: Sink,
+        queue_size: int = 4096,
+        nominal: Optional[float] = None,
+        late_factor: float = 1.5,
+        seed_count: int = 16,
+    ):
+        self.backend = backend
+        self.sink = sink
+        self.queue = asyncio.Queue(queue_size)
+        self.stats = Stats()
+        self.nominal = nominal
+        self.fixed_nominal = nominal is not None
+        self.late_factor = late_factor
+        self.seed_count = seed_count
+        self.seed = []
+        self.stop = asyncio.Event()
+        self.connected = False
+
+    # BLE callback, so it only hands the packet off
+    def on_packet(self, data: bytes):
+        self.stats.received += 1
+        try:
+            self.queue.put_nowait(bytes(data))
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+
+    def check_delay(self, data: bytes):
+        if len(data) != PACKET_SIZE:
+            return
+        (delay,) = DELAY.unpack_from(data, DELAY_OFFSET)
+        if self.nominal is None:
+            self.seed.append(float(delay))
+            if len(self.seed) < self.seed_count:
+                return
+            self.nominal = float(np.median(self.seed))
+            # Now that there's something to compare them to
+            for delay in self.seed:
+                self.count_delay(delay)
+            self.seed.clear()
+            return
+        self.count_delay(delay)
+
+    def count_delay(self, delay: float):
+        assert self.nominal is not None
+        if delay > self.late_factor * self.nominal:
+            self.stats.late += 1
+            self.stats.missed += max(round(delay / self.nominal) - 1, 0)
+        elif not self.fixed_nominal:
+            # Slow moving average of the on-time delays
+            self.nominal += (delay - self.nominal) * 0.01
+
+    async def writer(self):
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                break
+            self.check_delay(data)
+            self.sink.append(data)
+            self.stats.written += 1
+
+    async def session(self) -> bool:
+        # Returns False when the backend has nothing left to connect to
+        backoff = 0.5
+        while not self.stop.is_set():
+            try:
+                await self.backend.connect()
+                await self.backend.start(self.on_packet)
+                if self.connected:
+                    self.stats.reconnects += 1
+                self.connected = True
+                break
+            except EOFError:
+                return False
+            except Exception as e:
+                log.warning(f"Couldn't connect ({e}), retrying in {backoff}s")
+                # connect may have gone through before start failed
+                try:
+                    await self.backend.disconnect()
+                except Exception as e:
+                    log.warning(f"Couldn't disconnect ({e})")
+                try:
+                    await asyncio.wait_for(self.stop.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 5.0)
+
+        lost = asyncio.create_task(self.backend.wait_disconnect())
+        stop = asyncio.create_task(self.stop.wait())
+        await asyncio.wait((lost, stop), return_when=asyncio.FIRST_COMPLETED)
+        lost.cancel()
+        stop.cancel()
+        await self.backend.disconnect()
+        return True
+
+    async def run(self, duration: Optional[float] = None) -> Stats:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not on the main thread
+                pass
+        if duration is not None:
+            loop.call_later(duration, self.stop.set)
+
+        writer = asyncio.create_task(self.writer())
+        try:
+            while not self.stop.is_set():
+                if not await self.session():
+                    break
+                if not self.stop.is_set():
+                    log.info(f"Disconnected, reconnecting ({self.stats})")
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            # Flush whatever is still queued
+            await self.queue.put(None)
+            await writer
+            self.sink.close()
+
+        return self.stats
+
+
+async def replay(file: str, disconnect_every: Optional[int]):
+    backend = FakeBackend.from_capture(file, disconnect_every=disconnect_every)
+    with TemporaryDirectory() as tmp:
+        sink = PacketBuffer(os.path.join(tmp, "replay.bin"))
+        start = perf_counter()
+        stats = await Collector(backend, sink).run()
+        elapsed = perf_counter() - start
+    print(stats)
+    print(f"{stats.written / elapsed:.0f} packets/s over {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Usage: python -m imu.collector <capture.bin> [disconnect_every]")
+        sys.exit(1)
+    every = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    asyncio.run(replay(sys.argv[1], every))
@@ -1,41 +1,68 @@
+# Records IMU data from the pen over BLE until interrupted.
+# Usage: python -m imu.host [-b] [-o FILE] [-d SECONDS] [-a ADDRESS]
+from argparse import ArgumentParser
+from typing import Callable, Optional
 import asyncio
-from bleak import BleakScanner, BleakClient
-from bleak.backends.characteristic import BleakGATTCharacteristic
-from struct import unpack
-from typing import Callable
+import logging
 
-SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
-IMU_UUID = "22222222-1111-7688-b7f5-ea07361b26a8"
+from .capture import CsvFile, PacketBuffer, format_packet
+from .collector import BleakBackend, Collector
 
-async def main():
-    devices = await BleakScanner.discover(
-        service_uuids=[SERVICE_UUID],
+
+async def display(latest: Callable[[], Optional[tuple]], hz: float = 4):
+    # Printing is slow enough to drop samples at high notify rates, so it runs
+    # on its own task at a fixed rate instead of in the BLE callback.
+    while True:
+        await asyncio.sleep(1 / hz)
+        values = latest()
+        if values is not None:
+            print(f"\033[2J\r{format_packet(values)}", end="", flush=True)
+
+
+async def main(output: str, binary: bool, duration: Optional[float], address: Optional[str]):
+    sink = PacketBuffer(output) if binary else CsvFile(output)
+    collector = Collector(BleakBackend(address), sink)
+
+    printer = asyncio.create_task(display(sink.latest))
+    try:
+        stats = await collector.run(duration)
+    finally:
+        printer.cancel()
+
+    print(f"\n{stats}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(prog="imu_host", description="Record IMU data from the pen")
+    parser.add_argument(
+        "-b",
+        "--binary",
+        action="store_true",
+        default=False,
+        help="Capture raw packets to a binary file instead of CSV. "
+        "Convert them later with python -m imu.capture.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="File to write to (points.csv, or points.bin with --binary).",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=None,
+        help="Stop after this many seconds instead of waiting for Ctrl-C.",
     )
-    device = devices[0]
-    print(f'Found Device {device}')
-
-    with open('points.csv', 'w+') as f:
-        f.write('accx1,accy1,accz1,gyrx1,gyry1,gyrz1,magx1,magy1,magz1,accx2,accy2,accz2,gyrx2,gyry2,gyrz2,magx2,magy2,magz2,delay\n')
-    
-        def on_notify(chr: BleakGATTCharacteristic, data: bytearray):
-            try:
-                accx1, accy1, accz1, gyrx1, gyry1, gyrz1, magx1, magy1, magz1, \
-                accx2, accy2, accz2, gyrx2, gyry2, gyrz2, magx2, magy2, magz2, micros = unpack('=ffffffffffffffffffQ', data)
-                print(f'\033[2J\r', end='')
-                print(f'--- sensor 1 ---\n', end='')
-                print(f'accel: ({accx1:>25}, {accy1:>25}, {accz1:>25})\ngyro: ({gyrx1:>25}, {gyry1:>25}, {gyrz1:>25})\nmagnet: ({magx1:>25}, {magy1:>25}, {magz1:>25})\n', end='')
-                print(f'--- sensor 2 ---\n', end='')
-                print(f'accel: ({accx2:>25}, {accy2:>25}, {accz2:>25})\ngyro: ({gyrx2:>25}, {gyry2:>25}, {gyrz2:>25})\nmagnet: ({magx2:>25}, {magy2:>25}, {magz2:>25})\n', end='')
-                print(f'delay: {micros:>25} us', end='')
-                f.write(f'{accx1},{accy1},{accz1},{gyrx1},{gyry1},{gyrz1},{magx1},{magy1},{magz1},{accx2},{accy2},{accz2},{gyrx2},{gyry2},{gyrz2},{magx2},{magy2},{magz2},{micros}\n')
-            except Exception as ex:
-                print(f'Failed to unpack data: {ex}')
-    
-        async with BleakClient(device) as client:
-            # await client.start_notify(ACCEL_UUID, make_printer('accel'))
-            await client.start_notify(IMU_UUID, on_notify)
-            await asyncio.sleep(35)
-            # await client.stop_notify(ACCEL_UUID)
-            await client.stop_notify(IMU_UUID)
-
-asyncio.run(main())
+    parser.add_argument(
+        "-a",
+        "--address",
+        default=None,
+        help="Connect to this pen instead of the first one found.",
+    )
+    args = parser.parse_args()
+    output = args.output or ("points.bin" if args.binary else "points.csv")
+
+    asyncio.run(main(output, args.binary, args.duration, args.address))
@@ -0,0 +1,353 @@
+# Incremental recognition of live handwriting.
+#
+# Strokes are grouped into spatial clusters (roughly one line or expression each),
+# and only clusters whose strokes changed since the last pass are sent to the
+# recognizer again. Everything else is served from the cache, so the cost of a pass
+# depends on what was just written instead of on the size of the board.
+# The clusters are kept up to date the same way: a new or extended stroke is only
+# checked against the clusters its box comes near, and a removed stroke only splits
+# the cluster it was in.
+# Live, the --ocr option feeds the pen-down strokes in (realsense/recognize.py).
+# Usage: python -m ocr.incremental <calibration> <recording> [--stub]
+# (replays the recording stroke by stroke, with a pass after every stroke)
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+# Takes a rendered cluster and returns the recognized text (LaTeX for formulas)
+Recognizer = Callable[[Image.Image], str]
+
+# Cache key for a cluster: the (id, version) of every stroke in it
+ClusterKey = tuple[tuple[int, int], ...]
+
+
+def pix2text_recognizer() -> Recognizer:
+    # Imported here because loading the models takes a while
+    from pix2text import Pix2Text
+
+    p2t = Pix2Text.from_config()
+
+    def recognize(img: Image.Image) -> str:
+        return p2t.recognize_formula(img)
+
+    return recognize
+
+
+@dataclass
+class Stroke:
+    # Shape (N, 2), in the same units as the projected plane (roughly [0, 1])
+    pts: np.ndarray
+    # Bumped every time the stroke changes so cached results get invalidated
+    version: int = 0
+
+
+@dataclass
+class Cluster:
+    key: ClusterKey
+    # (xmin, ymin, xmax, ymax)
+    bbox: tuple[float, float, float, float]
+    text: str
+
+
+class IncrementalRecognizer:
+    strokes: dict[int, Stroke]
+    # Bounding box (xmin, ymin, xmax, ymax) of every stroke, one row per stroke so a
+    # new box can be checked against all of them at once. Rows of strokes without
+    # points or that were removed are NaN, which is never near anything
+    boxes: np.ndarray
+    row: dict[int, int]
+    # Stroke of every row (-1 if free), and the free rows, which new strokes reuse so
+    # erasing doesn't make the scan any longer
+    ids: list[int]
+    free: list[int]
+    # Cluster of every clustered stroke, the strokes in every cluster and its box
+    group: dict[int, int]
+    members: dict[int, list[int]]
+    group_boxes: dict[int, np.ndarray]
+    next_group: int
+    # Strokes added or extended since the last pass, and clusters that lost a stroke
+    dirty: set[int]
+    split: set[int]
+    cache: dict[ClusterKey, str]
+    recognize_fn: Optional[Recognizer]
+    # How far apart (in plane units) strokes can be horizontally / vertically
+    # and still be considered part of the same expression
+    xgap: float
+    ygap: float
+    # Height of the image that a cluster is rendered to
+    height: int
+    next_id: int
+    # Number of clusters sent to the recognizer in the last pass
+    recognized: int
+
+    def __init__(
+        self,
+        recognize: Optional[Recognizer] = None,
+        xgap: float = 0.05,
+        ygap: float = 0.01,
+        height: int = 128,
+    ):
+        self.strokes = {}
+        self.boxes = np.full((64, 4), np.nan)
+        self.row = {}
+        self.ids = []
+        self.free = []
+        self.group = {}
+        self.members = {}
+        self.group_boxes = {}
+        self.next_group = 0
+        self.dirty = set()
+        self.split = set()
+        self.cache = {}
+        self.recognize_fn = recognize
+        self.xgap = xgap
+        self.ygap = ygap
+        self.height = height
+        self.next_id = 0
+        self.recognized = 0
+
+    def add_stroke(self, pts: np.ndarray) -> int:
+        id = self.next_id
+        self.next_id += 1
+        self.strokes[id] = Stroke(np.asarray(pts, dtype=float).reshape(-1, 2))
+        self.update_box(id, self.strokes[id].pts)
+        return id
+
+    # For strokes that are still being drawn
+    def extend_stroke(self, id: int, pts: np.ndarray):
+        stroke = self.strokes[id]
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        stroke.pts = np.concatenate((stroke.pts, pts))
+        stroke.version += 1
+        self.update_box(id, pts)
+
+    def remove_stroke(self, id: int):
+        del self.strokes[id]
+        row = self.row.pop(id)
+        self.boxes[row] = np.nan
+        self.ids[row] = -1
+        self.free.append(row)
+        self.dirty.discard(id)
+        gid = self.group.pop(id, None)
+        if gid is not None:
+            self.members[gid].remove(id)
+            self.split.add(gid)
+
+    def clear(self):
+        self.strokes.clear()
+        self.boxes = np.full((64, 4), np.nan)
+        self.row.clear()
+        self.ids.clear()
+        self.free.clear()
+        self.group.clear()
+        self.members.clear()
+        self.group_boxes.clear()
+        self.dirty.clear()
+        self.split.clear()
+        self.cache.clear()
+
+    def update_box(self, id: int, pts: np.ndarray):
+        # Grows the stroke's box by the new points
+        if id not in self.row:
+            if len(self.free) > 0:
+                row = self.free.pop()
+                self.ids[row] = id
+            else:
+                if len(self.ids) == len(self.boxes):
+                    grown = np.full((2 * len(self.boxes), 4), np.nan)
+                    grown[: len(self.boxes)] = self.boxes
+                    self.boxes = grown
+                row = len(self.ids)
+                self.ids.append(id)
+            self.row[id] = row
+        if len(pts) == 0:
+            return
+        box = self.boxes[self.row[id]]
+        # fmin/fmax so the NaNs of a stroke that had no points yet are ignored
+        box[:2] = np.fmin(box[:2], pts.min(axis=0))
+        box[2:] = np.fmax(box[2:], pts.max(axis=0))
+        self.dirty.add(id)
+
+    def near(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # Whether box a overlaps each of the (N, 4) boxes b once padded by the gaps
+        return (
+            (a[0] - self.xgap <= b[..., 2])
+            & (b[..., 0] - self.xgap <= a[2])
+            & (a[1] - self.ygap <= b[..., 3])
+            & (b[..., 1] - self.ygap <= a[3])
+        )
+
+    def insert(self, id: int):
+        # Puts a new or grown stroke in a cluster, merging every cluster that has a
+        # stroke near it. Strokes that weren't near before still aren't, so that's
+        # all that can change
+        box = self.boxes[self.row[id]]
+        hits = np.flatnonzero(self.near(box, self.boxes[: len(self.ids)]))
+        # Strokes that are dirty too haven't been placed yet, they'll find this one
+        groups = {self.group[self.ids[r]] for r in hits if self.ids[r] in self.group}
+        if not groups:
+            gid = self.next_group
+            self.next_group += 1
+            self.members[gid] = []
+            self.group_boxes[gid] = box.copy()
+        else:
+            # The biggest cluster absorbs the others so strokes are rarely relabeled
+            gid = max(groups, key=lambda g: len(self.members[g]))
+        if id not in self.group:
+            # Otherwise its cluster is one of the hits and gets merged below
+            self.group[id] = gid
+            self.members[gid].append(id)
+        gbox = self.group_boxes[gid]
+        gbox[:2] = np.minimum(gbox[:2], box[:2])
+        gbox[2:] = np.maximum(gbox[2:], box[2:])
+
+        for other in groups - {gid}:
+            ids = self.members.pop(other)
+            for i in ids:
+                self.group[i] = gid
+            self.members[gid].extend(ids)
+            obox = self.group_boxes.pop(other)
+            gbox[:2] = np.minimum(gbox[:2], obox[:2])
+            gbox[2:] = np.maximum(gbox[2:], obox[2:])
+
+    def update(self):
+        # Brings the clusters up to date with the strokes
+        for gid in self.split:
+            # Its strokes go back in one by one, which splits it if need be
+            for id in self.members.pop(gid):
+                del self.group[id]
+                self.dirty.add(id)
+            del self.group_boxes[gid]
+        self.split.clear()
+        for id in sorted(self.dirty):
+            self.insert(id)
+        self.dirty.clear()
+
+    def clusters(self) -> list[list[int]]:
+        self.update()
+
+        # Reading order: clusters whose heights overlap by at least half make a line,
+        # lines go top to bottom (plane y goes up) and left to right within a line
+        lines: list[tuple[float, float, list[int]]] = []
+        for gid in sorted(self.members, key=lambda g: -self.group_boxes[g][3]):
+            _, ymin, _, ymax = self.group_boxes[gid]
+            for i, (lo, hi, line) in enumerate(lines):
+                overlap = min(hi, ymax) - max(lo, ymin)
+                if overlap >= 0.5 * min(hi - lo, ymax - ymin):
+                    line.append(gid)
+                    lines[i] = (min(lo, ymin), max(hi, ymax), line)
+                    break
+            else:
+                lines.append((ymin, ymax, [gid]))
+
+        out = []
+        for _, _, line in lines:
+            line.sort(key=lambda g: self.group_boxes[g][0])
+            out.extend(list(self.members[g]) for g in line)
+        return out
+
+    def render(self, ids: list[int]) -> Image.Image:
+        pts = np.concatenate([self.strokes[id].pts for id in ids])
+        lo = pts.min(axis=0)
+        span = np.maximum(pts.max(axis=0) - lo, 1e-6)
+        pad = self.height // 8
+        # Flat clusters (minus signs etc.) get scaled by width instead of height
+        scale = (self.height - 2 * pad) / max(span[1], span[0] / 4)
+        width = int(span[0] * scale) + 2 * pad
+
+        img = Image.new("L", (width, self.height), 255)
+        draw = ImageDraw.Draw(img)
+        for id in ids:
+            s = (self.strokes[id].pts - lo) * scale + pad
+            # The plane has y going up, images have y going down
+            s[:, 1] = self.height - s[:, 1]
+            if len(s) == 1:
+                x, y = s[0]
+                draw.ellipse((x - 2, y - 2, x + 2, y + 2), fill=0)
+            else:
+                draw.line([tuple(p) for p in s], fill=0, width=3, joint="curve")
+
+        return img
+
+    def recognize(self) -> list[Cluster]:
+        if self.recognize_fn is None:
+            self.recognize_fn = pix2text_recognizer()
+
+        out: list[Cluster] = []
+        cache: dict[ClusterKey, str] = {}
+        self.recognized = 0
+
+        for ids in self.clusters():
+            key = tuple((id, self.strokes[id].version) for id in sorted(ids))
+            text = self.cache.get(key)
+            if text is None:
+                text = self.recognize_fn(self.render(ids))
+                self.recognized += 1
+            cache[key] = text
+
+            xmin, ymin, xmax, ymax = self.group_boxes[self.group[ids[0]]]
+            out.append(
+                Cluster(key, (float(xmin), float(ymin), float(xmax), float(ymax)), text)
+            )
+
+        # Only keep results for clusters that still exist
+        self.cache = cache
+        return out
+
+
+def replay(calfile: str, recfile: str, stub: bool):
+    import time
+
+    from realsense.batch import pen_down, strokes
+    from realsense.calibration import load_calibration, project, read_recording
+
+    cal = load_calibration(calfile)
+    if cal is None:
+        raise ValueError(f"Couldn't calibrate from {calfile}")
+    t, xyz = read_recording(recfile)
+    proj = project(xyz, *cal)
+    runs = strokes(pen_down(proj[:, 2], t))
+
+    # The stub only reports the size of what it was given, to time everything else
+    r = IncrementalRecognizer(
+        (lambda img: f"[{img.width}x{img.height}]") if stub else None
+    )
+    times = []
+    recognized = 0
+    # What re-recognizing every cluster on every pass would have cost
+    full = 0
+    for a, b in runs:
+        r.add_stroke(proj[a:b, :2])
+        start = time.perf_counter()
+        clusters = r.recognize()
+        times.append(time.perf_counter() - start)
+        recognized += r.recognized
+        full += len(clusters)
+
+    ms = 1000 * np.array(times)
+    print(
+        f"{len(runs)} strokes, {len(r.members)} clusters: {recognized} recognized "
+        f"instead of {full}, {ms.mean():.1f} ms per pass on average (max {ms.max():.1f} ms)"
+    )
+    for c in r.recognize():
+        print(c.text)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        prog="ocr.incremental", description="Recognize a recording stroke by stroke"
+    )
+    parser.add_argument("calibration")
+    parser.add_argument("recording")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        default=False,
+        help="Don't load pix2text, only time the clustering and rendering.",
+    )
+    args = parser.parse_args()
+    replay(args.calibration, args.recording, args.stub)
@@ -0,0 +1,240 @@
+# Headless batch processing of recordings.
+# Each recording is projected onto the calibrated plane, split into strokes, rendered
+# to a PNG and exported, with the files spread over a process pool.
+# Usage: python -m realsense -cf <calibration> batch <recordings or dirs or globs> [-o DIR]
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+import csv
+import glob
+import logging
+import os
+import time
+
+import numpy as np
+
+from .calibration import load_calibration, project, read_recording
+from .codec import EXTENSION
+from .pen import PenState
+from .tip import PenTip
+
+log = logging.getLogger(__name__)
+
+SUMMARY_KEYS = [
+    "file",
+    # What its outputs are called in the output directory
+    "name",
+    "samples",
+    "duration",
+    "strokes",
+    "ink_time",
+    "ink_length",
+    "mean_speed",
+    "xmin",
+    "xmax",
+    "ymin",
+    "ymax",
+    "seconds",
+    # Why it couldn't be processed, if it couldn't
+    "error",
+]
+
+
+def expand(inputs: list[str], exclude: Optional[str] = None) -> list[str]:
+    # Directories mean every recording in them; globs are expanded here so they work on
+    # shells that don't (Windows)
+    files = []
+    for spec in inputs:
+        if os.path.isdir(spec):
+            csvs = glob.glob(os.path.join(spec, "*.csv"))
+            # A .zrec next to the CSV it was compressed from is the same recording
+            stems = {os.path.splitext(f)[0] for f in csvs}
+            zrecs = [
+                f
+                for f in glob.glob(os.path.join(spec, "*" + EXTENSION))
+                if os.path.splitext(f)[0] not in stems
+            ]
+            files.extend(sorted(csvs + zrecs))
+        elif glob.has_magic(spec):
+            files.extend(sorted(glob.glob(spec)))
+        else:
+            files.append(spec)
+    # The calibration often lives next to the recordings
+    # (missing files are left for the caller to report)
+    if exclude is not None:
+        files = [
+            f for f in files if not (os.path.exists(f) and os.path.samefile(f, exclude))
+        ]
+    return list(dict.fromkeys(files))
+
+
+def output_names(files: list[str]) -> dict[str, str]:
+    # Unique names for the outputs of each recording: the file name without its
+    # extension, unless another recording has the same one (from another directory, or
+    # in another format), then with its parent directory and extension too
+    stems = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    counts: dict[str, int] = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    names = {f: stem for f, stem in zip(files, stems) if counts[stem] == 1}
+    taken = set(names.values())
+    for f, stem in zip(files, stems):
+        if counts[stem] == 1:
+            continue
+        parent = os.path.basename(os.path.dirname(os.path.abspath(f)))
+        name = f"{parent}_{os.path.basename(f).replace('.', '_')}"
+        # Numbered if even that is taken
+        unique, n = name, 1
+        while unique in taken:
+            n += 1
+            unique = f"{name}-{n}"
+        taken.add(unique)
+        names[f] = unique
+    return names
+
+
+def pen_down(z: np.ndarray, t: np.ndarray) -> np.ndarray:
+    # Same pen state the live projection would have had
+    pen = PenState()
+    return np.fromiter(
+        (pen.update(float(zi), float(ti)) for zi, ti in zip(z, t)), dtype=bool, count=len(z)
+    )
+
+
+def strokes(pressed: np.ndarray) -> list[tuple[int, int]]:
+    # [start, end) index ranges where the pen is down
+    edges = np.diff(pressed.astype(np.int8), prepend=0, append=0)
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def render(
+    file: str, name: str, proj: np.ndarray, pressed: np.ndarray, runs: list[tuple[int, int]]
+):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # Without pyplot, so no GUI backend gets involved
+    fig = Figure(figsize=(8, 4.5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(proj[~pressed, 0], proj[~pressed, 1], ".", color="blue", alpha=0.1, ms=2)
+    for a, b in runs:
+        ax.plot(proj[a:b, 0], proj[a:b, 1], color="red", lw=2)
+    ax.set_aspect("equal", adjustable="datalim")
+    ax.set_title(f"{name} ({len(runs)} strokes)")
+    fig.savefig(file, dpi=100)
+
+
+def process(
+    file: str,
+    basis: np.ndarray,
+    origin: np.ndarray,
+    outdir: str,
+    png: bool,
+    tip: Optional[PenTip] = None,
+    ink: tuple[str, ...] = (),
+    name: Optional[str] = None,
+) -> dict:
+    # name is what the outputs are called, the file name without extension by default
+    start = time.perf_counter()
+    t, xyz = read_recording(file, tip)
+    proj = project(xyz, basis, origin)
+    pressed = pen_down(proj[:, 2], t)
+    runs = strokes(pressed)
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(file))[0]
+    np.savetxt(
+        os.path.join(outdir, f"{name}.proj.csv"),
+        np.column_stack((t, proj, pressed)),
+        delimiter=",",
+        header="time,x,y,z,pressed",
+        comments="",
+        fmt=["%.6f", "%.6g", "%.6g", "%.6g", "%d"],
+    )
+    if png:
+        render(os.path.join(outdir, f"{name}.png"), name, proj, pressed, runs)
+    for ext in ink:
+        from .ink import export
+
+        export(os.path.join(outdir, f"{name}.{ext}"), t, proj, pressed, basis)
+
+    ink_time = sum(t[b - 1] - t[a] for a, b in runs)
+    ink_length = sum(
+        np.linalg.norm(np.diff(proj[a:b, :2], axis=0), axis=1).sum() for a, b in runs
+    )
+    ink = proj[pressed] if pressed.any() else proj
+    return {
+        "file": file,
+        "name": name,
+        "samples": len(t),
+        "duration": t[-1] - t[0] if len(t) > 0 else 0.0,
+        "strokes": len(runs),
+        "ink_time": ink_time,
+        "ink_length": ink_length,
+        "mean_speed": ink_length / ink_time if ink_time > 0 else 0.0,
+        "xmin": ink[:, 0].min(),
+        "xmax": ink[:, 0].max(),
+        "ymin": ink[:, 1].min(),
+        "ymax": ink[:, 1].max(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_batch(
+    calfile: str,
+    inputs: list[str],
+    outdir: str = "batch",
+    jobs: Optional[int] = None,
+    png: bool = True,
+    tip: Optional[PenTip] = None,
+    ink: tuple[str, ...] = (),
+) -> list[dict]:
+    start = time.perf_counter()
+    cal = load_calibration(calfile, tip)
+    if cal is None:
+        raise ValueError(f"Couldn't calibrate from {calfile}")
+    basis, origin = cal
+    files = expand(inputs, calfile if os.path.exists(calfile) else None)
+    if len(files) == 0:
+        log.warning("No recordings to process")
+        return []
+    os.makedirs(outdir, exist_ok=True)
+    names = output_names(files)
+
+    jobs = min(jobs or os.cpu_count() or 1, len(files))
+    log.info(f"Processing {len(files)} recordings with {jobs} workers")
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(process, f, basis, origin, outdir, png, tip, ink, names[f]): f
+            for f in files
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            file = futures[future]
+            try:
+                res = future.result()
+            except Exception as e:
+                log.error(f"[{i}/{len(files)}] {file}: {e}")
+                results.append({"file": file, "name": names[file], "error": str(e)})
+                continue
+            results.append(res)
+            log.info(
+                f"[{i}/{len(files)}] {file}: {res['strokes']} strokes, "
+                f"{res['samples']} samples in {res['seconds'] * 1000:.0f} ms"
+            )
+
+    results.sort(key=lambda r: r["file"])
+    with open(os.path.join(outdir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_KEYS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    elapsed = time.perf_counter() - start
+    done = [r for r in results if "error" not in r]
+    busy = sum(r["seconds"] for r in done)
+    log.info(
+        f"Processed {len(done)} of {len(files)} recordings in {elapsed:.2f}s "
+        f"({busy:.2f}s of work, {len(done) / elapsed:.1f} recordings/s), "
+        f"results in {outdir}"
+    )
+    return results
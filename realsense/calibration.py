@@ -0,0 +1,119 @@
+# Calibration without a plot: finding the corner points in a recording and turning
+# them into the basis of the writing plane.
+from typing import TYPE_CHECKING, Optional
+import logging
+
+import numpy as np
+
+from . import codec
+
+if TYPE_CHECKING:
+    from .tip import PenTip
+
+log = logging.getLogger(__name__)
+
+# Same as DataSource.calibrate_point: the pen has to hold still (std under STABLE on
+# every axis) for WINDOW samples
+WINDOW = 300
+STABLE = 0.03
+
+
+def read_poses(file: str) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the (N,) times and (N, 7) positions + quaternions of a recording CSV or
+    # .zrec file. Recordings from SocketSource have no header, the others do
+    if codec.is_compressed(file):
+        return codec.read(file)
+    with open(file) as f:
+        first = f.readline()
+    skip = 0 if first[:1].isdigit() or first[:1] == "-" else 1
+    data = np.loadtxt(file, delimiter=",", skiprows=skip, usecols=range(1, 9), ndmin=2)
+    return data[:, 0], data[:, 1:8]
+
+
+def read_recording(
+    file: str, tip: Optional["PenTip"] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the (N,) times and (N, 3) positions, of the pen tip if given
+    t, poses = read_poses(file)
+    if tip is None:
+        return t, poses[:, :3]
+    return t, tip.apply_all(poses[:, :3], poses[:, 3:])
+
+
+def find_points(
+    xyz: np.ndarray, count: int = 4, window: int = WINDOW, thresh: float = STABLE
+) -> list[np.ndarray]:
+    # The mean of each window where the pen held still, in order. The next window
+    # only starts after the previous one was found, like the interactive calibration.
+    # The mean and variance of every window come from cumulative sums in one pass,
+    # then only the first stable window after each point has to be looked up.
+    n = len(xyz)
+    if n < window:
+        return []
+    # Centered, so the sums of squares don't lose the small variances to rounding
+    center = xyz.mean(axis=0)
+    d = xyz - center
+    s = np.cumsum(np.vstack((np.zeros(3), d)), axis=0)
+    ss = np.cumsum(np.vstack((np.zeros(3), d * d)), axis=0)
+    # Window i is xyz[i : i + window]
+    mean = (s[window:] - s[:-window]) / window
+    var = (ss[window:] - ss[:-window]) / window - mean * mean
+    stable = np.flatnonzero((var < thresh * thresh).all(axis=1))
+
+    pts: list[np.ndarray] = []
+    start = 0
+    while len(pts) < count:
+        i = np.searchsorted(stable, start)
+        if i == len(stable):
+            break
+        first = stable[i]
+        pts.append(mean[first] + center)
+        start = first + window
+    return pts
+
+
+def plane_basis(pts: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    # When calibrating, the order of points SHOULD be:
+    # - Bottom left corner
+    # - Top left corner
+    # - Bottom right corner
+    # - Top right corner
+    # So y is clearly top left - bot left
+    # and x is clearly bot right - bot left
+    x = pts[2] - pts[0]
+    y = pts[1] - pts[0]
+    xx = np.dot(x, x)
+    xy = np.dot(x, y)
+    plotxy = (xy / xx) * x
+    # "Rectify" the Y axis by calculating the vector rejection of the Y axis from the X
+    y = y - plotxy
+    # Get normal vector
+    z = np.cross(x, y)
+
+    log.info(f"Got x vector {x}, y vector {y}, z vector {z}")
+
+    # Where x, y, z are the columns of the matrix
+    return np.column_stack((x, y, z)), pts[0]
+
+
+def load_points(file: str, tip: Optional["PenTip"] = None) -> Optional[list[np.ndarray]]:
+    # The 4 corners in a calibration recording, None if it doesn't have them all
+    _, xyz = read_recording(file, tip)
+    pts = find_points(xyz)
+    if len(pts) < 4:
+        log.warning(f"Only found {len(pts)} of 4 calibration points in {file}")
+        return None
+    return pts
+
+
+def load_calibration(
+    file: str, tip: Optional["PenTip"] = None
+) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    # Basis and origin from a calibration recording, None if it doesn't have 4 points
+    pts = load_points(file, tip)
+    return None if pts is None else plane_basis(pts)
+
+
+def project(xyz: np.ndarray, basis: np.ndarray, origin: np.ndarray) -> np.ndarray:
+    # Projection.change_basis for a whole (N, 3) array at once
+    return np.linalg.solve(basis, (xyz - origin).T).T
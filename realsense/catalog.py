@@ -0,0 +1,540 @@
+# Catalog of recordings in SQLite, for finding a session without opening every file.
+#
+# Every indexed recording gets a row in `sessions` (camera serial number, tool id, time
+# range, sample count) and, when a calibration is given, one row per stroke with its
+# time range and bounding box in the calibrated plane. Bounding boxes live in an R*Tree
+# and OCR text in an FTS5 table, so lookups by time, region or text only touch the
+# rows that match instead of scanning the catalog.
+# Indexing is incremental: a recording is only read again when its modification time,
+# size or calibration changed, so re-indexing a folder of old sessions is just a stat
+# per file. Recordings are indexed when `record` writes them (with --catalog), or in bulk
+# with the `index` mode. OCR text comes from a `<recording>.txt` next to the recording,
+# or from `Catalog.add_text` (e.g. with clusters from ocr/incremental.py).
+# Usage: python -m realsense -cf <cal> --catalog DB index <recordings or dirs or globs>
+#        python -m realsense --catalog DB search [--after T] [--before T] [--region X0,Y0,X1,Y1] [--text WORDS]
+#        python -m realsense.catalog [sessions] (query speed on a synthetic catalog)
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from . import codec
+from .calibration import load_calibration, project, read_recording
+from .state import csvkeys
+from .tip import PenTip
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FILE = "catalog.db"
+# Bumped when the schema changes, which rebuilds the catalog
+VERSION = 1
+# Stroke times in the R*Tree are in hours, so a session spans about as much time as
+# the board does space and the tree splits strokes by region within a session too
+# (in seconds, time dwarfs the board and region-only queries visit every session)
+HOUR = 3600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    -- What the strokes were found with, so a new calibration reindexes them
+    calibration TEXT NOT NULL,
+    -- Modification time of the OCR text file next to the recording (0 if none)
+    text_mtime INTEGER NOT NULL,
+    sno TEXT,
+    tool TEXT,
+    t0 REAL,
+    t1 REAL,
+    samples INTEGER NOT NULL,
+    strokes INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_t0 ON sessions (t0);
+CREATE INDEX IF NOT EXISTS sessions_t1 ON sessions (t1);
+CREATE TABLE IF NOT EXISTS strokes (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    t0 REAL NOT NULL,
+    t1 REAL NOT NULL,
+    points INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS strokes_session ON strokes (session);
+CREATE INDEX IF NOT EXISTS strokes_t0 ON strokes (t0);
+-- Time too, so region and time narrow down each other. The R*Tree keeps 32-bit floats
+-- (rounded outwards, so epoch times are only good to a few minutes), strokes has the
+-- exact ones
+CREATE VIRTUAL TABLE IF NOT EXISTS stroke_boxes USING rtree (
+    id, xmin, xmax, ymin, ymax, t0, t1
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5 (
+    text, session UNINDEXED, xmin UNINDEXED, ymin UNINDEXED, xmax UNINDEXED, ymax UNINDEXED
+);
+"""
+
+# (xmin, ymin, xmax, ymax) in the calibrated plane
+Box = tuple[float, float, float, float]
+
+
+@dataclass
+class Session:
+    path: str
+    sno: Optional[str]
+    tool: Optional[str]
+    t0: Optional[float]
+    t1: Optional[float]
+    samples: int
+    # None when indexed without a calibration
+    strokes: Optional[int]
+
+
+@dataclass
+class Stroke:
+    path: str
+    t0: float
+    t1: float
+    box: Box
+    points: int
+
+
+def read_ids(file: str) -> tuple[Optional[str], Optional[str]]:
+    # Camera serial number and tool id of the first row
+    if codec.is_compressed(file):
+        for sno, id, _, _ in codec.blocks(file):
+            return sno, id
+        return None, None
+    with open(file, newline="") as f:
+        for row in csv.reader(f):
+            # Skips the header, if any
+            if len(row) == len(csvkeys) and row[0] != csvkeys[0]:
+                return row[0], row[-1]
+    return None, None
+
+
+def calibration_key(
+    basis: Optional[np.ndarray], origin: Optional[np.ndarray], tip: Optional[PenTip]
+) -> str:
+    if basis is None or origin is None:
+        return ""
+    h = hashlib.sha1(np.asarray(basis, dtype=np.float64).tobytes())
+    h.update(np.asarray(origin, dtype=np.float64).tobytes())
+    if tip is not None:
+        h.update(tip.offset.astype(np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def stroke_rows(
+    t: np.ndarray, proj: np.ndarray, pressed: np.ndarray
+) -> list[tuple[float, float, int, float, float, float, float]]:
+    # (t0, t1, points, xmin, ymin, xmax, ymax) of every stroke
+    from .batch import strokes
+
+    runs = strokes(pressed)
+    if len(runs) == 0:
+        return []
+    starts = np.array([a for a, _ in runs])
+    ends = np.array([b for _, b in runs])
+    # All the boxes at once: reduce over the pen-down rows, which are the strokes back
+    # to back
+    down = proj[pressed, :2]
+    offsets = np.r_[0, np.cumsum(ends - starts)[:-1]]
+    lo = np.minimum.reduceat(down, offsets)
+    hi = np.maximum.reduceat(down, offsets)
+    return list(
+        zip(
+            t[starts].tolist(),
+            t[ends - 1].tolist(),
+            (ends - starts).tolist(),
+            lo[:, 0].tolist(),
+            lo[:, 1].tolist(),
+            hi[:, 0].tolist(),
+            hi[:, 1].tolist(),
+        )
+    )
+
+
+def text_file(file: str) -> str:
+    return os.path.splitext(file)[0] + ".txt"
+
+
+def parse_time(value: str) -> float:
+    # Tracker time (seconds since the epoch) or an ISO date / date and time
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def fts_query(text: str) -> str:
+    # Every word has to appear, taken literally (no FTS5 operators)
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class Catalog:
+    file: str
+    db: sqlite3.Connection
+
+    def __init__(self, file: str = DEFAULT_FILE):
+        self.file = file
+        self.db = sqlite3.connect(file)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, VERSION):
+            log.warning(f"Rebuilding {file}, it's from another version of the catalog")
+            for table in ("sessions", "strokes", "stroke_boxes", "texts"):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+        self.db.executescript(SCHEMA)
+        self.db.execute(f"PRAGMA user_version = {VERSION}")
+        self.db.commit()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def index(
+        self,
+        file: str,
+        basis: Optional[np.ndarray] = None,
+        origin: Optional[np.ndarray] = None,
+        tip: Optional[PenTip] = None,
+    ) -> bool:
+        # Adds or updates a recording, True if it had to be read. Strokes are only
+        # found with a calibration
+        path = os.path.abspath(file)
+        st = os.stat(path)
+        txt = text_file(path)
+        text_mtime = os.stat(txt).st_mtime_ns if os.path.exists(txt) else 0
+        key = calibration_key(basis, origin, tip)
+        row = self.db.execute(
+            "SELECT mtime, size, calibration, text_mtime FROM sessions WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row == (st.st_mtime_ns, st.st_size, key, text_mtime):
+            return False
+
+        t, xyz = read_recording(path, tip)
+        sno, tool = read_ids(path)
+        runs = None
+        if basis is not None and origin is not None:
+            from .batch import pen_down
+
+            proj = project(xyz, basis, origin)
+            runs = stroke_rows(t, proj, pen_down(proj[:, 2], t))
+
+        with self.db:
+            self.remove(path)
+            cur = self.db.execute(
+                "INSERT INTO sessions (path, mtime, size, calibration, text_mtime, sno, "
+                "tool, t0, t1, samples, strokes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    st.st_mtime_ns,
+                    st.st_size,
+                    key,
+                    text_mtime,
+                    sno,
+                    tool,
+                    float(t.min()) if len(t) > 0 else None,
+                    float(t.max()) if len(t) > 0 else None,
+                    len(t),
+                    None if runs is None else len(runs),
+                ),
+            )
+            session = cur.lastrowid
+            for t0, t1, points, xmin, ymin, xmax, ymax in runs or []:
+                cur = self.db.execute(
+                    "INSERT INTO strokes (session, t0, t1, points) VALUES (?, ?, ?, ?)",
+                    (session, t0, t1, points),
+                )
+                self.db.execute(
+                    "INSERT INTO stroke_boxes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cur.lastrowid, xmin, xmax, ymin, ymax, t0 / HOUR, t1 / HOUR),
+                )
+            if text_mtime != 0:
+                with open(txt) as f:
+                    self.insert_text(session, f.read(), None)
+        return True
+
+    def index_all(
+        self,
+        files: list[str],
+        basis: Optional[np.ndarray] = None,
+        origin: Optional[np.ndarray] = None,
+        tip: Optional[PenTip] = None,
+    ) -> int:
+        # Returns how many recordings were new or changed
+        start = time.perf_counter()
+        changed = 0
+        for file in files:
+            try:
+                if self.index(file, basis, origin, tip):
+                    changed += 1
+                    log.info(f"Indexed {file}")
+            except (OSError, ValueError) as e:
+                log.error(f"Couldn't index {file}: {e}")
+        log.info(
+            f"Indexed {changed} new or changed of {len(files)} recordings in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        return changed
+
+    def remove(self, path: str):
+        row = self.db.execute("SELECT id FROM sessions WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        (session,) = row
+        self.db.execute(
+            "DELETE FROM stroke_boxes WHERE id IN (SELECT id FROM strokes WHERE session = ?)",
+            (session,),
+        )
+        self.db.execute("DELETE FROM strokes WHERE session = ?", (session,))
+        self.db.execute("DELETE FROM texts WHERE session = ?", (session,))
+        self.db.execute("DELETE FROM sessions WHERE id = ?", (session,))
+
+    def prune(self) -> int:
+        # Forgets recordings that were deleted, returns how many
+        gone = [
+            path
+            for (path,) in self.db.execute("SELECT path FROM sessions")
+            if not os.path.exists(path)
+        ]
+        with self.db:
+            for path in gone:
+                self.remove(path)
+        return len(gone)
+
+    def insert_text(self, session: int, text: str, box: Optional[Box]):
+        xmin, ymin, xmax, ymax = (None,) * 4 if box is None else box
+        self.db.execute(
+            "INSERT INTO texts (text, session, xmin, ymin, xmax, ymax) VALUES (?, ?, ?, ?, ?, ?)",
+            (text, session, xmin, ymin, xmax, ymax),
+        )
+
+    def add_text(self, file: str, text: str, box: Optional[Box] = None):
+        # OCR text for an indexed recording, of the region box if given. It's dropped
+        # if the recording changes and has to be indexed again
+        path = os.path.abspath(file)
+        row = self.db.execute("SELECT id FROM sessions WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            raise ValueError(f"{file} isn't in the catalog")
+        with self.db:
+            self.insert_text(row[0], text, box)
+
+    def sessions(
+        self,
+        after: Optional[float] = None,
+        before: Optional[float] = None,
+        region: Optional[Box] = None,
+        text: Optional[str] = None,
+    ) -> list[Session]:
+        # Sessions overlapping [after, before], with a stroke in region and the words of
+        # text in their OCR text, oldest first
+        where, params = self.filters(after, before, "s")
+        if region is not None:
+            where.append(
+                "s.id IN (SELECT st.session FROM stroke_boxes b JOIN strokes st "
+                "ON st.id = b.id WHERE b.xmax >= ? AND b.xmin <= ? AND b.ymax >= ? "
+                "AND b.ymin <= ?)"
+            )
+            params += [region[0], region[2], region[1], region[3]]
+        if text is not None and len(text.split()) > 0:
+            where.append("s.id IN (SELECT session FROM texts WHERE texts MATCH ?)")
+            params.append(fts_query(text))
+        rows = self.db.execute(
+            "SELECT s.path, s.sno, s.tool, s.t0, s.t1, s.samples, s.strokes "
+            "FROM sessions s"
+            + (" WHERE " + " AND ".join(where) if len(where) > 0 else "")
+            + " ORDER BY s.t0",
+            params,
+        )
+        return [Session(*row) for row in rows]
+
+    def strokes(
+        self,
+        region: Optional[Box] = None,
+        after: Optional[float] = None,
+        before: Optional[float] = None,
+    ) -> list[Stroke]:
+        # Strokes whose box overlaps region and whose time overlaps [after, before]
+        where, params = self.filters(after, before, "st")
+        # The same on the R*Tree, which finds the candidates
+        if after is not None:
+            where.append("b.t1 >= ?")
+            params.append(after / HOUR)
+        if before is not None:
+            where.append("b.t0 <= ?")
+            params.append(before / HOUR)
+        if region is not None:
+            where += ["b.xmax >= ?", "b.xmin <= ?", "b.ymax >= ?", "b.ymin <= ?"]
+            params += [region[0], region[2], region[1], region[3]]
+        rows = self.db.execute(
+            "SELECT s.path, st.t0, st.t1, b.xmin, b.ymin, b.xmax, b.ymax, st.points "
+            "FROM stroke_boxes b JOIN strokes st ON st.id = b.id "
+            "JOIN sessions s ON s.id = st.session"
+            + (" WHERE " + " AND ".join(where) if len(where) > 0 else "")
+            + " ORDER BY st.t0",
+            params,
+        )
+        return [Stroke(path, t0, t1, (x0, y0, x1, y1), n) for path, t0, t1, x0, y0, x1, y1, n in rows]
+
+    def filters(
+        self, after: Optional[float], before: Optional[float], table: str
+    ) -> tuple[list[str], list]:
+        where: list[str] = []
+        params: list = []
+        if after is not None:
+            where.append(f"{table}.t1 >= ?")
+            params.append(after)
+        if before is not None:
+            where.append(f"{table}.t0 <= ?")
+            params.append(before)
+        return where, params
+
+    def close(self):
+        self.db.close()
+
+
+def run_index(
+    calfile: str, inputs: list[str], file: str = DEFAULT_FILE, tip: Optional[PenTip] = None
+) -> int:
+    # Recordings without a calibration are still searchable by time and text
+    from .batch import expand
+
+    basis = origin = None
+    if os.path.exists(calfile):
+        cal = load_calibration(calfile, tip)
+        if cal is None:
+            raise ValueError(f"Couldn't calibrate from {calfile}")
+        basis, origin = cal
+    else:
+        log.warning(f"No calibration file {calfile}, indexing without strokes")
+    files = expand(inputs, calfile if os.path.exists(calfile) else None)
+    with Catalog(file) as cat:
+        pruned = cat.prune()
+        if pruned > 0:
+            log.info(f"Removed {pruned} deleted recordings from {file}")
+        return cat.index_all(files, basis, origin, tip)
+
+
+def run_search(
+    file: str = DEFAULT_FILE,
+    after: Optional[float] = None,
+    before: Optional[float] = None,
+    region: Optional[Box] = None,
+    text: Optional[str] = None,
+    strokes: bool = False,
+):
+    with Catalog(file) as cat:
+        start = time.perf_counter()
+        if strokes:
+            found = cat.strokes(region, after, before)
+        else:
+            found = cat.sessions(after, before, region, text)
+        elapsed = time.perf_counter() - start
+        for item in found:
+            if isinstance(item, Stroke):
+                print(
+                    f"{item.path} {datetime.fromtimestamp(item.t0):%Y-%m-%d %H:%M:%S} "
+                    f"{item.t1 - item.t0:.2f}s {item.points} samples "
+                    f"box {' '.join(f'{v:.3f}' for v in item.box)}"
+                )
+            else:
+                when = "" if item.t0 is None else f"{datetime.fromtimestamp(item.t0):%Y-%m-%d %H:%M}"
+                length = "" if item.t0 is None else f"{(item.t1 - item.t0) / 60:.1f} min, "
+                print(
+                    f"{item.path} {when} ({length}{item.samples} samples, "
+                    f"{'?' if item.strokes is None else item.strokes} strokes, "
+                    f"camera {item.sno} tool {item.tool})"
+                )
+    log.info(f"Found {len(found)} in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    logging.basicConfig(level=logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per = 300
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "catalog.db")
+        cat = Catalog(db)
+        # n hour-long lectures a day apart with `per` strokes each, written straight
+        # into the tables (indexing real files is timed below)
+        start = time.perf_counter()
+        words = ["quadratic", "formula", "integral", "matrix", "limit", "vector", "proof"]
+        with cat.db:
+            for i in range(n):
+                t0 = 1.7e9 + i * 86400.0
+                cur = cat.db.execute(
+                    "INSERT INTO sessions (path, mtime, size, calibration, text_mtime, sno, "
+                    "tool, t0, t1, samples, strokes) VALUES (?, 0, 0, '', 0, '1', '0', ?, ?, ?, ?)",
+                    (f"/lectures/{i}.csv", t0, t0 + 3600, 360000, per),
+                )
+                session = cur.lastrowid
+                st = t0 + np.sort(rng.uniform(0, 3600, per))
+                lo = rng.uniform(0, 0.95, (per, 2))
+                hi = lo + rng.uniform(0.005, 0.05, (per, 2))
+                for k in range(per):
+                    c = cat.db.execute(
+                        "INSERT INTO strokes (session, t0, t1, points) VALUES (?, ?, ?, 50)",
+                        (session, st[k], st[k] + 0.5),
+                    )
+                    cat.db.execute(
+                        "INSERT INTO stroke_boxes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (c.lastrowid, lo[k, 0], hi[k, 0], lo[k, 1], hi[k, 1], st[k] / HOUR, (st[k] + 0.5) / HOUR),
+                    )
+                text = " ".join(rng.choice(words, 20))
+                if i % 97 == 0:
+                    text += " eigenvalue"
+                cat.insert_text(session, text, None)
+        print(
+            f"Built a catalog of {n} sessions, {n * per} strokes in "
+            f"{time.perf_counter() - start:.1f}s ({os.path.getsize(db) / 1e6:.0f} MB)"
+        )
+
+        def timed(label: str, fn, reps: int = 50):
+            start = time.perf_counter()
+            for _ in range(reps):
+                got = fn()
+            ms = (time.perf_counter() - start) / reps * 1000
+            print(f"{label}: {len(got)} results in {ms:.2f} ms")
+
+        mid = 1.7e9 + n / 2 * 86400
+        timed("Sessions in a week", lambda: cat.sessions(mid, mid + 7 * 86400))
+        timed("Sessions with a word", lambda: cat.sessions(text="eigenvalue"))
+        timed(
+            "Sessions with a stroke in a corner",
+            lambda: cat.sessions(region=(0.0, 0.0, 0.01, 0.01)),
+        )
+        timed("Strokes in a region", lambda: cat.strokes((0.4, 0.4, 0.42, 0.42)))
+        timed(
+            "Strokes in a region in a week",
+            lambda: cat.strokes((0.2, 0.2, 0.6, 0.6), mid, mid + 7 * 86400),
+        )
+        cat.close()
+
+        # Indexing the samples, then again when nothing changed
+        cal = load_calibration("samples/calibrate.csv")
+        assert cal is not None
+        files = ["samples/eric.csv", "samples/hi.csv"]
+        with Catalog(os.path.join(tmp, "samples.db")) as cat:
+            for label in ("Indexing the samples", "Indexing them again"):
+                start = time.perf_counter()
+                changed = cat.index_all(files, *cal)
+                print(
+                    f"{label}: {changed} of {len(files)} read in "
+                    f"{(time.perf_counter() - start) * 1000:.1f} ms"
+                )
+            for s in cat.sessions():
+                print(f"  {os.path.basename(s.path)}: {s.samples} samples, {s.strokes} strokes")
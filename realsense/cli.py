@@ -1,15 +1,20 @@
-from argparse import ArgumentParser
-from .plot import Plotter
+from argparse import ArgumentParser, Namespace
+from typing import Optional
 import logging
 
+log = logging.getLogger(__name__)
 
-def cli_main():
-    logging.basicConfig(level=logging.INFO)
+# Only argparse is imported up front, so --help and bad arguments come back right
+# away; matplotlib etc. are imported once we know which mode needs them.
+# Run python -m realsense.startup to measure it.
+
+
+def parse_args(argv: Optional[list[str]] = None) -> Namespace:
     top = ArgumentParser(
         prog="realsense_cli", description="Plot RealSense tool position with Matplotlib"
     )
     sub = top.add_subparsers(
-        required=True, help="Which mode to use (record or replay)."
+        dest="mode", required=True, help="Which mode to use (record or replay)."
     )
     top.add_argument(
         "-f",
@@ -28,7 +33,7 @@ def cli_main():
         "--calibrate-anim",
         action="store_true",
         default=False,
-        help="Whether to replay the calibration file as an animation",
+        help="Replay the calibration file as an animation instead of calibrating from it at once.",
     )
     top.add_argument(
         "-nc",
@@ -37,7 +42,232 @@ def cli_main():
         default=False,
         help="Whether to control the mouse cursor.",
     )
-    sub.add_parser("record", help="Record a tool in realtime")
+    top.add_argument(
+        "-b",
+        "--broadcast",
+        nargs="?",
+        const="239.255.42.99:5007",
+        default=None,
+        metavar="ADDR:PORT",
+        help="Broadcast projected positions over UDP (multicast group by default). "
+        "Listen with python -m realsense.sink.",
+    )
+    top.add_argument(
+        "-pr",
+        "--predict",
+        type=float,
+        default=0.0,
+        metavar="MS",
+        help="Move the cursor this many milliseconds ahead of the pen to hide tracking lag.",
+    )
+    top.add_argument(
+        "-rc",
+        "--relative-cursor",
+        action="store_true",
+        default=False,
+        help="Move the cursor like a mouse instead of placing it like a pen tablet.",
+    )
+    top.add_argument(
+        "-cr",
+        "--cursor-rate",
+        type=float,
+        default=None,
+        metavar="HZ",
+        help="Cursor updates per second (60-240, the display's refresh rate by default). "
+        "0 moves the cursor on every tracker sample instead.",
+    )
+    top.add_argument(
+        "-t",
+        "--tip",
+        default=None,
+        metavar="X,Y,Z|FILE",
+        help="Track the pen tip instead of the marker: its offset in the marker's frame (m), "
+        "or a pivot calibration recording to solve it from (see python -m realsense.tip). "
+        "Give offsets with a leading minus as --tip=-0.003,0.01,-0.14.",
+    )
+    top.add_argument(
+        "--ink",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="Export the pen strokes to FILE while running (.svg or .inkml, can be repeated).",
+    )
+    top.add_argument(
+        "--ocr",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="FILE",
+        help="Recognize the handwriting while running (needs pix2text) and log it, or write "
+        "the board's text to FILE (RECORDING.txt is what the catalog searches).",
+    )
+    top.add_argument(
+        "--history",
+        default=None,
+        metavar="FILE",
+        help="Keep every projected position in FILE (float64 t, x, y, z records) instead of "
+        "a temporary file. Only the most recent ones are kept in memory.",
+    )
+    top.add_argument(
+        "--shm",
+        nargs="?",
+        const="zotpen",
+        default=None,
+        metavar="NAME",
+        help="Publish the raw and projected positions to shared memory (NAME-raw and "
+        "NAME-proj) for other processes. Read them with python -m realsense.shm.",
+    )
+    top.add_argument(
+        "--catalog",
+        default=None,
+        metavar="DB",
+        help="Add recordings to this catalog as they're written, to find them with the "
+        "search mode (catalog.db for index and search by default).",
+    )
+    top.add_argument(
+        "-r",
+        "--renderer",
+        choices=["mpl", "qt"],
+        default="mpl",
+        help="Draw with Matplotlib, or straight with Qt (much faster with many points).",
+    )
+    top.add_argument(
+        "--stats",
+        nargs="?",
+        const="-",
+        default=None,
+        metavar="FILE",
+        help="Time the tracking loop and print a summary every few seconds "
+        "(or append it to FILE).",
+    )
+    rec = sub.add_parser("record", help="Record a tool in realtime")
+    rec.add_argument(
+        "-i",
+        "--imu",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="ADDRESS|CAPTURE",
+        help="Fuse the pen's IMU in live, so the cursor keeps moving while the marker is "
+        "occluded: the pen's BLE address (found by its service if not given), or a raw "
+        ".bin capture to stream instead of the pen.",
+    )
+    rec.add_argument(
+        "-io",
+        "--imu-offset",
+        type=float,
+        default=None,
+        help="Seconds to add to IMU times on top of lining them up by arrival time.",
+    )
+    vid = sub.add_parser(
+        "video", help="Record a pen tracked by a webcam (or in a video file)"
+    )
+    vid.add_argument(
+        "source",
+        nargs="?",
+        default="0",
+        help="Camera index or video file to track the pen in.",
+    )
+    vid.add_argument(
+        "-p",
+        "--pixels",
+        action="store_true",
+        default=False,
+        help="Use normalized pixel coordinates instead of estimating 3D positions.",
+    )
+    vid.add_argument(
+        "-k",
+        "--kcf",
+        action="store_true",
+        default=False,
+        help="Track the marker with KCF between detections.",
+    )
+    vid.add_argument(
+        "-l",
+        "--flow",
+        action="store_true",
+        default=False,
+        help="Track the marker with Lucas-Kanade optical flow between detections.",
+    )
+    bat = sub.add_parser(
+        "batch",
+        help="Project, render and export many recordings without a GUI, using the calibration file",
+    )
+    bat.add_argument(
+        "recordings",
+        nargs="+",
+        help="Recording files, directories of them or globs.",
+    )
+    bat.add_argument(
+        "-o", "--output", default="batch", help="Directory to write the results to."
+    )
+    bat.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Worker processes (all cores by default).",
+    )
+    bat.add_argument(
+        "-np",
+        "--no-png",
+        action="store_true",
+        default=False,
+        help="Skip rendering a PNG of each recording.",
+    )
+    bat.add_argument(
+        "-k",
+        "--ink",
+        dest="ink_formats",
+        action="append",
+        choices=["svg", "inkml"],
+        default=[],
+        help="Also export the strokes of each recording in this format (can be repeated).",
+    )
+    idx = sub.add_parser(
+        "index",
+        help="Add recordings to the catalog (only new or changed ones are read), using the calibration file",
+    )
+    idx.add_argument(
+        "recordings",
+        nargs="+",
+        help="Recording files, directories of them or globs.",
+    )
+    sea = sub.add_parser("search", help="Find recordings in the catalog")
+    sea.add_argument(
+        "-a",
+        "--after",
+        default=None,
+        metavar="TIME",
+        help="Recorded (at least partly) after this time: seconds since the epoch or an ISO date.",
+    )
+    sea.add_argument(
+        "-B",
+        "--before",
+        default=None,
+        metavar="TIME",
+        help="Recorded (at least partly) before this time.",
+    )
+    sea.add_argument(
+        "-g",
+        "--region",
+        default=None,
+        metavar="X0,Y0,X1,Y1",
+        help="With a stroke in this region of the calibrated plane.",
+    )
+    sea.add_argument(
+        "-x",
+        "--text",
+        default=None,
+        help="Whose OCR text has all these words.",
+    )
+    sea.add_argument(
+        "-s",
+        "--strokes",
+        action="store_true",
+        default=False,
+        help="List the matching strokes instead of the recordings.",
+    )
     rep = sub.add_parser("replay", help="Replay a tool from a file")
     rep.add_argument(
         "-na",
@@ -46,7 +276,92 @@ def cli_main():
         default=False,
         help="In replay mode, whether or not to animate the sequence.",
     )
-    args = top.parse_args()
+    rep.add_argument(
+        "-i",
+        "--imu",
+        default=None,
+        help="IMU capture (points.csv or raw .bin) recorded alongside the file to fuse in.",
+    )
+    rep.add_argument(
+        "-io",
+        "--imu-offset",
+        type=float,
+        default=None,
+        help="Seconds to add to IMU times to line them up with the tracker. Estimated if not given.",
+    )
+    args = top.parse_args(argv)
+    if args.mode == "search":
+        from .catalog import parse_time
+
+        try:
+            if args.after is not None:
+                args.after = parse_time(args.after)
+            if args.before is not None:
+                args.before = parse_time(args.before)
+        except ValueError as e:
+            top.error(f"bad time: {e}")
+        if args.region is not None:
+            try:
+                region = tuple(float(v) for v in args.region.split(","))
+            except ValueError:
+                region = ()
+            if len(region) != 4:
+                top.error(f"bad region {args.region}, use X0,Y0,X1,Y1")
+            args.region = region
+        if args.strokes and args.text is not None:
+            top.error("--text finds recordings, not strokes")
+    for file in args.ink:
+        if not file.lower().endswith((".svg", ".inkml")):
+            top.error(f"can't export ink to {file}, use a .svg or .inkml file")
+    return args
+
+
+def cli_main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    tip = None
+    if args.tip is not None:
+        from .tip import load_tip
+
+        tip = load_tip(args.tip)
+        log.info(f"Tracking the pen tip at {tip}")
+
+    if args.mode == "batch":
+        from .batch import run_batch
+
+        run_batch(
+            args.calibrate_file,
+            args.recordings,
+            args.output,
+            args.jobs,
+            not args.no_png,
+            tip,
+            tuple(args.ink_formats),
+        )
+        return
+
+    if args.mode in ("index", "search"):
+        from .catalog import DEFAULT_FILE, run_index, run_search
+
+        catalog = args.catalog or DEFAULT_FILE
+        if args.mode == "index":
+            run_index(args.calibrate_file, args.recordings, catalog, tip)
+        else:
+            run_search(
+                catalog, args.after, args.before, args.region, args.text, args.strokes
+            )
+        return
+
+    if args.renderer == "qt":
+        from .qtplot import QtPlotter as Plotter
+    else:
+        from .plot import MplPlotter as Plotter
+
+    if args.stats is not None:
+        from .stats import Stats
+
+        Stats(args.stats).install()
 
     anim = not args.no_anim if hasattr(args, "no_anim") else None
 
@@ -56,5 +371,21 @@ def cli_main():
         args.calibrate_anim,
         not args.no_cursor,
         anim,
+        imu=getattr(args, "imu", None),
+        imu_offset=getattr(args, "imu_offset", None),
+        video=getattr(args, "source", None),
+        video_pixels=getattr(args, "pixels", False),
+        video_kcf=getattr(args, "kcf", False),
+        video_flow=getattr(args, "flow", False),
+        broadcast=args.broadcast,
+        predict=args.predict / 1000,
+        cursor_rate=args.cursor_rate,
+        absolute=not args.relative_cursor,
+        tip=tip,
+        history=args.history,
+        ink=args.ink,
+        ocr=args.ocr,
+        shm=args.shm,
+        catalog=args.catalog,
     )
     plot.run()
@@ -0,0 +1,311 @@
+# Compressed recordings (.zrec).
+#
+# Recording CSVs are mostly redundant: sno and id never change within a file, and the
+# tracker repeats the last pose in every packet until the camera has a new frame, so
+# about 4 in 5 rows only differ in their time. A .zrec file stores them in blocks of
+# up to BLOCK rows, each holding:
+# - sno and id once
+# - the times as deltas of their float64 bit patterns (lossless, and small because the
+#   packets come at a steady rate)
+# - each run of identical poses once, with its length
+# The arrays are byte-shuffled (all first bytes, then all second bytes...) and the
+# block is compressed with zlib or lzma. Blocks are framed by their compressed size,
+# so a reader only ever inflates one at a time.
+# Live recordings are written straight to .zrec when the file name ends with it
+# (record -f lecture.zrec).
+# Usage: python -m realsense.codec [-o DIR] [-m zlib|lzma] <recordings>
+# (without recordings it reports the compression ratio and decode speed on samples/)
+from collections.abc import Iterable, Iterator
+from typing import BinaryIO
+import csv
+import logging
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+from .state import RecordingRow, csvkeys
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"ZREC"
+VERSION = 1
+EXTENSION = ".zrec"
+# Rows per block, about 40 s of recording
+BLOCK = 4096
+
+METHODS = {"zlib": 0, "lzma": 1}
+COMPRESS = {0: lambda b: zlib.compress(b, 9), 1: lambda b: lzma.compress(b, preset=6)}
+DECOMPRESS = {0: zlib.decompress, 1: lzma.decompress}
+
+# File header: magic, version, method
+FILE_HEADER = struct.Struct("<4sBB")
+# Before each block: compressed size
+FRAME = struct.Struct("<I")
+# Start of each inflated block: rows, runs, length of sno, length of id
+BLOCK_HEADER = struct.Struct("<IIHH")
+
+# x, y, z, qx, qy, qz, qw
+POSE = 7
+
+# sno, id, times (N,), poses (N, 7)
+Block = tuple[str, str, np.ndarray, np.ndarray]
+
+
+def is_compressed(file: str) -> bool:
+    with open(file, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def shuffle(a: np.ndarray) -> bytes:
+    # Same byte of every element next to each other, which zlib does a lot better on
+    return a.view(np.uint8).reshape(-1, a.itemsize).T.tobytes()
+
+
+def unshuffle(b: bytes, dtype: type, count: int) -> np.ndarray:
+    size = np.dtype(dtype).itemsize
+    return np.frombuffer(b, np.uint8).reshape(size, count).T.copy().view(dtype).ravel()
+
+
+def encode_block(sno: str, id: str, t: np.ndarray, poses: np.ndarray) -> bytes:
+    n = len(t)
+    # Runs of identical poses
+    starts = np.flatnonzero(np.r_[True, (poses[1:] != poses[:-1]).any(axis=1)])
+    lengths = np.diff(np.r_[starts, n]).astype(np.uint32)
+    # Bit patterns rather than values, so the deltas are exact
+    bits = np.ascontiguousarray(t, dtype=np.float64).view(np.int64)
+    deltas = np.diff(bits, prepend=np.int64(0))
+
+    snob, idb = sno.encode(), id.encode()
+    return b"".join(
+        (
+            BLOCK_HEADER.pack(n, len(starts), len(snob), len(idb)),
+            snob,
+            idb,
+            shuffle(deltas),
+            shuffle(lengths),
+            shuffle(np.ascontiguousarray(poses[starts], dtype=np.float64)),
+        )
+    )
+
+
+def decode_block(data: bytes) -> Block:
+    n, runs, snolen, idlen = BLOCK_HEADER.unpack_from(data)
+    at = BLOCK_HEADER.size
+    sno = data[at : at + snolen].decode()
+    at += snolen
+    id = data[at : at + idlen].decode()
+    at += idlen
+    deltas = unshuffle(data[at : at + 8 * n], np.int64, n)
+    at += 8 * n
+    lengths = unshuffle(data[at : at + 4 * runs], np.uint32, runs)
+    at += 4 * runs
+    poses = unshuffle(data[at : at + 8 * runs * POSE], np.float64, runs * POSE)
+
+    t = np.cumsum(deltas).view(np.float64)
+    return sno, id, t, np.repeat(poses.reshape(runs, POSE), lengths, axis=0)
+
+
+class Writer:
+    out: BinaryIO
+    method: int
+    block: int
+    # Rows not written yet
+    pending: list[tuple[str, str, float, tuple[float, ...]]]
+    rows: int
+    size: int
+
+    def __init__(self, out: BinaryIO, method: str = "zlib", block: int = BLOCK):
+        self.out = out
+        self.method = METHODS[method]
+        self.block = block
+        self.pending = []
+        self.rows = 0
+        self.size = out.write(FILE_HEADER.pack(MAGIC, VERSION, self.method))
+
+    def write(self, row: RecordingRow):
+        pose = (row["x"], row["y"], row["z"], row["qx"], row["qy"], row["qz"], row["qw"])
+        sno, id = str(row["sno"]), str(row["id"])
+        # A block has a single sno and id, so a change starts a new one
+        if len(self.pending) > 0 and (sno, id) != self.pending[-1][:2]:
+            self.flush()
+        self.pending.append((sno, id, float(row["time"]), tuple(map(float, pose))))
+        if len(self.pending) >= self.block:
+            self.flush()
+
+    def write_block(self, sno: str, id: str, t: np.ndarray, poses: np.ndarray):
+        data = COMPRESS[self.method](encode_block(sno, id, t, poses))
+        self.size += self.out.write(FRAME.pack(len(data)))
+        self.size += self.out.write(data)
+        self.rows += len(t)
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        sno, id = self.pending[0][:2]
+        t = np.array([p[2] for p in self.pending])
+        poses = np.array([p[3] for p in self.pending])
+        self.pending = []
+        self.write_block(sno, id, t, poses)
+
+    def close(self):
+        self.flush()
+        self.out.flush()
+
+
+def save(file: str, data: Iterable[RecordingRow], header: bool = True):
+    # Recorded rows as a .zrec or a CSV (with a header row if asked), by the extension
+    if file.endswith(EXTENSION):
+        with open(file, "wb") as out:
+            writer = Writer(out)
+            for row in data:
+                writer.write(row)
+            writer.close()
+        return
+    with open(file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=csvkeys)
+        if header:
+            writer.writeheader()
+        writer.writerows(data)
+
+
+def blocks(file: str) -> Iterator[Block]:
+    # One block at a time, so memory stays bounded however long the recording is
+    with open(file, "rb") as f:
+        magic, version, method = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{file} is not a compressed recording")
+        if version != VERSION:
+            raise ValueError(f"{file} has unsupported version {version}")
+        while True:
+            frame = f.read(FRAME.size)
+            if len(frame) < FRAME.size:
+                return
+            (size,) = FRAME.unpack(frame)
+            data = f.read(size)
+            if len(data) < size:
+                log.warning(f"{file} is truncated, ignoring the last block")
+                return
+            yield decode_block(DECOMPRESS[method](data))
+
+
+def rows(block: Block) -> Iterator[RecordingRow]:
+    # The same rows csv.DictReader gives for the CSV (sno and id stay strings)
+    sno, id, t, poses = block
+    for ti, (x, y, z, qx, qy, qz, qw) in zip(t.tolist(), poses.tolist()):
+        yield {
+            "sno": sno,  # type: ignore
+            "time": ti,
+            "x": x,
+            "y": y,
+            "z": z,
+            "qx": qx,
+            "qy": qy,
+            "qz": qz,
+            "qw": qw,
+            "id": id,  # type: ignore
+        }
+
+
+def read(file: str) -> tuple[np.ndarray, np.ndarray]:
+    # All (N,) times and (N, 7) poses
+    parts = list(blocks(file))
+    if len(parts) == 0:
+        return np.zeros(0), np.zeros((0, POSE))
+    return np.concatenate([b[2] for b in parts]), np.concatenate([b[3] for b in parts])
+
+
+def compress(src: str, dst: str, method: str = "zlib", block: int = BLOCK) -> int:
+    # Converts a recording CSV, returns the compressed size
+    with open(src, newline="") as f:
+        reader = csv.reader(f)
+        data = [r for r in reader if len(r) == len(csvkeys)]
+    # Recordings from SocketSource have no header, the others do
+    if len(data) > 0 and data[0][0] == csvkeys[0]:
+        data = data[1:]
+
+    with open(dst, "wb") as out:
+        writer = Writer(out, method, block)
+        start = 0
+        for i in range(1, len(data) + 1):
+            if (
+                i == len(data)
+                or i - start >= block
+                or (data[i][0], data[i][-1]) != (data[start][0], data[start][-1])
+            ):
+                chunk = np.array([r[1:9] for r in data[start:i]], dtype=np.float64)
+                writer.write_block(data[start][0], data[start][-1], chunk[:, 0], chunk[:, 1:])
+                start = i
+        writer.close()
+        return writer.size
+
+
+def decompress(src: str, dst: str):
+    # Back to a CSV identical to the one the recording started as
+    with open(dst, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(csvkeys)
+        for sno, id, t, poses in blocks(src):
+            for ti, pose in zip(t.tolist(), poses.tolist()):
+                writer.writerow([sno, repr(ti), *map(repr, pose), id])
+
+
+if __name__ == "__main__":
+    import argparse
+    import filecmp
+    import glob
+    import os
+    import tempfile
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        prog="python -m realsense.codec",
+        description="Compress recordings and report ratio and decode speed",
+    )
+    parser.add_argument("recordings", nargs="*", help="Recording CSVs (default samples/)")
+    parser.add_argument("-o", "--output", help="Directory for the .zrec files")
+    parser.add_argument("-m", "--method", choices=list(METHODS), default="zlib")
+    args = parser.parse_args()
+
+    files = args.recordings or sorted(glob.glob("samples/*.csv"))
+    with tempfile.TemporaryDirectory() as tmp:
+        outdir = args.output or tmp
+        os.makedirs(outdir, exist_ok=True)
+        total_in = total_out = total_plain = total_rows = 0
+        decode_time = 0.0
+        for file in files:
+            name = os.path.splitext(os.path.basename(file))[0]
+            dst = os.path.join(outdir, name + EXTENSION)
+            size = compress(file, dst, args.method)
+
+            start = time.perf_counter()
+            n = sum(len(b[2]) for b in blocks(dst))
+            elapsed = time.perf_counter() - start
+
+            check = os.path.join(tmp, name + ".check.csv")
+            decompress(dst, check)
+            same = filecmp.cmp(file, check, shallow=False)
+            orig = os.path.getsize(file)
+            with open(file, "rb") as f:
+                # What compressing the whole CSV would have given
+                plain = len(zlib.compress(f.read(), 9))
+            total_in += orig
+            total_plain += plain
+            total_out += size
+            total_rows += n
+            decode_time += elapsed
+            print(
+                f"{file}: {orig} -> {size} bytes ({orig / size:.1f}x, "
+                f"zlib on the CSV {orig / plain:.1f}x), {n} rows, "
+                f"decoded at {n / elapsed / 1e6:.1f}M rows/s, "
+                f"{'round trips' if same else 'DIFFERS from the CSV'}"
+            )
+        if total_out > 0:
+            print(
+                f"Total: {total_in} -> {total_out} bytes ({total_in / total_out:.1f}x, "
+                f"zlib on the CSV {total_in / total_plain:.1f}x), "
+                f"{total_rows / decode_time / 1e6:.1f}M rows/s "
+                f"({total_in / decode_time / 1e6:.0f} MB/s of CSV)"
+            )
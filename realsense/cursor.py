@@ -1,8 +1,33 @@
 from abc import abstractmethod, ABC
+from typing import TYPE_CHECKING, Optional
 import sys
 
+# The backends are only imported once a cursor is actually made,
+# so starting up (or running without a cursor) doesn't pay for them
+if TYPE_CHECKING:
+    import uinput
+    from pynput.mouse import Button, Controller
+
+
+def screen_size(default: tuple[int, int] = (1920, 1080)) -> tuple[int, int]:
+    # Size of the primary screen in pixels if Qt is up (it is with the qtagg backend)
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        return default
+    app = QApplication.instance()
+    if app is None:
+        return default
+    size = app.primaryScreen().size()
+    if size.width() <= 0 or size.height() <= 0:
+        return default
+    return size.width(), size.height()
+
 
 class Cursor(ABC):
+    # Whether move_to works, which puts the cursor somewhere instead of moving it
+    absolute: bool = False
+
     @abstractmethod
     def move(self, x: int, y: int):
         pass
@@ -15,54 +40,141 @@ class Cursor(ABC):
     def finalize(self):
         pass
 
+    # x and y are in [0, 1] from the bottom left corner of the screen,
+    # pressure in [0, 1] (0 while the pen is up)
+    def move_to(self, x: float, y: float, pressure: float):
+        raise NotImplementedError(f"{type(self).__name__} can only move relatively")
+
     @staticmethod
-    def default() -> "Cursor":
+    def default(
+        absolute: bool = True, screen: tuple[int, int] = (1920, 1080)
+    ) -> "Cursor":
         if sys.platform == "linux":
-            return UinputCursor()
+            return UinputTablet(screen) if absolute else UinputCursor()
         else:
-            return PynputCursor()
+            return PynputCursor(screen if absolute else None)
 
 
-if sys.platform == "linux":
-    import uinput
+class UinputCursor(Cursor):
+    dev: "uinput.Device"
+    # Event codes, looked up once
+    rel_x: tuple[int, int]
+    rel_y: tuple[int, int]
+    btn_left: tuple[int, int]
 
-    class UinputCursor(Cursor):
-        dev: uinput.Device
+    def __init__(self):
+        import uinput
 
-        def __init__(self):
-            self.dev = uinput.Device((uinput.REL_X, uinput.REL_Y, uinput.BTN_LEFT))
+        self.rel_x, self.rel_y, self.btn_left = uinput.REL_X, uinput.REL_Y, uinput.BTN_LEFT
+        self.dev = uinput.Device((self.rel_x, self.rel_y, self.btn_left))
 
-        def move(self, x: int, y: int):
-            self.dev.emit(uinput.REL_X, x)
-            # dy is negative because the axes is flipped on the screen
-            # The "origin" of a screen is the top left corner,
-            # not the bottom left.
-            self.dev.emit(uinput.REL_Y, -y)
+    def move(self, x: int, y: int):
+        self.dev.emit(self.rel_x, x)
+        # dy is negative because the axes is flipped on the screen
+        # The "origin" of a screen is the top left corner,
+        # not the bottom left.
+        self.dev.emit(self.rel_y, -y)
 
-        def click(self, on: bool):
-            self.dev.emit(uinput.BTN_LEFT, 1 if on else 0)
+    def click(self, on: bool):
+        self.dev.emit(self.btn_left, 1 if on else 0)
 
-        def finalize(self):
-            self.dev.destroy()
+    def finalize(self):
+        self.dev.destroy()
+
+
+class UinputTablet(Cursor):
+    # Shows up as a pen tablet covering the screen, so positions map straight to
+    # pixels and nothing accumulates between samples
+    absolute = True
+    dev: "uinput.Device"
+    screen: tuple[int, int]
+    abs_x: tuple[int, int]
+    abs_y: tuple[int, int]
+    abs_pressure: tuple[int, int]
+    btn_touch: tuple[int, int]
+    # Last values sent, so nothing is sent for motion under a pixel
+    last: tuple[int, int, int]
+
+    # Pressure range
+    PRESSURE = 1023
+
+    def __init__(self, screen: tuple[int, int]):
+        import uinput
+
+        self.screen = screen
+        w, h = screen
+        self.abs_x, self.abs_y = uinput.ABS_X, uinput.ABS_Y
+        self.abs_pressure, self.btn_touch = uinput.ABS_PRESSURE, uinput.BTN_TOUCH
+        self.dev = uinput.Device(
+            (
+                self.abs_x + (0, w - 1, 0, 0),
+                self.abs_y + (0, h - 1, 0, 0),
+                self.abs_pressure + (0, self.PRESSURE, 0, 0),
+                self.btn_touch,
+                uinput.BTN_TOOL_PEN,
+            ),
+            name="zotpen-tablet",
+        )
+        # The pen is always in range of the "tablet"
+        self.dev.emit(uinput.BTN_TOOL_PEN, 1)
+        self.last = (-1, -1, -1)
 
-else:
-    from pynput.mouse import Button, Controller
+    def move(self, x: int, y: int):
+        raise NotImplementedError("UinputTablet only moves absolutely")
+
+    def move_to(self, x: float, y: float, pressure: float):
+        w, h = self.screen
+        # Screen coordinates start at the top left
+        px = min(max(round(x * (w - 1)), 0), w - 1)
+        py = min(max(round((1 - y) * (h - 1)), 0), h - 1)
+        p = min(max(round(pressure * self.PRESSURE), 0), self.PRESSURE)
+        lx, ly, lp = self.last
+        if px != lx:
+            self.dev.emit(self.abs_x, px, syn=False)
+        if py != ly:
+            self.dev.emit(self.abs_y, py, syn=False)
+        if p != lp:
+            self.dev.emit(self.abs_pressure, p, syn=False)
+        if (px, py, p) != self.last:
+            self.dev.syn()
+            self.last = (px, py, p)
 
-    class PynputCursor(Cursor):
-        dev: Controller
+    def click(self, on: bool):
+        self.dev.emit(self.btn_touch, 1 if on else 0)
+
+    def finalize(self):
+        self.dev.destroy()
+
+
+class PynputCursor(Cursor):
+    dev: "Controller"
+    # The left button
+    button: "Button"
+    # Screen size if positioning absolutely
+    screen: Optional[tuple[int, int]]
+
+    def __init__(self, screen: Optional[tuple[int, int]] = None):
+        from pynput.mouse import Button, Controller
 
-        def __init__(self):
-            self.dev = Controller()
+        self.button = Button.left
+        self.dev = Controller()
+        self.screen = screen
+        self.absolute = screen is not None
 
-        def move(self, x: int, y: int):
-            self.dev.move(x, y)
+    def move(self, x: int, y: int):
+        self.dev.move(x, y)
+
+    def move_to(self, x: float, y: float, pressure: float):
+        assert self.screen is not None
+        w, h = self.screen
+        self.dev.position = (round(x * (w - 1)), round((1 - y) * (h - 1)))
 
-        def click(self, on: bool):
-            if on:
-                self.dev.press(Button.left)
-            else:
-                self.dev.release(Button.left)
+    def click(self, on: bool):
+        if on:
+            self.dev.press(self.button)
+        else:
+            self.dev.release(self.button)
 
-        def finalize(self):
-            # I don't think pynput has a Controller dtor
-            pass
+    def finalize(self):
+        # I don't think pynput has a Controller dtor
+        pass
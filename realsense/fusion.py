@@ -0,0 +1,464 @@
+# IMU / optical sensor fusion
+#
+# The tracker loses the marker whenever the pen is occluded, and while that happens it
+# either sends nothing or keeps repeating the last pose. The pen's IMU keeps streaming
+# through occlusions, so an error-state Kalman filter integrates the accelerometers
+# between tracker fixes and gets corrected by the tracker whenever it sees the marker.
+# Replays fuse a recorded capture (replay -i), live tracking fuses the pen's BLE stream
+# as it comes in (record -i), with the collector from imu/ running on its own thread.
+from collections import deque
+from threading import Thread, current_thread
+from typing import TYPE_CHECKING, Optional
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+from .replay import FileSource
+from .source import Projection
+from .state import RecordingRow
+from .tip import quat_matrix
+
+if TYPE_CHECKING:
+    from imu.collector import Collector
+
+    from .plotter import Plotter
+
+log = logging.getLogger(__name__)
+
+
+# Returns (t, acc) with t in seconds since the start of the capture and acc the specific
+# force in m/s^2 (gravity included) averaged over both sensors, shape (N, 3).
+# Accepts both raw captures (.bin) and points.csv files.
+def load_imu(file: str) -> tuple[np.ndarray, np.ndarray]:
+    from imu.analysis import column, convert, read_chunks
+
+    acc1 = [column(f"acc{axis}1") for axis in "xyz"]
+    acc2 = [column(f"acc{axis}2") for axis in "xyz"]
+
+    if os.path.splitext(file)[1] == ".bin":
+        from imu.capture import read_packets
+
+        packets = read_packets(file)
+        t = np.cumsum(packets["delay"]) * 1e-6
+        data = convert(packets["sensors"].astype(np.float64), offset=False)
+    else:
+        ts, datas = [], []
+        for chunk in read_chunks(file, offset=False):
+            ts.append(chunk.t)
+            datas.append(chunk.data)
+        t = np.concatenate(ts) if ts else np.empty(0)
+        data = np.concatenate(datas) if datas else np.empty((0, 18))
+
+    return t, (data[:, acc1] + data[:, acc2]) / 2
+
+
+# Marks rows that just repeat the previous pose, which is what the tracker
+# sends while the marker is occluded
+def frozen(pos: np.ndarray, quat: np.ndarray) -> np.ndarray:
+    pose = np.column_stack((pos, quat))
+    out = np.zeros(len(pose), dtype=bool)
+    out[1:] = np.all(pose[1:] == pose[:-1], axis=1)
+    return out
+
+
+# Estimates the offset to add to IMU times to get tracker times by lining up how
+# hard the pen accelerates according to each sensor.
+def estimate_offset(
+    opt_t: np.ndarray,
+    opt_pos: np.ndarray,
+    imu_t: np.ndarray,
+    imu_acc: np.ndarray,
+    search: float = 5.0,
+    hz: float = 100.0,
+) -> float:
+    base = opt_t[0] - imu_t[0]
+    if len(opt_t) < 4 or len(imu_t) < 4:
+        return base
+
+    grid = np.arange(opt_t[0], opt_t[-1], 1 / hz)
+    p = np.column_stack([np.interp(grid, opt_t, opt_pos[:, i]) for i in range(3)])
+    opt_mag = np.linalg.norm(np.diff(p, 2, axis=0), axis=1) * hz * hz
+    grid = grid[1:-1]
+
+    imu_mag = np.linalg.norm(imu_acc, axis=1)
+    imu_mag = np.abs(imu_mag - np.median(imu_mag))
+
+    opt_mag = (opt_mag - opt_mag.mean()) / (opt_mag.std() + 1e-9)
+    best, best_lag = -np.inf, 0.0
+    for lag in np.arange(-search, search, 1 / hz):
+        shifted = np.interp(grid - base - lag, imu_t, imu_mag)
+        shifted = (shifted - shifted.mean()) / (shifted.std() + 1e-9)
+        score = np.dot(opt_mag, shifted)
+        if score > best:
+            best, best_lag = score, lag
+
+    return base + best_lag
+
+
+class Fuser:
+    # Nominal state
+    p: np.ndarray
+    v: np.ndarray
+    # Accelerometer bias (sensor frame)
+    b: np.ndarray
+    # Error state covariance for [dp, dv, db], shape (9, 9)
+    P: np.ndarray
+    # Latest orientation from the tracker (marker to camera)
+    R: Optional[np.ndarray]
+    # Fixed rotation from the IMU frame to the marker frame
+    imu_rot: np.ndarray
+    # Gravity in the camera frame, estimated from the IMU
+    g: Optional[np.ndarray]
+    # World frame acceleration from the last IMU sample
+    acc: np.ndarray
+    t: Optional[float]
+    last_fix: Optional[float]
+
+    # Noise parameters
+    acc_noise: float
+    bias_noise: float
+    meas_noise: float
+    # How long to keep dead reckoning without a tracker fix (s)
+    max_gap: float
+
+    def __init__(
+        self,
+        acc_noise: float = 0.5,
+        bias_noise: float = 0.01,
+        meas_noise: float = 0.002,
+        max_gap: float = 0.5,
+        imu_rot: Optional[np.ndarray] = None,
+    ):
+        self.p = np.zeros(3)
+        self.v = np.zeros(3)
+        self.b = np.zeros(3)
+        self.P = np.eye(9)
+        self.R = None
+        self.imu_rot = np.eye(3) if imu_rot is None else imu_rot
+        self.g = None
+        self.acc = np.zeros(3)
+        self.t = None
+        self.last_fix = None
+        self.acc_noise = acc_noise
+        self.bias_noise = bias_noise
+        self.meas_noise = meas_noise
+        self.max_gap = max_gap
+
+    def predict(self, t: float):
+        if self.t is None:
+            self.t = t
+            return
+        dt = t - self.t
+        if dt <= 0:
+            return
+        self.t = t
+
+        self.p = self.p + self.v * dt + 0.5 * self.acc * dt * dt
+        self.v = self.v + self.acc * dt
+
+        F = np.eye(9)
+        F[0:3, 3:6] = np.eye(3) * dt
+        if self.R is not None:
+            F[3:6, 6:9] = -self.R @ self.imu_rot * dt
+        Q = np.zeros(9)
+        Q[3:6] = self.acc_noise**2 * dt
+        Q[6:9] = self.bias_noise**2 * dt
+        self.P = F @ self.P @ F.T + np.diag(Q)
+
+    def dead_reckoning(self, t: float) -> bool:
+        return self.last_fix is not None and t - self.last_fix <= self.max_gap
+
+    # Returns the estimate at time t, or None if there's nothing useful to say
+    def imu(self, t: float, acc: np.ndarray) -> Optional[np.ndarray]:
+        if self.R is None:
+            return None
+        # Specific force in the camera frame, gravity included
+        f = self.R @ (self.imu_rot @ (acc - self.b))
+        # Over time the pen doesn't go anywhere, so what's left on average is gravity
+        self.g = -f if self.g is None else self.g + (-f - self.g) * 0.001
+
+        self.predict(t)
+        self.acc = f + self.g
+
+        if not self.dead_reckoning(t):
+            # Too long without a fix for double integration to be trusted
+            self.v = np.zeros(3)
+            self.acc = np.zeros(3)
+            return None
+        return self.p
+
+    def optical(self, t: float, pos: np.ndarray, quat: np.ndarray) -> np.ndarray:
+        self.R = quat_matrix(quat)
+        if self.last_fix is None or not self.dead_reckoning(t):
+            # (Re)initialize from the tracker
+            self.t = t
+            self.p = np.array(pos, dtype=float)
+            self.v = np.zeros(3)
+            self.P = np.eye(9) * 0.01
+            self.P[0:3, 0:3] = np.eye(3) * self.meas_noise**2
+            self.last_fix = t
+            return self.p
+
+        self.predict(t)
+        S = self.P[0:3, 0:3] + np.eye(3) * self.meas_noise**2
+        K = np.linalg.solve(S, self.P[0:3, :]).T
+        dx = K @ (pos - self.p)
+        self.P = self.P - K @ self.P[0:3, :]
+
+        # Inject the error state into the nominal state
+        self.p = self.p + dx[0:3]
+        self.v = self.v + dx[3:6]
+        self.b = self.b + dx[6:9]
+        self.last_fix = t
+        return self.p
+
+
+# Fuses a whole recording with an IMU capture. Returns (t, pos, quat) of the fused
+# stream, which has a sample for every usable tracker fix and IMU reading.
+def fuse(
+    opt_t: np.ndarray,
+    opt_pos: np.ndarray,
+    opt_quat: np.ndarray,
+    imu_t: np.ndarray,
+    imu_acc: np.ndarray,
+    offset: Optional[float] = None,
+    fuser: Optional[Fuser] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if offset is None:
+        good = ~frozen(opt_pos, opt_quat)
+        offset = estimate_offset(opt_t[good], opt_pos[good], imu_t, imu_acc)
+        log.info(f"Estimated IMU clock offset {offset:.3f}s")
+    if fuser is None:
+        fuser = Fuser()
+
+    imu_t = imu_t + offset
+    # Only keep IMU readings that overlap the recording
+    keep = (imu_t >= opt_t[0]) & (imu_t <= opt_t[-1])
+    imu_t, imu_acc = imu_t[keep], imu_acc[keep]
+
+    skip = frozen(opt_pos, opt_quat)
+    # Merge both streams by time, tracker first on ties
+    times = np.concatenate((opt_t, imu_t))
+    kinds = np.concatenate((np.zeros(len(opt_t), int), np.ones(len(imu_t), int)))
+    index = np.concatenate((np.arange(len(opt_t)), np.arange(len(imu_t))))
+    order = np.lexsort((kinds, times))
+
+    out_t: list[float] = []
+    out_p: list[np.ndarray] = []
+    out_q: list[np.ndarray] = []
+    quat = opt_quat[0]
+    for i in order:
+        t = times[i]
+        j = index[i]
+        if kinds[i] == 0:
+            if skip[j]:
+                continue
+            quat = opt_quat[j]
+            est = fuser.optical(t, opt_pos[j], quat)
+        else:
+            est = fuser.imu(t, imu_acc[j])
+        if est is not None:
+            out_t.append(t)
+            out_p.append(est.copy())
+            out_q.append(quat)
+
+    return np.array(out_t), np.array(out_p).reshape(-1, 3), np.array(out_q).reshape(-1, 4)
+
+
+# Longest a BLE notification is assumed to take to arrive (s)
+MAX_LATENCY = 0.05
+
+
+class ImuStream:
+    # The pen's IMU readings as they arrive, from imu.collector on a worker thread.
+    # Times follow the pen's own delay field, put on the tracker's clock (seconds since
+    # the epoch) by when packets arrive: a reading can't be from after it arrived, or
+    # from more than MAX_LATENCY before. That also keeps up with a pen clock that drifts
+    readings: deque[tuple[float, np.ndarray]]
+    offset: float
+    # Pen time (s) of the last packet, and what to add to get tracker time
+    pen_t: float
+    epoch: Optional[float]
+    loop: asyncio.AbstractEventLoop
+    collector: "Collector"
+    thread: Thread
+
+    def __init__(self, spec: str = "", offset: Optional[float] = None):
+        # spec is the pen's BLE address, "" to look for it, or a capture (.bin) to
+        # stream instead of the pen at the rate it was recorded
+        from imu.collector import BleakBackend, Collector, FakeBackend
+
+        self.readings = deque(maxlen=4096)
+        self.offset = 0.0 if offset is None else offset
+        self.pen_t = 0.0
+        self.epoch = None
+        if spec.endswith(".bin"):
+            from imu.capture import read_packets
+
+            delay = np.median(read_packets(spec)["delay"])
+            backend = FakeBackend.from_capture(spec, rate=1e6 / max(float(delay), 1.0))
+        else:
+            backend = BleakBackend(spec or None)
+        self.loop = asyncio.new_event_loop()
+        self.collector = Collector(backend, self)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        log.info(f"Fusing the pen's IMU stream ({spec or 'looking for the pen'})")
+
+    def run(self):
+        self.loop.run_until_complete(self.collector.run())
+        log.info(f"IMU stream closed: {self.collector.stats}")
+
+    # Collector sink, called on the worker thread
+    def append(self, data: bytes):
+        from imu.analysis import column, convert
+        from imu.capture import DTYPE, PACKET_SIZE
+
+        if len(data) != PACKET_SIZE:
+            return
+        packet = np.frombuffer(data, dtype=DTYPE)[0]
+        self.pen_t += int(packet["delay"]) * 1e-6
+        arrival = time.time() + self.offset
+        if self.epoch is None or self.epoch + self.pen_t > arrival:
+            self.epoch = arrival - self.pen_t
+        elif self.epoch + self.pen_t < arrival - MAX_LATENCY:
+            self.epoch = arrival - MAX_LATENCY - self.pen_t
+        raw = convert(packet["sensors"].astype(np.float64), offset=False)
+        acc1 = raw[[column(f"acc{axis}1") for axis in "xyz"]]
+        acc2 = raw[[column(f"acc{axis}2") for axis in "xyz"]]
+        acc = (acc1 + acc2) / 2
+        self.readings.append((self.epoch + self.pen_t, acc))
+
+    def close(self):
+        # Called by the collector as its sink when it stops (nothing to do then), and by
+        # the data source to stop it
+        if current_thread() is self.thread or not self.thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self.collector.stop.set)
+        self.thread.join()
+
+
+class LiveFusion:
+    # Fuses tracker packets with an ImuStream as they come in, like fuse() does for a
+    # whole recording: IMU readings up to each fix go in first, and repeated poses
+    # (the tracker lost the marker) are left to the IMU
+    stream: ImuStream
+    fuser: Fuser
+    # The last pose the tracker sent, its time, and when it arrived
+    last: Optional[tuple]
+    last_t: float
+    last_arrival: float
+    # Time of the last position given out, so they never go back in time
+    out_t: float
+    # Latest orientation, for the pen tip
+    quat: tuple[float, float, float, float]
+    fixes: int
+    dead_reckoned: int
+
+    def __init__(self, spec: str = "", offset: Optional[float] = None):
+        self.stream = ImuStream(spec, offset)
+        self.fuser = Fuser()
+        self.last = None
+        self.last_t = 0.0
+        self.last_arrival = 0.0
+        self.out_t = -np.inf
+        self.quat = (0.0, 0.0, 0.0, 1.0)
+        self.fixes = 0
+        self.dead_reckoned = 0
+
+    def imu_until(self, t: float) -> list[tuple[tuple[float, float, float], float]]:
+        out = []
+        readings = self.stream.readings
+        while len(readings) > 0 and readings[0][0] <= t:
+            ti, acc = readings.popleft()
+            # Readings from before the last fix still correct the filter's
+            # acceleration, but don't move the pen back in time
+            est = self.fuser.imu(ti, acc)
+            if est is not None and self.last is not None and ti > self.out_t:
+                out.append(((float(est[0]), float(est[1]), float(est[2])), ti))
+                self.out_t = ti
+        self.dead_reckoned += len(out)
+        return out
+
+    def optical(
+        self,
+        t: float,
+        pos: tuple[float, float, float],
+        quat: tuple[float, float, float, float],
+    ) -> list[tuple[tuple[float, float, float], float]]:
+        # Positions (marker, not tip) to append for a tracker packet, oldest first
+        out = self.imu_until(t)
+        self.last_arrival = time.time()
+        pose = (*pos, *quat)
+        if pose != self.last:
+            est = self.fuser.optical(t, np.array(pos), np.array(quat))
+            out.append(((float(est[0]), float(est[1]), float(est[2])), t))
+            self.out_t = max(self.out_t, t)
+            self.last = pose
+            self.quat = quat
+            self.fixes += 1
+        self.last_t = max(self.last_t, t)
+        return out
+
+    def idle(self) -> list[tuple[tuple[float, float, float], float]]:
+        # Positions while the tracker sends nothing: the tracker's clock has moved on by
+        # as long as it's been quiet
+        if self.last is None:
+            return []
+        return self.imu_until(self.last_t + time.time() - self.last_arrival)
+
+    def close(self):
+        self.stream.close()
+        log.info(
+            f"Fused {self.fixes} tracker fixes with {self.dead_reckoned} IMU estimates"
+        )
+
+
+class FusionSource(FileSource):
+    # Replays a recording with an IMU capture fused in. The fused rows go through
+    # the regular FileSource logic, so animation and projection work the same.
+    def __init__(
+        self,
+        plot: "Plotter",
+        animate: bool,
+        file: str,
+        imu: str,
+        offset: Optional[float] = None,
+        calibrate: bool = False,
+        proj: Optional[Projection] = None,
+    ):
+        super().__init__(plot, animate, file, calibrate, proj)
+
+        # Fusion needs the whole recording, so every block of a .zrec is read here
+        rows = list(self.remaining())
+        cols = ["time", "x", "y", "z", "qx", "qy", "qz", "qw"]
+        data = np.array([[float(row[c]) for c in cols] for row in rows])  # type: ignore
+        imu_t, imu_acc = load_imu(imu)
+        t, pos, quat = fuse(data[:, 0], data[:, 1:4], data[:, 4:8], imu_t, imu_acc, offset)
+        log.info(
+            f"Fused {len(rows)} tracker rows and {len(imu_t)} IMU readings into {len(t)} samples"
+        )
+
+        sno, id = rows[0]["sno"], rows[0]["id"]
+        fused: list[RecordingRow] = [
+            {
+                "sno": sno,
+                "time": t[i],
+                "x": pos[i, 0],
+                "y": pos[i, 1],
+                "z": pos[i, 2],
+                "qx": quat[i, 0],
+                "qy": quat[i, 1],
+                "qz": quat[i, 2],
+                "qw": quat[i, 3],
+                "id": id,
+            }
+            for i in range(len(t))
+        ]
+        self.rows.clear()
+        self.rows.extend(fused)
+        if len(self.rows) >= 2:
+            self.recstart = float(self.rows[1]["time"])
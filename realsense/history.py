@@ -0,0 +1,172 @@
+# On-disk history of positions.
+#
+# A `Position` only keeps its last few thousand samples in RAM (the hot tier). With an
+# `Archive` attached, every sample that falls out of it is spilled here instead of
+# being lost: samples collect in a small chunk buffer and are appended to a file of
+# (t, x, y, z) float64 records a chunk at a time. Reads map the file with np.memmap,
+# so looking back over a whole session only pages in what it touches and the process
+# doesn't grow with the length of the session. `Position.range` reads across both tiers.
+# There's one archive per session: every projection (after recalibrating too) appends
+# to it, and an existing --history file is appended to rather than overwritten.
+# Usage: python -m realsense.history [samples] (measures memory and read speed)
+from typing import BinaryIO, Optional
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# t, x, y, z
+COLUMNS = 4
+# Samples spilled to disk at once
+CHUNK = 1024
+
+
+def read_archive(file: str) -> np.ndarray:
+    # The (N, 4) records of an archive file, mapped rather than read. A partial record
+    # at the end (from a crash mid-write) is left out
+    count = os.path.getsize(file) // (COLUMNS * 8)
+    if count == 0:
+        return np.empty((0, COLUMNS))
+    return np.memmap(file, dtype=np.float64, mode="r", shape=(count, COLUMNS))
+
+
+class Archive:
+    file: str
+    # Delete the file when closed (it's a temporary file)
+    temporary: bool
+    out: BinaryIO
+
+    chunk: int
+    # Samples not spilled yet, flattened (a list is cheaper to append to than an array)
+    pending: list[float]
+    # Samples in the file
+    count: int
+    # Time of the last sample appended (-inf if none)
+    last: float
+    # Whether times only ever went forward, so range can binary search. A replay after a
+    # live session (or an older --history file) can go back in time
+    ordered: bool
+    # Mapping of the file, redone when it has grown since
+    mapped: np.ndarray
+
+    def __init__(self, file: Optional[str] = None, chunk: int = CHUNK):
+        self.temporary = file is None
+        if file is None:
+            fd, file = tempfile.mkstemp(prefix="zotpen-", suffix=".hist")
+            os.close(fd)
+        self.file = file
+        self.out = open(file, "ab")
+        self.chunk = chunk
+        self.pending = []
+        # A partial record at the end (from a crash mid-write) is cut off, or everything
+        # appended after it would be misaligned
+        self.count = os.path.getsize(file) // (COLUMNS * 8)
+        self.out.truncate(self.count * COLUMNS * 8)
+        self.mapped = np.empty((0, COLUMNS))
+        self.last = -np.inf
+        self.ordered = True
+        if self.count > 0:
+            times = self.records()[:, 0]
+            self.last = float(times[-1])
+            self.ordered = bool(np.all(np.diff(times) >= 0))
+            log.info(f"Appending to {self.count} samples of history in {file}")
+
+    def __len__(self) -> int:
+        return self.count + len(self.pending) // COLUMNS
+
+    def append(self, t: float, x: float, y: float, z: float):
+        if t < self.last and self.ordered:
+            log.warning(f"History in {self.file} went back in time, reading it gets slower")
+            self.ordered = False
+        self.last = t
+        self.pending += (t, x, y, z)
+        if len(self.pending) >= self.chunk * COLUMNS:
+            self.spill()
+
+    def spill(self):
+        if len(self.pending) == 0:
+            return
+        self.out.write(np.array(self.pending, dtype=np.float64).tobytes())
+        self.out.flush()
+        self.count += len(self.pending) // COLUMNS
+        self.pending = []
+
+    def records(self) -> np.ndarray:
+        # Everything on disk, (N, 4)
+        if len(self.mapped) != self.count:
+            self.mapped = read_archive(self.file)[: self.count]
+        return self.mapped
+
+    def range(self, t0: float, t1: float) -> np.ndarray:
+        # Samples with t0 <= t < t1, (N, 4). While times only go forward, the file is
+        # binary searched and only the pages in the range are touched
+        disk = self.records()
+        times = disk[:, 0]
+        if self.ordered:
+            a, b = np.searchsorted(times, t0), np.searchsorted(times, t1)
+            disk = disk[a:b]
+        else:
+            disk = disk[(times >= t0) & (times < t1)]
+        pending = np.array(self.pending).reshape(-1, COLUMNS)
+        keep = (pending[:, 0] >= t0) & (pending[:, 0] < t1)
+        return np.concatenate((disk, pending[keep]))
+
+    def close(self):
+        self.spill()
+        self.out.close()
+        self.mapped = np.empty((0, COLUMNS))
+        if self.temporary:
+            os.remove(self.file)
+        else:
+            log.info(f"Kept {self.count} samples of history in {self.file}")
+
+
+if __name__ == "__main__":
+    import resource
+    import sys
+    import time
+
+    from .state import Position
+
+    def rss() -> float:
+        # Peak resident memory (MB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    plain = Position(5000)
+    start = time.perf_counter()
+    for i in range(n // 10):
+        plain.append((i * 1e-6, 0.5, 0.1), i * 0.01)
+    base = (time.perf_counter() - start) / (n // 10)
+
+    archive = Archive()
+    pos = Position(5000, archive=archive)
+    before = rss()
+    start = time.perf_counter()
+    # 100 Hz for n samples, spread over a lecture's worth of handwriting
+    for i in range(n):
+        pos.append((i * 1e-6, 0.5, 0.1), i * 0.01)
+        if i % (n // 5) == 0:
+            print(f"{i:>9} samples, peak memory {rss():.0f} MB")
+    elapsed = time.perf_counter() - start
+    print(
+        f"Appended {n} samples in {elapsed:.2f}s ({elapsed / n * 1e9:.0f} ns each, "
+        f"{base * 1e9:.0f} ns without an archive), "
+        f"{len(archive)} on disk, peak memory grew {rss() - before:.0f} MB"
+    )
+
+    end = n * 0.01
+    for span in (10.0, 600.0):
+        reads = 200
+        start = time.perf_counter()
+        for k in range(reads):
+            t0 = (k * 7919 % 1000) / 1000 * (end - span)
+            got = pos.range(t0, t0 + span)
+        ms = (time.perf_counter() - start) / reads * 1000
+        print(f"Reading {span:.0f} s of history: {len(got)} samples in {ms:.2f} ms")
+    last = pos.range(end - 100, end)
+    print(f"Last 100 s across both tiers: {len(last)} samples")
+    archive.close()
@@ -0,0 +1,327 @@
+# Ink export: the pen-down strokes as SVG paths or InkML traces.
+#
+# An `InkSink` collects the projected samples while the pen is down. When the pen
+# comes up the stroke is quantized to a grid (SCALE steps across the calibrated area),
+# decimated with Ramer-Douglas-Peucker, and written with relative integer coordinates.
+# That keeps a whole lecture to a few hundred KB. Strokes are written to the file every
+# few seconds, followed by the closing tags, and the next write goes over those tags.
+# The file is valid after every write, so a crash loses at most the last few seconds,
+# and memory only ever holds the stroke in progress. A sink lasts the whole session:
+# recalibrating finalizes it (writing everything so far) and carries on in the same file.
+# The format is picked by the file extension (.svg or .inkml). Recordings are
+# converted with the batch mode: python -m realsense -cf <cal> batch <recs> -k svg
+# Usage: python -m realsense.ink (reports the export size for the samples and an hour
+# of writing)
+from abc import abstractmethod
+from typing import Optional, TextIO
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from .sink import Sink
+
+log = logging.getLogger(__name__)
+
+# Grid steps across the width of the calibrated area
+SCALE = 1000
+# How far (grid steps) decimation may move a stroke
+TOLERANCE = 1.0
+# Seconds between writes to the file
+INTERVAL = 2.0
+# Longer strokes are split, so a pen that's never lifted can't use up memory
+MAX_POINTS = 4096
+
+
+def rdp(pts: np.ndarray, eps: float) -> np.ndarray:
+    # Ramer-Douglas-Peucker on (N, 2) points: which ones to keep so no dropped point
+    # is further than eps from the polyline. Iterative, so long strokes can't recurse
+    # too deep
+    n = len(pts)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while len(stack) > 0:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = pts[b] - pts[a]
+        d = pts[a + 1 : b] - pts[a]
+        length = math.hypot(seg[0], seg[1])
+        if length == 0:
+            dist = np.hypot(d[:, 0], d[:, 1])
+        else:
+            dist = np.abs(seg[0] * d[:, 1] - seg[1] * d[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > eps:
+            m = a + 1 + i
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return keep
+
+
+class InkSink(Sink):
+    out: TextIO
+    file: str
+    scale: int
+    tolerance: float
+    interval: float
+    max_points: int
+    # Height / width of the calibrated area, which sets the height of the drawing
+    aspect: float
+
+    # Stroke in progress: x, y (projected) and tracker time
+    stroke: list[tuple[float, float, float]]
+    # Strokes encoded since the last write
+    pending: list[str]
+    # Time of the first sample
+    t0: Optional[float]
+    # Where the closing tags start (the next write goes there)
+    end: Optional[int]
+    last_write: float
+
+    strokes: int
+    points_in: int
+    points_out: int
+
+    def __init__(
+        self,
+        file: str,
+        scale: int = SCALE,
+        tolerance: float = TOLERANCE,
+        interval: float = INTERVAL,
+        max_points: int = MAX_POINTS,
+        aspect: float = 1.0,
+    ):
+        self.file = file
+        self.out = open(file, "w")
+        self.scale = scale
+        self.tolerance = tolerance
+        self.interval = interval
+        self.max_points = max_points
+        self.aspect = aspect
+        self.stroke = []
+        self.pending = []
+        self.t0 = None
+        self.end = None
+        self.last_write = time.monotonic()
+        self.strokes = 0
+        self.points_in = 0
+        self.points_out = 0
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.scale, round(self.scale * self.aspect)
+
+    @abstractmethod
+    def header(self) -> str:
+        pass
+
+    # A decimated stroke: (N, 2) integer grid points and (N,) times in ms
+    @abstractmethod
+    def encode(self, pts: np.ndarray, ms: np.ndarray) -> str:
+        pass
+
+    @abstractmethod
+    def footer(self) -> str:
+        pass
+
+    def on_calibrate(self, basis: np.ndarray):
+        # Plane x and y are both 0..1, but the area usually isn't square. Only the first
+        # calibration counts once the header is written, or the strokes after a
+        # recalibration wouldn't fit its size
+        if self.end is None:
+            self.aspect = float(np.linalg.norm(basis[:, 1]) / np.linalg.norm(basis[:, 0]))
+
+    def on_sample(self, pos: tuple[float, float, float], t: float, pressed: bool):
+        if self.t0 is None:
+            self.t0 = t
+        if pressed:
+            self.stroke.append((pos[0], pos[1], t))
+            if len(self.stroke) >= self.max_points:
+                # Carry on from the same point in a new stroke
+                last = self.stroke[-1]
+                self.end_stroke()
+                self.stroke.append(last)
+        elif len(self.stroke) > 0:
+            self.end_stroke()
+
+    def end_stroke(self):
+        stroke = np.array(self.stroke)
+        self.stroke = []
+        assert self.t0 is not None
+        w, h = self.size
+        # Plane y points up, both formats' y points down
+        grid = np.column_stack(
+            (np.rint(stroke[:, 0] * w), np.rint((1 - stroke[:, 1]) * h))
+        ).astype(np.int64)
+        ms = np.rint((stroke[:, 2] - self.t0) * 1000).astype(np.int64)
+        # Drop repeats (the tracker resends poses) before decimating
+        moved = np.r_[True, (grid[1:] != grid[:-1]).any(axis=1)]
+        grid, ms = grid[moved], ms[moved]
+        keep = rdp(grid.astype(float), self.tolerance)
+        self.pending.append(self.encode(grid[keep], ms[keep]))
+        self.strokes += 1
+        self.points_in += len(stroke)
+        self.points_out += int(keep.sum())
+
+    def write(self):
+        if self.end is None:
+            self.out.write(self.header())
+        else:
+            self.out.seek(self.end)
+        self.out.write("".join(self.pending))
+        self.pending = []
+        self.end = self.out.tell()
+        self.out.write(self.footer())
+        self.out.truncate()
+        self.out.flush()
+        self.last_write = time.monotonic()
+
+    def flush(self):
+        if len(self.pending) > 0 and time.monotonic() - self.last_write > self.interval:
+            self.write()
+
+    def finalize(self):
+        # The projection is done; the file outlives it, in case of a recalibration
+        if len(self.stroke) > 0:
+            self.end_stroke()
+        self.write()
+
+    def close(self):
+        self.finalize()
+        self.out.close()
+        log.info(
+            f"Exported {self.strokes} strokes to {self.file} "
+            f"({self.points_out} of {self.points_in} points, "
+            f"{os.path.getsize(self.file) / 1024:.1f} KB)"
+        )
+
+
+class SvgSink(InkSink):
+    def header(self) -> str:
+        w, h = self.size
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {w} {h}">\n'
+            f'<g fill="none" stroke="black" stroke-width="{max(self.scale // 500, 1)}" '
+            f'stroke-linecap="round" stroke-linejoin="round">\n'
+        )
+
+    def encode(self, pts: np.ndarray, ms: np.ndarray) -> str:
+        x, y = pts[0]
+        if len(pts) == 1:
+            # A dot
+            return f'<path d="M{x} {y}h0"/>\n'
+        d = np.diff(pts, axis=0).ravel().tolist()
+        return f'<path d="M{x} {y}l{" ".join(map(str, d))}"/>\n'
+
+    def footer(self) -> str:
+        return "</g>\n</svg>\n"
+
+
+class InkmlSink(InkSink):
+    def header(self) -> str:
+        return (
+            '<ink xmlns="http://www.w3.org/2003/InkML">\n'
+            "<definitions>\n"
+            '<context xml:id="ctx">\n'
+            "<traceFormat>\n"
+            '<channel name="X" type="integer"/>\n'
+            '<channel name="Y" type="integer"/>\n'
+            '<channel name="T" type="integer" units="ms"/>\n'
+            "</traceFormat>\n"
+            "</context>\n"
+            f'<timestamp xml:id="start" time="{round((self.t0 or 0.0) * 1000)}"/>\n'
+            "</definitions>\n"
+        )
+
+    def encode(self, pts: np.ndarray, ms: np.ndarray) -> str:
+        rows = np.column_stack((pts, ms))
+        first = " ".join(map(str, rows[0].tolist()))
+        if len(rows) == 1:
+            return f'<trace contextRef="#ctx">{first}</trace>\n'
+        diffs = np.diff(rows, axis=0).tolist()
+        # ' switches every channel to differences from the previous point
+        second = "".join(f"'{v}" for v in diffs[0])
+        rest = "".join("," + " ".join(map(str, d)) for d in diffs[1:])
+        return f'<trace contextRef="#ctx">{first},{second}{rest}</trace>\n'
+
+    def footer(self) -> str:
+        return "</ink>\n"
+
+
+FORMATS = {".svg": SvgSink, ".inkml": InkmlSink}
+
+
+def ink_sink(file: str, **kwargs) -> InkSink:
+    ext = os.path.splitext(file)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Can't export ink to {file}, use one of {', '.join(FORMATS)}")
+    return FORMATS[ext](file, **kwargs)
+
+
+def export(
+    file: str,
+    t: np.ndarray,
+    proj: np.ndarray,
+    pressed: np.ndarray,
+    basis: Optional[np.ndarray] = None,
+) -> InkSink:
+    # A whole projected recording at once, through the same sink as live
+    sink = ink_sink(file, interval=float("inf"))
+    if basis is not None:
+        sink.on_calibrate(basis)
+    for ti, p, down in zip(t.tolist(), proj.tolist(), pressed.tolist()):
+        sink.on_sample(p, ti, down)
+    sink.close()
+    return sink
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    from .batch import pen_down
+    from .calibration import load_calibration, project, read_recording
+
+    logging.basicConfig(level=logging.WARNING)
+    calfile = sys.argv[1] if len(sys.argv) > 1 else "samples/calibrate.csv"
+    cal = load_calibration(calfile)
+    assert cal is not None
+    basis, origin = cal
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("eric", "hi"):
+            t, xyz = read_recording(f"samples/{name}.csv")
+            proj = project(xyz, basis, origin)
+            pressed = pen_down(proj[:, 2], t)
+            for ext in FORMATS:
+                sink = export(os.path.join(tmp, name + ext), t, proj, pressed, basis)
+                print(
+                    f"{name}{ext}: {sink.strokes} strokes, {sink.points_out} of "
+                    f"{sink.points_in} points kept, {os.path.getsize(sink.file)} bytes"
+                )
+
+        # An hour of writing: the sample strokes over and over, moved around the board
+        t, xyz = read_recording("samples/eric.csv")
+        proj = project(xyz, basis, origin)
+        pressed = pen_down(proj[:, 2], t)
+        span = t[-1] - t[0] + 0.01
+        copies = int(3600 / span)
+        rng = np.random.default_rng(0)
+        shift = np.repeat(rng.uniform(-0.3, 0.3, size=(copies, 1, 2)), len(t), axis=1)
+        hour_t = (t[None, :] + span * np.arange(copies)[:, None]).ravel()
+        hour = np.tile(proj, (copies, 1))
+        hour[:, :2] += shift.reshape(-1, 2)
+        hour_pressed = np.tile(pressed, copies)
+        for ext in FORMATS:
+            start = time.perf_counter()
+            sink = export(os.path.join(tmp, "hour" + ext), hour_t, hour, hour_pressed, basis)
+            print(
+                f"An hour ({len(hour_t)} samples, {sink.strokes} strokes) as {ext}: "
+                f"{os.path.getsize(sink.file) / 1024:.0f} KB, "
+                f"exported in {time.perf_counter() - start:.1f}s"
+            )
@@ -0,0 +1,138 @@
+# End-to-end latency, from the tracker's timestamp on a packet to the cursor event.
+#
+# The tracker and this machine don't share a clock, so the offset between them is
+# estimated as the smallest (receive time - tracker time) seen over the last few
+# seconds: the fastest packet is the one that spent no time queued anywhere. Latencies
+# are measured against that, so they're the extra delay on top of the best case
+# network transit (which is what changes when things lag).
+# Stalls are gaps between reads of the socket long enough that packets piled up,
+# which means something (usually a redraw) held up the loop.
+from collections import deque
+from typing import Optional
+import logging
+import time
+
+import numpy as np
+
+from .stats import Histogram, Stats, fmt
+
+log = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    # Seconds of packets the clock offset is estimated over
+    window: float
+    # Gaps between socket reads longer than this (s) are stalls
+    stall: float
+    # (receive time, receive time - tracker time), increasing delays only,
+    # so the front is the minimum of the window
+    delays: deque[tuple[float, float]]
+    offset: Optional[float]
+
+    # The most recent latencies (s) for the title, and the whole session for the summary
+    recent: np.ndarray
+    count: int
+    hist: Histogram
+
+    stalls: int
+    worst_stall: float
+    last_read: Optional[float]
+    # Stall warnings are batched up, a slow redraw can stall every frame
+    last_warning: float
+    unreported: int
+
+    # Cached title text, so the percentiles are only worked out a few times a second
+    text: str
+    text_time: float
+
+    def __init__(self, window: float = 10.0, stall: float = 0.1, recent: int = 1024):
+        self.window = window
+        self.stall = stall
+        self.delays = deque()
+        self.offset = None
+        self.recent = np.zeros(recent)
+        self.count = 0
+        # Shows up in the --stats summary as well, if it's on
+        self.hist = Histogram() if Stats.current is None else Stats.current.stage(
+            "Tracker to cursor"
+        )
+        self.hist.busy = False
+        self.stalls = 0
+        self.worst_stall = 0.0
+        self.last_read = None
+        self.last_warning = 0.0
+        self.unreported = 0
+        self.text = ""
+        self.text_time = 0.0
+
+    # A packet with this tracker time was just read off the socket
+    def on_receive(self, t: float):
+        now = time.time()
+        d = now - t
+        while len(self.delays) > 0 and self.delays[-1][1] >= d:
+            self.delays.pop()
+        self.delays.append((now, d))
+        while self.delays[0][0] < now - self.window:
+            self.delays.popleft()
+        self.offset = self.delays[0][1]
+
+    # A read of the socket finished with this many packets
+    def on_read(self, packets: int):
+        now = time.time()
+        if self.last_read is not None and packets > 0:
+            gap = now - self.last_read
+            if gap > self.stall:
+                self.stalls += 1
+                self.unreported += 1
+                self.worst_stall = max(self.worst_stall, gap)
+                if now - self.last_warning > 5:
+                    log.warning(
+                        f"Ingestion stalled for {gap * 1000:.0f} ms with {packets} packets "
+                        f"queued up ({self.unreported} stalls in total since the last warning)"
+                    )
+                    self.last_warning = now
+                    self.unreported = 0
+        self.last_read = now
+
+    # The cursor was just moved for the sample with this tracker time
+    def on_output(self, t: float):
+        if self.offset is None:
+            # Replays have no live clock to compare against
+            return
+        lat = max(time.time() - t - self.offset, 0.0)
+        self.recent[self.count % len(self.recent)] = lat
+        self.count += 1
+        self.hist.add(int(lat * 1e9))
+
+    def percentiles(self) -> Optional[tuple[float, float, float]]:
+        n = min(self.count, len(self.recent))
+        if n == 0:
+            return None
+        p50, p95, p99 = np.percentile(self.recent[:n], (50, 95, 99)) * 1000
+        return p50, p95, p99
+
+    def title(self) -> str:
+        now = time.perf_counter()
+        if now - self.text_time > 0.5:
+            self.text_time = now
+            pcts = self.percentiles()
+            if pcts is None:
+                self.text = ""
+            else:
+                p50, p95, p99 = pcts
+                self.text = f"Latency p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms"
+                if self.stalls > 0:
+                    self.text += f", {self.stalls} stalls"
+        return self.text
+
+    def summary(self) -> str:
+        if self.hist.calls == 0:
+            return "No live latency measurements"
+        text = (
+            f"Tracker to cursor latency over {self.hist.calls} samples: "
+            f"p50 {fmt(self.hist.percentile(50))}, p99 {fmt(self.hist.percentile(99))}, "
+            f"max {fmt(self.hist.max)} (clock offset {self.offset:.4f} s)"
+        )
+        if self.stalls > 0:
+            text += f", {self.stalls} stalls (worst {self.worst_stall * 1000:.0f} ms)"
+        return text
@@ -0,0 +1,178 @@
+# Cursor output at the display rate.
+#
+# Poses arrive whenever the tracker sends them (jittery, and in bursts after a stall),
+# so moving the cursor straight from `Projection.on_append` makes it jump. Instead the
+# projection hands samples to a thread that wakes up once per display frame,
+# interpolates the position for that moment (a little in the past, so there's a
+# sample on both sides) and moves the cursor there. Tablet cursors are just placed;
+# for relative ones the sub-pixel remainder is carried over to the next frame instead
+# of being dropped.
+from collections import deque
+from threading import Event, Thread
+from typing import Optional
+import logging
+import time
+
+from .cursor import Cursor
+from .latency import LatencyTracker
+
+log = logging.getLogger(__name__)
+
+# (tracker time, x, y, pen down, pressure)
+Sample = tuple[float, float, float, bool, float]
+
+
+def display_rate(default: float = 60.0) -> float:
+    # Refresh rate of the primary screen if Qt is up (it is with the qtagg backend)
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        return default
+    app = QApplication.instance()
+    if app is None:
+        return default
+    rate = app.primaryScreen().refreshRate()
+    return rate if rate > 0 else default
+
+
+class CursorThread:
+    cursor: Cursor
+    # Frames per second, and pixels per projected unit
+    rate: float
+    screen: tuple[int, int]
+    latency: Optional[LatencyTracker]
+
+    # Handed over from the ingestion loop; only appended there and popped here
+    inbox: deque[Sample]
+    # Recent samples, oldest first
+    window: list[Sample]
+    # Host time - tracker time, as low as it's been (drifts up slowly)
+    offset: Optional[float]
+    # Typical time between samples, how far behind the newest sample we render
+    spacing: float
+
+    # Where the cursor is (px, with the fraction that hasn't been sent yet)
+    at: Optional[tuple[float, float]]
+    pressed: bool
+    # Tracker time of the last sample reported to the latency tracker
+    reported: float
+    frames: int
+    late: int
+
+    stop: Event
+    thread: Thread
+
+    def __init__(
+        self,
+        cursor: Cursor,
+        rate: Optional[float] = None,
+        screen: tuple[int, int] = (1920, 1080),
+        latency: Optional[LatencyTracker] = None,
+    ):
+        self.cursor = cursor
+        self.rate = min(max(display_rate() if rate is None else rate, 60.0), 240.0)
+        self.screen = screen
+        self.latency = latency
+        self.inbox = deque(maxlen=1024)
+        self.window = []
+        self.offset = None
+        self.spacing = 0.01
+        self.at = None
+        self.pressed = False
+        self.reported = float("-inf")
+        self.frames = 0
+        self.late = 0
+        self.stop = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        log.info(f"Moving the cursor at {self.rate:.0f} Hz")
+
+    def push(self, t: float, x: float, y: float, pressed: bool, pressure: float):
+        # Called from the ingestion loop, so this can't wait on anything
+        self.inbox.append((t, x, y, pressed, pressure))
+
+    def drain(self, now: float):
+        while True:
+            try:
+                sample = self.inbox.popleft()
+            except IndexError:
+                break
+            t = sample[0]
+            d = now - t
+            if self.offset is None or d < self.offset:
+                self.offset = d
+            else:
+                # Follow clock drift, but slowly enough to ignore queueing
+                self.offset += (d - self.offset) * 0.001
+            if len(self.window) > 0 and t > self.window[-1][0]:
+                self.spacing += (t - self.window[-1][0] - self.spacing) * 0.05
+            self.window.append(sample)
+
+    def sample_at(self, rt: float) -> Sample:
+        # Linear interpolation between the samples around tracker time rt
+        window = self.window
+        i = len(window) - 1
+        while i > 0 and window[i][0] > rt:
+            i -= 1
+        # Everything before the bracketing pair is old news
+        if i > 1:
+            del window[: i - 1]
+            i = 1
+        t0, x0, y0, p0, f0 = window[i]
+        if i + 1 >= len(window) or rt <= t0:
+            return window[i]
+        t1, x1, y1, _, f1 = window[i + 1]
+        f = (rt - t0) / (t1 - t0) if t1 > t0 else 1.0
+        return rt, x0 + (x1 - x0) * f, y0 + (y1 - y0) * f, p0, f0 + (f1 - f0) * f
+
+    def frame(self):
+        now = time.time()
+        self.drain(now)
+        if len(self.window) == 0:
+            return
+        assert self.offset is not None
+
+        rt = now - self.offset - self.spacing
+        t, x, y, pressed, pressure = self.sample_at(rt)
+        if self.cursor.absolute:
+            self.cursor.move_to(x, y, pressure)
+        else:
+            w, h = self.screen
+            px, py = x * w, y * h
+            if self.at is None:
+                self.at = (px, py)
+
+            # Only whole pixels can be sent, keep the rest for the next frame
+            ax, ay = self.at
+            dx, dy = round(px - ax), round(py - ay)
+            if dx != 0 or dy != 0:
+                self.cursor.move(dx, dy)
+                self.at = (ax + dx, ay + dy)
+        if pressed != self.pressed:
+            log.debug(f"Button {'pressed' if pressed else 'released'}")
+            self.cursor.click(pressed)
+            self.pressed = pressed
+
+        if self.latency is not None and t > self.reported:
+            self.latency.on_output(t)
+            self.reported = t
+
+    def run(self):
+        period = 1 / self.rate
+        deadline = time.perf_counter()
+        while not self.stop.is_set():
+            self.frame()
+            self.frames += 1
+            deadline += period
+            wait = deadline - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                # Missed a frame, start counting from now instead of catching up
+                self.late += 1
+                deadline = time.perf_counter()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        log.info(f"Cursor thread ran {self.frames} frames, {self.late} late")
@@ -0,0 +1,155 @@
+# Pen up / down detection from the projected z coordinate.
+#
+# A single fixed threshold flickers whenever the tracker noise straddles it, so this
+# uses a hysteresis band around the threshold, a debounce time a new state has to
+# hold for, and a threshold that follows the z distribution of the session:
+# the z values cluster around the surface (pen down) and the hover height (pen up),
+# and an online two-means puts the threshold between the two.
+# Everything is O(1) per sample.
+from typing import Optional
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class PenState:
+    # Threshold used until the clusters have separated enough to trust
+    default: float
+    # Set from the Z threshold slider, replaces the automatic threshold while set
+    override: Optional[float]
+    # Seconds a new state has to hold before it's reported
+    debounce: float
+    # Half width of the hysteresis band is at least this...
+    min_band: float
+    # ...and at most this fraction of the gap between the clusters
+    max_band: float
+    # Clusters closer than this are just noise, not pen down / up
+    min_gap: float
+    # Smoothing factor of the cluster means, about 1 / samples remembered
+    alpha: float
+
+    # Cluster means (surface and hover) and how many samples each has seen
+    lo: float
+    hi: float
+    nlo: int
+    nhi: int
+    # Mean absolute deviation of the samples around the surface
+    noise: float
+
+    pressed: bool
+    # Sample time the other state was first seen at, if it's pending
+    since: Optional[float]
+    # Number of press / release transitions, and changes suppressed by the debounce
+    edges: int
+    bounces: int
+
+    def __init__(
+        self,
+        default: float = 0.065,
+        debounce: float = 0.02,
+        min_band: float = 0.004,
+        max_band: float = 0.25,
+        min_gap: float = 0.02,
+        alpha: float = 0.02,
+    ):
+        self.default = default
+        self.override = None
+        self.debounce = debounce
+        self.min_band = min_band
+        self.max_band = max_band
+        self.min_gap = min_gap
+        self.alpha = alpha
+
+        # Start out with the default threshold right between the clusters
+        self.lo = 0.0
+        self.hi = 2 * default
+        self.nlo = 0
+        self.nhi = 0
+        self.noise = 0.0
+
+        self.pressed = False
+        self.since = None
+        self.edges = 0
+        self.bounces = 0
+
+    @property
+    def auto(self) -> bool:
+        return (
+            self.nlo * self.alpha > 1
+            and self.nhi * self.alpha > 1
+            and self.hi - self.lo > self.min_gap
+        )
+
+    @property
+    def threshold(self) -> float:
+        if self.override is not None:
+            return self.override
+        if self.auto:
+            return (self.lo + self.hi) / 2
+        return self.default
+
+    @property
+    def band(self) -> float:
+        # Wide enough for the noise, but never so wide that one side can't be reached
+        return min(
+            max(self.min_band, 2 * self.noise), self.max_band * (self.hi - self.lo)
+        )
+
+    def learn(self, z: float):
+        # Assign to the nearest cluster and move its mean. Exponential averages keep
+        # following the session (the surface moves when the calibration is off).
+        # The hover mean moves up by at most alpha * min_gap per sample (down it
+        # follows freely), so the pen being far away for a while (or a tracking
+        # glitch) doesn't drag it away from the height the pen is lifted to between
+        # strokes
+        if abs(z - self.lo) <= abs(z - self.hi):
+            self.nlo += 1
+            dev = z - self.lo
+            self.lo += self.alpha * dev
+            gap = max(self.hi - self.lo, self.min_gap)
+            self.noise += self.alpha * (min(abs(dev), gap) - self.noise)
+        else:
+            self.nhi += 1
+            self.hi += self.alpha * min(z - self.hi, self.min_gap)
+
+    # Returns whether the pen is down after this sample
+    def update(self, z: float, t: float) -> bool:
+        self.learn(z)
+
+        thresh = self.threshold
+        band = self.band if self.override is None else self.min_band
+        if self.pressed:
+            other = z > thresh + band
+        else:
+            other = z < thresh - band
+
+        if not other:
+            if self.since is not None:
+                self.bounces += 1
+            self.since = None
+        elif self.since is None:
+            self.since = t
+        if self.since is not None and t - self.since >= self.debounce:
+            self.pressed = not self.pressed
+            self.since = None
+            self.edges += 1
+
+        return self.pressed
+
+    # How hard the pen presses: 0 when up, rising to 1 as z gets down to the surface
+    def pressure(self, z: float) -> float:
+        if not self.pressed:
+            return 0.0
+        thresh = self.threshold
+        depth = (thresh - z) / max(thresh - self.lo, 1e-6)
+        # Still touching in the hysteresis band above the threshold
+        return min(max(depth, 0.05), 1.0)
+
+    def summary(self) -> str:
+        mode = "override" if self.override is not None else (
+            "auto" if self.auto else "default"
+        )
+        return (
+            f"Pen threshold {self.threshold:.4f} ({mode}), surface {self.lo:.4f}, "
+            f"hover {self.hi:.4f}, {self.edges} transitions, {self.bounces} bounces suppressed"
+        )
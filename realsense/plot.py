@@ -1,5 +1,6 @@
 from .state import Position
-from .source import DataSource, Projection
+from .source import Projection
+from .plotter import Plotter, ProjectionView
 
 from matplotlib.figure import Figure
 from matplotlib.widgets import Button, Slider
@@ -8,18 +9,12 @@ from matplotlib.collections import PathCollection
 from mpl_toolkits.mplot3d.axes3d import Axes3D
 from mpl_toolkits.mplot3d.art3d import Path3DCollection, Poly3DCollection
 from typing import Optional
-from time import sleep
 from datetime import datetime
 import matplotlib.pyplot as plt
 import matplotlib.colors
 import matplotlib
 import numpy as np
 import logging
-import traceback
-import sys
-
-if sys.platform == "linux":
-    import uinput
 
 log = logging.getLogger(__name__)
 
@@ -35,18 +30,20 @@ def get_lims(arr: np.ndarray, lims: tuple[float, float]) -> tuple[float, float]:
     return (min, max)
 
 
-class ProjPlotter:
-    plot: "Plotter"
+class ProjPlotter(ProjectionView):
+    plot: "MplPlotter"
     proj: Projection
     ax: Axes
     path: PathCollection
     slider: Slider
+    # Hands the threshold back to the automatic estimate after using the slider
+    auto: Button
     # Graph objects that need to be removed when recalibrating
     objects: list[Poly3DCollection]
     xlim: tuple[float, float]
     ylim: tuple[float, float]
 
-    def __init__(self, proj: "Projection", plot: "Plotter"):
+    def __init__(self, proj: "Projection", plot: "MplPlotter"):
         self.proj = proj
         self.plot = plot
         self.xlim = (0, 1)
@@ -58,9 +55,12 @@ class ProjPlotter:
             label="Z threshold",
             valmin=0,
             valmax=1,
-            valinit=self.proj.zthresh,
+            valinit=self.proj.pen.threshold,
         )
         self.slider.on_changed(self.on_slider)
+        auto_ax = self.plot.fig.add_axes((0.45, 0.05, 0.1, 0.075))
+        self.auto = Button(auto_ax, "Auto threshold")
+        self.auto.on_clicked(self.on_auto)
 
         origin = self.proj.origin
         x, y, z = self.proj.basis
@@ -89,12 +89,27 @@ class ProjPlotter:
         self.plot.ax.set_subplotspec(gs[0, 0])
 
     def on_slider(self, val: float):
-        self.proj.zthresh = val
-        # log.info(f"Set Z threshold to {self.zthresh}")
+        self.proj.pen.override = val
+        log.info(f"Set Z threshold to {val}")
+
+    def on_auto(self, event):
+        self.proj.pen.override = None
+        log.info("Using automatic Z threshold")
 
     def update(self, pos: Position):
         projs = np.column_stack((pos.x, pos.y, pos.z))
 
+        title = self.proj.latency.title()
+        if title != self.ax.get_title():
+            self.ax.set_title(title)
+        thresh = self.proj.pen.threshold
+
+        if self.proj.pen.override is None and thresh != self.slider.val:
+            # Follow the automatic threshold without turning it into an override
+            self.slider.eventson = False
+            self.slider.set_val(thresh)
+            self.slider.eventson = True
+
         if not len(projs) == 0:
             # Only take the x and y components
             trunc = projs[:, [0, 1]]
@@ -105,7 +120,7 @@ class ProjPlotter:
 
             # Color map
             # print(projs[:, 2])
-            mask = projs[:, 2] > self.proj.zthresh
+            mask = projs[:, 2] > thresh
             colors = np.zeros((len(projs), 4))
             colors[mask] = matplotlib.colors.to_rgba("red", 0.3)
             colors[~mask] = matplotlib.colors.to_rgba("blue", 1.0)
@@ -113,8 +128,15 @@ class ProjPlotter:
 
             self.path.set_offsets(trunc)
 
+    def clear(self):
+        self.path.set_offsets(np.empty((0, 2)))
+
+    def remove(self):
+        for obj in self.objects:
+            obj.remove()
 
-class Plotter:
+
+class MplPlotter(Plotter):
     fig: Figure
     ax: Axes3D
     # For current data source
@@ -123,40 +145,13 @@ class Plotter:
     ylim: tuple[float, float]
     zlim: tuple[float, float]
 
-    data: Optional[DataSource]
-
     # Buttons
     calibrate: Button
     clear: Button
 
-    # Input / output filenames
-    recfile: str
-    calfile: str
-
-    # Preferences
-    recanim: Optional[bool]
-
-    # State variables
-    should_calibrate: bool
-    calibrating: bool
-    should_exit: bool
-    cursor: bool
     last_flush: datetime
 
-    def __init__(
-        self,
-        calfile: str,
-        recfile: str,
-        calanim: bool,
-        cursor: bool,
-        # If this is None, then it signifies that no
-        # recording should be queued.
-        recanim: Optional[bool],
-    ):
-        # Circular import otherwise
-        from .replay import FileSource
-        from .record import SocketSource
-
+    def setup(self):
         try:
             matplotlib.use("qtagg", force=True)
         except ImportError:
@@ -185,61 +180,15 @@ class Plotter:
         self.calibrate = Button(cal_ax, "Calibrate axes")
         self.calibrate.on_clicked(self.on_calibrate)
 
-        self.data = None
-        self.calfile = calfile
-        self.recfile = recfile
-        self.recanim = recanim
-
+        self.path = None
         self.xlim = (-0.5, 0.5)
         self.ylim = (-0.5, 0.5)
         self.zlim = (-0.5, 0.5)
-
-        self.should_calibrate = False
-        self.calibrating = False
-        self.should_exit = False
-        self.cursor = cursor
         self.last_flush = datetime.now()
 
-        # Some initial data source setup depending on mode
-        try:
-            self.path = None
-            self.data = FileSource(self, calanim, self.calfile, True)
-            self.reset_path(True)
-            self.calibrating = True
-            log.info("Found calibration file")
-        except FileNotFoundError:
-            # Ok, whatever
-            log.warning("File specified was not able to be opened for reading")
-
-        if self.data is None:
-            if self.recanim is None:
-                log.info("Using socket source")
-                self.data = SocketSource(self, self.recfile)
-            else:
-                log.info("Using file source without calibration file")
-                self.data = FileSource(self, self.recanim, self.recfile, False)
-            self.reset_path(False)
-
-        if self.recanim is not None:
-            # We know we're in a replay; so don't
-            # allow the user to do some weird stuff
-            log.info("Disabling buttons for replay mode")
-            self.clear.set_active(False)
-            self.calibrate.set_active(False)
-
-    def on_calibrate(self, event):
-        self.should_calibrate = True
-        self.data.on_close()
-
-    def on_clear(self, event):
-        if self.data:
-            self.data.on_clear()
-
-    def on_close(self, event):
-        if self.data:
-            self.data.on_close()
-
-        self.should_exit = True
+    def disable_buttons(self):
+        self.clear.set_active(False)
+        self.calibrate.set_active(False)
 
     def reset_path(self, calibrate: bool):
         log.debug("Resetting path collection")
@@ -250,50 +199,16 @@ class Plotter:
 
         self.path = self.ax.scatter([], [], [], s=50, alpha=alpha)
 
-    def run(self):
-        # Circular import otherwise
-        from .record import SocketSource
-        from .replay import FileSource
-
-        try:
-            while self.data is not None:
-                pts = self.data.run()
-                self.data = None
-
-                # From callback - this is only interactive calibration
-                if self.should_calibrate:
-                    log.debug("Entering calibration mode")
-                    self.data = SocketSource(self, self.calfile, True)
-                    self.reset_path(True)
-                    self.should_calibrate = False
-                    self.calibrating = True
-
-                # Done calibrating, now fall back to original thing
-                elif self.calibrating:
-                    log.debug("Finished calibrating")
-                    assert pts is not None
-                    proj = Projection(self, pts, self.cursor)
-                    if self.recanim is not None:
-                        self.data = FileSource(
-                            self, self.recanim, self.recfile, False, proj
-                        )
-                    else:
-                        self.data = SocketSource(self, self.recfile, False, proj)
-
-                    self.reset_path(False)
-                    self.calibrating = False
-
-        except Exception as e:
-            log.info(f"Got exception in data source: {e}")
-            log.info(f"Stack trace: {traceback.format_exc()}")
-            if self.should_exit:
-                return
-
-        log.info("All data sources have exited, turning off interactive graph")
-
+    def show(self):
         plt.ioff()
         plt.show()
 
+    def mark(self, pt: np.ndarray) -> Poly3DCollection:
+        return self.ax.scatter(*pt, c="red", s=100)
+
+    def projection_view(self, proj: Projection) -> ProjPlotter:
+        return ProjPlotter(proj, self)
+
     def set_title(self, title: str):
         self.ax.set_title(title)
 
@@ -0,0 +1,406 @@
+# The plotter runs the data sources and the calibration, and shows what they produce
+# through a view. The views subclass `Plotter`: `MplPlotter` (plot.py) draws with
+# matplotlib, `QtPlotter` (qtplot.py) straight with QPainter. -r picks one.
+# Nothing here imports a GUI toolkit, so a view only pays for its own.
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional, Protocol
+import logging
+import traceback
+
+import numpy as np
+
+from .latency import LatencyTracker
+from .sink import Sink
+from .source import DataSource, Projection
+from .state import Position
+from .tip import PenTip
+
+if TYPE_CHECKING:
+    from .catalog import Catalog
+    from .fusion import LiveFusion
+    from .history import Archive
+    from .ink import InkSink
+    from .recognize import OcrSink
+    from .shm import Publisher
+
+log = logging.getLogger(__name__)
+
+
+class Marker(Protocol):
+    # Something drawn on the plot that can be taken off again
+    def remove(self) -> None: ...
+
+
+class ProjectionView(ABC):
+    # Shows a Projection: the plane in the 3D view and the projected positions
+    @abstractmethod
+    def update(self, pos: Position):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    # Takes everything this view added back off the plot (when recalibrating)
+    @abstractmethod
+    def remove(self):
+        pass
+
+
+class Plotter(ABC):
+    data: Optional[DataSource]
+
+    # Input / output filenames
+    recfile: str
+    calfile: str
+
+    # Preferences
+    recanim: Optional[bool]
+    # IMU capture to fuse into the replay, and its clock offset (estimated if None).
+    # When recording: the pen's BLE address ("" to look for it) or a capture to stream
+    imu: Optional[str]
+    imu_offset: Optional[float]
+    # Fuses the pen's IMU into live tracking, for the whole session (if imu is set)
+    fusion: Optional["LiveFusion"]
+    # Camera index or video file to track the pen in instead of using the tool tracker
+    video: Optional[str]
+    video_pixels: bool
+    video_kcf: bool
+    video_flow: bool
+    # Where to broadcast projected positions to, if anywhere
+    broadcast: Optional[str]
+    # Seconds to predict the cursor ahead by
+    predict: float
+    # Cursor updates per second (None for the display rate, 0 for every sample)
+    cursor_rate: Optional[float]
+    # Place the cursor like a tablet instead of moving it like a mouse
+    absolute: bool
+    # Offset from the marker to the pen tip, if the tip is tracked instead of the marker
+    tip: Optional[PenTip]
+    # File to keep the projected history in (a temporary file if None)
+    history: Optional[str]
+    # The projected history of the whole session, across recalibrations
+    archive: Optional["Archive"]
+    # Files to export the strokes to, and their sinks (made with the first projection,
+    # and kept for the whole session)
+    ink: list[str]
+    ink_sinks: list["InkSink"]
+    # Handwriting recognition: where its text goes ("" to only log it, None to not
+    # recognize), and its sink (also kept for the whole session)
+    ocr: Optional[str]
+    ocr_sink: Optional["OcrSink"]
+    # Publishes the raw and projected positions to other processes, if set
+    publisher: Optional["Publisher"]
+    # Where recordings are indexed once written, if anywhere
+    catalog: Optional["Catalog"]
+    # Tracker to cursor latency, kept across recalibrations
+    latency: LatencyTracker
+
+    # State variables
+    should_calibrate: bool
+    calibrating: bool
+    should_exit: bool
+    cursor: bool
+
+    def __init__(
+        self,
+        calfile: str,
+        recfile: str,
+        calanim: bool,
+        cursor: bool,
+        # If this is None, then it signifies that no
+        # recording should be queued.
+        recanim: Optional[bool],
+        imu: Optional[str] = None,
+        imu_offset: Optional[float] = None,
+        video: Optional[str] = None,
+        video_pixels: bool = False,
+        video_kcf: bool = False,
+        video_flow: bool = False,
+        broadcast: Optional[str] = None,
+        predict: float = 0.0,
+        cursor_rate: Optional[float] = None,
+        absolute: bool = True,
+        tip: Optional[PenTip] = None,
+        history: Optional[str] = None,
+        ink: Optional[list[str]] = None,
+        ocr: Optional[str] = None,
+        shm: Optional[str] = None,
+        catalog: Optional[str] = None,
+    ):
+        # Circular import otherwise
+        from .replay import FileSource
+
+        self.data = None
+        self.calfile = calfile
+        self.recfile = recfile
+        self.recanim = recanim
+        self.imu = imu
+        self.imu_offset = imu_offset
+        self.fusion = None
+        self.video = video
+        self.video_pixels = video_pixels
+        self.video_kcf = video_kcf
+        self.video_flow = video_flow
+        self.broadcast = broadcast
+        self.predict = predict
+        self.cursor_rate = cursor_rate
+        self.absolute = absolute
+        self.tip = tip
+        self.history = history
+        self.archive = None
+        self.ink = [] if ink is None else ink
+        self.ink_sinks = []
+        self.ocr = ocr
+        self.ocr_sink = None
+        self.publisher = None
+        if shm is not None:
+            from .shm import Publisher
+
+            self.publisher = Publisher(shm)
+        self.catalog = None
+        if catalog is not None:
+            from .catalog import Catalog
+
+            self.catalog = Catalog(catalog)
+        self.latency = LatencyTracker()
+
+        self.should_calibrate = False
+        self.calibrating = False
+        self.should_exit = False
+        self.cursor = cursor
+
+        self.setup()
+
+        # Some initial data source setup depending on mode
+        try:
+            if calanim:
+                # Show the calibration being found
+                self.data = FileSource(self, calanim, self.calfile, True)
+                self.reset_path(True)
+                self.calibrating = True
+            else:
+                self.load_calibration()
+            log.info("Found calibration file")
+        except FileNotFoundError:
+            # Ok, whatever
+            log.warning("File specified was not able to be opened for reading")
+
+        if self.data is None:
+            if self.recanim is None:
+                self.data = self.live_source(self.recfile, False, None)
+            else:
+                log.info("Using file source without calibration file")
+                self.data = self.replay_source(None)
+            self.reset_path(False)
+
+        if self.recanim is not None:
+            # We know we're in a replay; so don't
+            # allow the user to do some weird stuff
+            log.info("Disabling buttons for replay mode")
+            self.disable_buttons()
+
+    # Creates the window, before any data source exists
+    @abstractmethod
+    def setup(self):
+        pass
+
+    # Starts a new path for the positions, faded while calibrating
+    @abstractmethod
+    def reset_path(self, calibrate: bool):
+        pass
+
+    @abstractmethod
+    def set_title(self, title: str):
+        pass
+
+    # Shows the latest positions (called whenever a data source has new ones)
+    @abstractmethod
+    def update(self, pos: Position):
+        pass
+
+    # Lets the GUI handle its events (called on every loop)
+    @abstractmethod
+    def flush(self):
+        pass
+
+    # Marks a calibration point
+    @abstractmethod
+    def mark(self, pt: np.ndarray) -> Marker:
+        pass
+
+    @abstractmethod
+    def projection_view(self, proj: Projection) -> ProjectionView:
+        pass
+
+    @abstractmethod
+    def disable_buttons(self):
+        pass
+
+    # Keeps the window open once all data sources are done, until it's closed
+    @abstractmethod
+    def show(self):
+        pass
+
+    def on_calibrate(self, event=None):
+        self.should_calibrate = True
+        self.data.on_close()
+
+    def on_clear(self, event=None):
+        if self.data:
+            self.data.on_clear()
+
+    def on_close(self, event=None):
+        if self.data:
+            self.data.on_close()
+
+        self.should_exit = True
+
+    def run(self):
+        try:
+            while self.data is not None:
+                pts = self.data.run()
+                self.data = None
+
+                # From callback - this is only interactive calibration
+                if self.should_calibrate:
+                    log.debug("Entering calibration mode")
+                    self.data = self.live_source(self.calfile, True, None)
+                    self.reset_path(True)
+                    self.should_calibrate = False
+                    self.calibrating = True
+
+                # Done calibrating, now fall back to original thing
+                elif self.calibrating:
+                    log.debug("Finished calibrating")
+                    assert pts is not None
+                    self.start_projection(pts)
+
+        except Exception as e:
+            log.info(f"Got exception in data source: {e}")
+            log.info(f"Stack trace: {traceback.format_exc()}")
+            if self.should_exit:
+                return
+        finally:
+            # Readers see the stream end
+            if self.publisher is not None:
+                self.publisher.close()
+            if self.catalog is not None:
+                self.catalog.close()
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+            for sink in self.ink_sinks:
+                sink.close()
+            self.ink_sinks = []
+            if self.ocr_sink is not None:
+                self.ocr_sink.close()
+                self.ocr_sink = None
+            if self.fusion is not None:
+                self.fusion.close()
+                self.fusion = None
+
+        log.info("All data sources have exited, turning off interactive graph")
+        self.show()
+
+    def load_calibration(self):
+        # Finds the corners in the whole calibration file at once instead of
+        # replaying it, so the projection is ready right away
+        from .calibration import load_points
+
+        start = datetime.now()
+        pts = load_points(self.calfile, self.tip)
+        if pts is None:
+            return
+        log.info(
+            f"Calibrated from {self.calfile} in "
+            f"{(datetime.now() - start).total_seconds() * 1000:.0f} ms"
+        )
+        self.set_title("Position plot (calibrated)")
+        self.start_projection(pts)
+
+    def start_projection(self, pts: list[np.ndarray]):
+        if self.archive is None:
+            from .history import Archive
+
+            self.archive = Archive(self.history)
+        proj = Projection(
+            self,
+            pts,
+            self.cursor,
+            self.make_sinks(),
+            self.predict,
+            self.cursor_rate,
+            self.absolute,
+            self.archive,
+        )
+        if self.recanim is not None:
+            self.data = self.replay_source(proj)
+        else:
+            self.data = self.live_source(self.recfile, False, proj)
+
+        self.reset_path(False)
+        self.calibrating = False
+
+    def make_sinks(self) -> list[Sink]:
+        sinks: list[Sink] = []
+        if self.broadcast is not None:
+            from .sink import BroadcastSink
+
+            sinks.append(BroadcastSink(self.broadcast))
+        if len(self.ink) > 0 and len(self.ink_sinks) == 0:
+            from .ink import ink_sink
+
+            self.ink_sinks = [ink_sink(file) for file in self.ink]
+        # The same files after recalibrating (on_calibrate is called again)
+        sinks.extend(self.ink_sinks)
+        if self.ocr is not None:
+            if self.ocr_sink is None:
+                from .recognize import OcrSink
+
+                self.ocr_sink = OcrSink(self.ocr or None)
+            sinks.append(self.ocr_sink)
+        if self.publisher is not None:
+            sinks.append(self.publisher.sink())
+        return sinks
+
+    def live_source(
+        self, file: str, calibrate: bool, proj: Optional[Projection]
+    ) -> DataSource:
+        if self.video is not None:
+            from .video import VideoSource, video_source
+
+            log.info("Using video source")
+            return VideoSource(
+                self,
+                file,
+                video_source(self.video),
+                calibrate,
+                proj,
+                self.video_pixels,
+                self.video_kcf,
+                self.video_flow,
+            )
+        else:
+            from .record import SocketSource
+
+            if self.imu is not None and self.fusion is None:
+                from .fusion import LiveFusion
+
+                self.fusion = LiveFusion(self.imu, self.imu_offset)
+            log.info("Using socket source")
+            return SocketSource(self, file, calibrate, proj)
+
+    def replay_source(self, proj: Optional[Projection]) -> DataSource:
+        assert self.recanim is not None
+        if self.imu is not None:
+            from .fusion import FusionSource
+
+            return FusionSource(
+                self, self.recanim, self.recfile, self.imu, self.imu_offset, False, proj
+            )
+        else:
+            from .replay import FileSource
+
+            return FileSource(self, self.recanim, self.recfile, False, proj)
@@ -0,0 +1,177 @@
+# Dead reckoning for the cursor.
+#
+# An alpha-beta-gamma filter tracks the projected position, velocity and acceleration
+# in tracker time, and the cursor is sent to where the pen will be `horizon` seconds
+# from now instead of where it was. That hides a good part of the tracker + network +
+# pipeline lag. Extrapolating a pen that's stopping overshoots, so the prediction is
+# damped when the pen slows down or is lifted, and never reaches further than `reach`.
+# Every prediction is also checked against where the pen actually got to, so the gain
+# can be measured on replays: python -m realsense -nc -cf <cal> -f <rec> -pr 30 replay
+from collections import deque
+from typing import Optional
+import logging
+import math
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Seconds a prediction may be off from a pose's time and still be scored against it
+MATCH = 0.02
+
+
+class Predictor:
+    # Seconds to predict ahead
+    horizon: float
+    # Filter gains. Poses only come at ~20 Hz and the pen changes direction a lot
+    # between them, so velocity follows the latest difference closely. The defaults
+    # were tuned on samples/eric.csv and hi.csv (30 ms ahead: p50 error down ~40%). On
+    # samples/calibrate.csv, which they weren't tuned on and where the pen mostly rests,
+    # p50 is about the same and p90 ~10% worse, so check them on your own recordings
+    alpha: float
+    beta: float
+    gamma: float
+    # Below this speed (units / s) the prediction fades out
+    stop_speed: float
+    # How much of the prediction is used while the pen is up
+    up_factor: float
+    # Furthest (units) a prediction may be from the last pose
+    reach: float
+    # Seconds without a new pose after which the pen counts as stopped
+    stale: float
+
+    # Filtered position, velocity and acceleration as of the last new pose
+    pos: Optional[tuple[float, float]]
+    vel: tuple[float, float]
+    acc: tuple[float, float]
+    # The last new pose and its time. The tracker repeats the last pose in every packet
+    # until the camera has a new frame (about 1 in 5 packets at 100 Hz), so the cursor
+    # is also dead reckoned across the repeats.
+    pose: Optional[tuple[float, float]]
+    t: float
+
+    # (time it's for, predicted x / y, x / y the cursor would've had without prediction)
+    pending: deque[tuple[float, float, float, float, float]]
+    # Errors (units) against where the pen actually was, with and without prediction
+    errors: np.ndarray
+    baseline: np.ndarray
+    checked: int
+
+    def __init__(
+        self,
+        horizon: float,
+        alpha: float = 0.9,
+        beta: float = 1.0,
+        gamma: float = 0.005,
+        stop_speed: float = 0.05,
+        up_factor: float = 0.5,
+        reach: float = 0.05,
+        stale: float = 0.15,
+        history: int = 8192,
+    ):
+        self.horizon = horizon
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.stop_speed = stop_speed
+        self.up_factor = up_factor
+        self.reach = reach
+        self.stale = stale
+
+        self.pos = None
+        self.vel = (0.0, 0.0)
+        self.acc = (0.0, 0.0)
+        self.pose = None
+        self.t = 0.0
+
+        self.pending = deque()
+        self.errors = np.zeros(history)
+        self.baseline = np.zeros(history)
+        self.checked = 0
+
+    def filter(self, x: float, y: float, t: float):
+        if self.pos is None:
+            self.pos = (x, y)
+            return
+        dt = t - self.t
+        if dt <= 1e-4:
+            return
+
+        (px, py), (vx, vy), (ax, ay) = self.pos, self.vel, self.acc
+        # Predict to this pose, then correct by the residual
+        px += vx * dt + ax * dt * dt / 2
+        py += vy * dt + ay * dt * dt / 2
+        vx += ax * dt
+        vy += ay * dt
+        rx, ry = x - px, y - py
+        self.pos = (px + self.alpha * rx, py + self.alpha * ry)
+        self.vel = (vx + self.beta * rx / dt, vy + self.beta * ry / dt)
+        self.acc = (
+            ax + 2 * self.gamma * rx / (dt * dt),
+            ay + 2 * self.gamma * ry / (dt * dt),
+        )
+
+    # Returns where the cursor should be for this sample
+    def update(self, x: float, y: float, t: float, pressed: bool) -> tuple[float, float]:
+        if self.pose != (x, y):
+            self.check(x, y, t)
+            self.filter(x, y, t)
+            self.pose = (x, y)
+            self.t = t
+
+        (vx, vy), (ax, ay) = self.vel, self.acc
+        # From the last new pose to `horizon` past this sample
+        since = t - self.t
+        h = since + self.horizon
+        speed = math.hypot(vx, vy)
+        damp = min(speed / self.stop_speed, 1.0)
+        if since > self.stale:
+            # No new pose for a while, the pen has stopped
+            damp *= max(1 - (since - self.stale) / self.stale, 0.0)
+        if not pressed:
+            damp *= self.up_factor
+
+        dx = (vx * h + ax * h * h / 2) * damp
+        dy = (vy * h + ay * h * h / 2) * damp
+        dist = math.hypot(dx, dy)
+        if dist > self.reach:
+            dx, dy = dx * self.reach / dist, dy * self.reach / dist
+
+        predicted = (x + dx, y + dy)
+        # Poses come in time order, so predictions too old to match the next one never
+        # will (otherwise a pen resting between poses would pile them up)
+        while len(self.pending) > 0 and self.pending[0][0] < t - MATCH:
+            self.pending.popleft()
+        self.pending.append((t + self.horizon, predicted[0], predicted[1], x, y))
+        return predicted
+
+    def check(self, x: float, y: float, t: float):
+        # A new pose is where the pen really was at time t: score the prediction
+        # that was made for the time closest to it
+        best = None
+        while len(self.pending) > 0 and self.pending[0][0] <= t:
+            best = self.pending.popleft()
+        if len(self.pending) > 0 and (
+            best is None or self.pending[0][0] - t < t - best[0]
+        ):
+            best = self.pending[0]
+        if best is None or abs(best[0] - t) > MATCH:
+            return
+
+        _, px, py, rx, ry = best
+        i = self.checked % len(self.errors)
+        self.errors[i] = math.hypot(px - x, py - y)
+        self.baseline[i] = math.hypot(rx - x, ry - y)
+        self.checked += 1
+
+    def summary(self) -> str:
+        n = min(self.checked, len(self.errors))
+        if n == 0:
+            return "No predictions checked yet"
+        err = np.percentile(self.errors[:n], (50, 90))
+        base = np.percentile(self.baseline[:n], (50, 90))
+        return (
+            f"Prediction {self.horizon * 1000:.0f} ms ahead over {n} poses: "
+            f"error p50 {err[0]:.4f}, p90 {err[1]:.4f} "
+            f"(without prediction p50 {base[0]:.4f}, p90 {base[1]:.4f})"
+        )
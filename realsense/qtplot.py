@@ -0,0 +1,643 @@
+# QPainter renderer (-r qt).
+#
+# Matplotlib goes through its whole artist tree and a lot of per point Python on every
+# frame, which drops to a few FPS with tens of thousands of points. This draws with
+# QPainter straight from NumPy instead: points are written into a QPolygonF's buffer
+# in place and drawn with one drawPoints call per color, so a frame costs a few NumPy
+# operations and a handful of Qt calls however many points there are.
+# - The 3D view is an orthographic projection (drag to rotate), colored by time in
+#   BINS steps rather than per point.
+# - The 2D view of the projection only draws the samples that are new since the last
+#   frame, onto an image it keeps. It's redrawn from the history (both tiers, see
+#   history.py) when the window is resized, the limits grow, the threshold moves or
+#   the data is cleared.
+# Updates only mark the views as stale. They're repainted at most FPS times a second,
+# while events are handled every 10 ms like the Matplotlib renderer.
+# Usage: python -m realsense.qtplot [points] (ms per frame, offscreen)
+from typing import Optional
+import logging
+import math
+import sys
+import time
+
+import numpy as np
+from PyQt5.QtCore import QPoint, QPointF, QRectF, Qt
+from PyQt5.QtGui import (
+    QBrush,
+    QColor,
+    QImage,
+    QMouseEvent,
+    QPainter,
+    QPaintEvent,
+    QPen,
+    QPolygonF,
+)
+from PyQt5.QtWidgets import (
+    QApplication,
+    QHBoxLayout,
+    QLabel,
+    QPushButton,
+    QSlider,
+    QVBoxLayout,
+    QWidget,
+)
+
+from .plotter import Plotter, ProjectionView
+from .source import Projection
+from .state import Position
+
+log = logging.getLogger(__name__)
+
+FPS = 60
+# viridis_r, oldest to newest
+BINS = [
+    QColor(c)
+    for c in (
+        "#fde725",
+        "#a0da39",
+        "#4ac16d",
+        "#1fa187",
+        "#277f8e",
+        "#365c8d",
+        "#46327e",
+        "#440154",
+    )
+]
+# Point size (px). Wider points take a lot longer to fill
+SIZE = 3
+# Slider steps between 0 and 1
+STEPS = 1000
+# How far the automatic threshold moves before the 2D view is redrawn with it
+RETHRESHOLD = 0.005
+# Room left around the data when the 2D limits grow, so they don't grow every sample
+MARGIN = 0.1
+
+
+def polygon(pts: np.ndarray) -> QPolygonF:
+    # (N, 2) points into a QPolygonF, copied straight into its buffer
+    poly = QPolygonF(len(pts))
+    if len(pts) > 0:
+        ptr = poly.data()
+        ptr.setsize(len(pts) * 2 * 8)
+        np.frombuffer(ptr, np.float64).reshape(-1, 2)[:] = pts
+    return poly
+
+
+def grow(lo: float, hi: float, arr: np.ndarray) -> tuple[float, float]:
+    # Limits that take in arr, with some margin, or the same ones if they already do
+    amin, amax = float(arr.min()), float(arr.max())
+    if amin >= lo and amax <= hi:
+        return lo, hi
+    lo, hi = min(lo, amin), max(hi, amax)
+    pad = (hi - lo) * MARGIN
+    return lo - pad, hi + pad
+
+
+class Point:
+    # A calibration point in the 3D view
+    canvas: "Canvas3D"
+    pt: np.ndarray
+
+    def __init__(self, canvas: "Canvas3D", pt: np.ndarray):
+        self.canvas = canvas
+        self.pt = pt
+        canvas.markers.append(self)
+        canvas.update()
+
+    def remove(self):
+        self.canvas.markers.remove(self)
+        self.canvas.update()
+
+
+class Canvas3D(QWidget):
+    title: str
+    # Positions shown are rows start:end of this (t, x, y, z) buffer. New ones are
+    # added at the end, and the buffer starts over when that runs out
+    buf: np.ndarray
+    start: int
+    end: int
+    # Faded while calibrating
+    alpha: float
+    # Limits (3, 2), which only grow like the Matplotlib ones
+    lims: np.ndarray
+    markers: list[Point]
+    # Calibrated planes: origin and basis
+    planes: list[tuple[np.ndarray, np.ndarray]]
+
+    # Rotation (radians) and where a drag started
+    yaw: float
+    pitch: float
+    drag: Optional[QPoint]
+
+    def __init__(self):
+        super().__init__()
+        self.setMinimumSize(300, 300)
+        self.title = ""
+        self.buf = np.empty((0, 4))
+        self.start = self.end = 0
+        self.alpha = 1.0
+        self.lims = np.array([[-0.5, 0.5]] * 3)
+        self.markers = []
+        self.planes = []
+        self.yaw = math.radians(-60)
+        self.pitch = math.radians(30)
+        self.drag = None
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def extend(self, data: np.ndarray, keep: int):
+        # Adds (N, 4) samples, only showing the newest keep
+        data = data[len(data) - keep :] if len(data) > keep else data
+        n = len(data)
+        if n == 0:
+            return
+        if self.end + n > len(self.buf):
+            old = self.buf[max(self.start, self.end + n - keep) : self.end]
+            self.buf = np.empty((max(2 * keep, len(old) + n), 4))
+            self.buf[: len(old)] = old
+            self.start, self.end = 0, len(old)
+        self.buf[self.end : self.end + n] = data
+        self.end += n
+        self.start = max(self.start, self.end - keep)
+        pts = data[:, 1:]
+        self.lims[:, 0] = np.minimum(self.lims[:, 0], pts.min(axis=0))
+        self.lims[:, 1] = np.maximum(self.lims[:, 1], pts.max(axis=0))
+
+    def screen(self, pts: np.ndarray) -> np.ndarray:
+        # World (N, 3) to widget (N, 2) coordinates
+        cy, sy = math.cos(self.yaw), math.sin(self.yaw)
+        cp, sp = math.cos(self.pitch), math.sin(self.pitch)
+        # Rows: screen right and screen up
+        rot = np.array([[cy, -sy, 0.0], [sy * sp, cy * sp, cp]])
+        center = self.lims.mean(axis=1)
+        # Half the diagonal of the limits fits the smaller side of the widget
+        radius = max(float(np.linalg.norm(self.lims[:, 1] - self.lims[:, 0])) / 2, 1e-9)
+        scale = min(self.width(), self.height()) * 0.45 / radius
+        # Everything in one matrix product and an add, screen y points down
+        m = rot.T * [scale, -scale]
+        return pts @ m + ([self.width() / 2, self.height() / 2] - center @ m)
+
+    def paintEvent(self, event: QPaintEvent):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+
+        # Edges of the limits box, for depth
+        lo, hi = self.lims[:, 0], self.lims[:, 1]
+        corners = np.array(
+            [[(hi if i >> k & 1 else lo)[k] for k in range(3)] for i in range(8)]
+        )
+        sc = self.screen(corners)
+        painter.setPen(QPen(QColor(200, 200, 200), 1))
+        for i in range(8):
+            for k in range(3):
+                if not i >> k & 1:
+                    j = i | 1 << k
+                    painter.drawLine(QPointF(*sc[i]), QPointF(*sc[j]))
+        for k, name in enumerate("XYZ"):
+            # Label each axis where it leaves the low corner
+            painter.drawText(QPointF(*sc[1 << k]), name)
+
+        for origin, basis in self.planes:
+            x, y, z = basis
+            quad = self.screen(np.array([origin, origin + x, origin + x + y, origin + y]))
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QBrush(QColor(31, 119, 180, 50)))
+            painter.drawPolygon(polygon(quad))
+            ends = self.screen(np.array([origin, origin + x, origin + y, origin + z]))
+            for end, color in zip(ends[1:], (Qt.blue, Qt.darkGreen, Qt.magenta)):
+                painter.setPen(QPen(QColor(color), 2))
+                painter.drawLine(QPointF(*ends[0]), QPointF(*end))
+
+        n = len(self)
+        if n > 0:
+            t = self.buf[self.start : self.end, 0]
+            sp = self.screen(self.buf[self.start : self.end, 1:])
+            # Times only go forward, so each color is one slice
+            edges = np.linspace(t[0], t[-1], len(BINS) + 1)[1:-1]
+            bounds = np.r_[0, np.searchsorted(t, edges), n]
+            for color, a, b in zip(BINS, bounds[:-1], bounds[1:]):
+                if b > a:
+                    c = QColor(color)
+                    c.setAlphaF(self.alpha)
+                    painter.setPen(QPen(c, SIZE))
+                    painter.drawPoints(polygon(sp[a:b]))
+
+        if len(self.markers) > 0:
+            painter.setPen(QPen(Qt.red, 10, cap=Qt.RoundCap))
+            painter.drawPoints(polygon(self.screen(np.array([m.pt for m in self.markers]))))
+
+        painter.setPen(Qt.black)
+        painter.drawText(
+            QRectF(0, 4, self.width(), 20), Qt.AlignHCenter | Qt.AlignTop, self.title
+        )
+        painter.end()
+
+    def mousePressEvent(self, event: QMouseEvent):
+        self.drag = event.pos()
+
+    def mouseMoveEvent(self, event: QMouseEvent):
+        if self.drag is None:
+            return
+        d = event.pos() - self.drag
+        self.drag = event.pos()
+        self.yaw -= d.x() * 0.01
+        self.pitch = min(max(self.pitch + d.y() * 0.01, -math.pi / 2), math.pi / 2)
+        self.update()
+
+    def mouseReleaseEvent(self, event: QMouseEvent):
+        self.drag = None
+
+
+class Canvas2D(QWidget):
+    title: str
+    # Everything drawn so far, only added to until it's redrawn
+    image: QImage
+    xlim: tuple[float, float]
+    ylim: tuple[float, float]
+
+    def __init__(self):
+        super().__init__()
+        self.setMinimumSize(300, 300)
+        self.title = ""
+        self.xlim = (0, 1)
+        self.ylim = (0, 1)
+        self.image = QImage(1, 1, QImage.Format_ARGB32_Premultiplied)
+        self.reset()
+
+    def reset(self):
+        if self.image.size() != self.size():
+            self.image = QImage(self.size(), QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(Qt.white)
+
+    def fits(self, data: np.ndarray) -> bool:
+        # Grows the limits to fit (N, 4) samples, False if they had to grow
+        xlim = grow(*self.xlim, data[:, 1])
+        ylim = grow(*self.ylim, data[:, 2])
+        same = xlim == self.xlim and ylim == self.ylim
+        self.xlim, self.ylim = xlim, ylim
+        return same
+
+    def draw(self, data: np.ndarray, thresh: float):
+        # Adds (N, 4) samples to the image, pen up in faded red and pen down in blue
+        w, h = self.image.width(), self.image.height()
+        (x0, x1), (y0, y1) = self.xlim, self.ylim
+        px = np.column_stack(
+            ((data[:, 1] - x0) * (w / (x1 - x0)), h - (data[:, 2] - y0) * (h / (y1 - y0)))
+        )
+        up = data[:, 3] > thresh
+        painter = QPainter(self.image)
+        painter.setPen(QPen(QColor(255, 0, 0, 77), SIZE))
+        painter.drawPoints(polygon(px[up]))
+        painter.setPen(QPen(Qt.blue, SIZE))
+        painter.drawPoints(polygon(px[~up]))
+        painter.end()
+
+    def paintEvent(self, event: QPaintEvent):
+        painter = QPainter(self)
+        # Stretched until it's redrawn at the new size
+        painter.drawImage(QRectF(self.rect()), self.image)
+        painter.setPen(Qt.gray)
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+        (x0, x1), (y0, y1) = self.xlim, self.ylim
+        h = self.height()
+        painter.drawText(QPointF(4, h - 4), f"({x0:.2f}, {y0:.2f})")
+        painter.drawText(
+            QRectF(0, 0, self.width() - 4, 20),
+            Qt.AlignRight | Qt.AlignVCenter,
+            f"({x1:.2f}, {y1:.2f})",
+        )
+        painter.setPen(Qt.black)
+        painter.drawText(
+            QRectF(0, 20, self.width(), 20), Qt.AlignHCenter | Qt.AlignTop, self.title
+        )
+        painter.end()
+
+
+class QtProjView(ProjectionView):
+    plot: "QtPlotter"
+    proj: Projection
+    canvas: Canvas2D
+    slider: QSlider
+    label: QLabel
+    auto: QPushButton
+    # Latest positions, drawn on the next frame
+    pos: Optional[Position]
+    stale: bool
+
+    # pos.count when last drawn
+    drawn: int
+    # The plane in the 3D view
+    plane: tuple[np.ndarray, np.ndarray]
+    # Threshold the image was drawn with
+    thresh: float
+    # Only samples from here on are shown (set when cleared)
+    since: float
+    # Redraw everything on the next frame
+    rebuild: bool
+
+    def __init__(self, proj: Projection, plot: "QtPlotter"):
+        self.proj = proj
+        self.plot = plot
+        self.pos = None
+        self.stale = False
+        self.drawn = 0
+        self.thresh = proj.pen.threshold
+        # The archive has the projections before this one too (from another calibration)
+        self.since = float(np.nextafter(proj.archive.last, math.inf))
+        self.rebuild = True
+
+        self.canvas = Canvas2D()
+        self.label = QLabel()
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setRange(0, STEPS)
+        self.follow(self.thresh)
+        self.slider.valueChanged.connect(self.on_slider)
+        self.auto = QPushButton("Auto threshold")
+        self.auto.clicked.connect(self.on_auto)
+
+        plot.views.addWidget(self.canvas)
+        plot.controls.insertWidget(0, self.label)
+        plot.controls.insertWidget(1, self.slider)
+        plot.controls.insertWidget(2, self.auto)
+        self.plane = (proj.origin, proj.basis)
+        plot.canvas.planes.append(self.plane)
+        plot.projections.append(self)
+
+    def follow(self, thresh: float):
+        # Moves the slider without it counting as an override
+        self.slider.blockSignals(True)
+        self.slider.setValue(round(thresh * STEPS))
+        self.slider.blockSignals(False)
+        self.label.setText(f"Z threshold {thresh:.3f}")
+
+    def on_slider(self, val: int):
+        self.proj.pen.override = val / STEPS
+        self.label.setText(f"Z threshold {val / STEPS:.3f}")
+        log.info(f"Set Z threshold to {val / STEPS}")
+
+    def on_auto(self):
+        self.proj.pen.override = None
+        log.info("Using automatic Z threshold")
+
+    def update(self, pos: Position):
+        self.pos = pos
+        self.stale = True
+
+    def frame(self):
+        pos = self.pos
+        if pos is None:
+            return
+        self.stale = False
+        thresh = self.proj.pen.threshold
+        if self.proj.pen.override is None and round(thresh * STEPS) != self.slider.value():
+            self.follow(thresh)
+        moved = abs(thresh - self.thresh) > RETHRESHOLD or (
+            self.proj.pen.override is not None and thresh != self.thresh
+        )
+        if self.canvas.image.size() != self.canvas.size():
+            self.rebuild = True
+
+        new = pos.count - self.drawn
+        if new > len(pos.t):
+            # More than the deques hold came in since the last frame
+            self.rebuild = True
+        if not self.rebuild and not moved and new > 0:
+            data = pos.tail(new)
+            if self.canvas.fits(data):
+                self.canvas.draw(data, self.thresh)
+            else:
+                self.rebuild = True
+        if self.rebuild or moved:
+            data = pos.range(self.since, math.inf)
+            if len(data) > 0:
+                self.canvas.fits(data)
+            self.thresh = thresh
+            self.canvas.reset()
+            self.canvas.draw(data, thresh)
+            self.rebuild = False
+        self.drawn = pos.count
+        self.canvas.title = self.proj.latency.title()
+        self.canvas.update()
+
+    def clear(self):
+        # Called before the positions are cleared, so the last one is still there
+        pos = self.proj.pos
+        if len(pos.t) > 0:
+            self.since = float(np.nextafter(pos.t[-1], math.inf))
+        self.drawn = pos.count
+        self.canvas.reset()
+        self.canvas.update()
+
+    def remove(self):
+        if self.stale:
+            self.frame()
+        self.plot.projections.remove(self)
+        planes = self.plot.canvas.planes
+        planes[:] = [p for p in planes if p is not self.plane]
+        # The 2D view stays up (like the Matplotlib one) until the next projection's
+        self.slider.setEnabled(False)
+        self.auto.setEnabled(False)
+        self.plot.retired.extend((self.canvas, self.label, self.slider, self.auto))
+        self.plot.canvas.update()
+
+
+class Window(QWidget):
+    plot: "QtPlotter"
+
+    def __init__(self, plot: "QtPlotter"):
+        super().__init__()
+        self.plot = plot
+
+    def closeEvent(self, event):
+        self.plot.on_close()
+        event.accept()
+
+
+class QtPlotter(Plotter):
+    app: QApplication
+    window: Window
+    canvas: Canvas3D
+    # Holds the 3D view and the projections' 2D views, side by side
+    views: QHBoxLayout
+    # Holds the buttons (the projections put their threshold controls in front)
+    controls: QHBoxLayout
+    clear: QPushButton
+    calibrate: QPushButton
+    projections: list[QtProjView]
+    # Widgets of finished projections, still shown
+    retired: list[QWidget]
+
+    # Latest positions, drawn on the next frame
+    pos: Optional[Position]
+    stale: bool
+    # The positions in the 3D view, and their count when last drawn
+    shown: Optional[Position]
+    drawn: int
+    last_frame: float
+    last_flush: float
+
+    def setup(self):
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        self.window = Window(self)
+        self.window.setWindowTitle("realsense")
+        self.canvas = Canvas3D()
+        self.views = QHBoxLayout()
+        self.views.addWidget(self.canvas)
+        self.controls = QHBoxLayout()
+        self.controls.addStretch()
+        self.clear = QPushButton("Clear data")
+        self.clear.clicked.connect(self.on_clear)
+        self.calibrate = QPushButton("Calibrate axes")
+        self.calibrate.clicked.connect(self.on_calibrate)
+        self.controls.addWidget(self.clear)
+        self.controls.addWidget(self.calibrate)
+        layout = QVBoxLayout(self.window)
+        layout.addLayout(self.views, 1)
+        layout.addLayout(self.controls)
+        self.window.resize(1200, 650)
+        self.window.show()
+
+        self.projections = []
+        self.retired = []
+        self.pos = None
+        self.stale = False
+        self.shown = None
+        self.drawn = 0
+        self.last_frame = 0.0
+        self.last_flush = 0.0
+
+    def disable_buttons(self):
+        self.clear.setEnabled(False)
+        self.calibrate.setEnabled(False)
+
+    def reset_path(self, calibrate: bool):
+        log.debug("Resetting path collection")
+        self.canvas.alpha = 0.1 if calibrate else 1.0
+        self.canvas.clear()
+        self.pos = None
+        self.shown = None
+        self.canvas.update()
+
+    def set_title(self, title: str):
+        self.canvas.title = title
+        self.canvas.update()
+
+    def mark(self, pt: np.ndarray) -> Point:
+        return Point(self.canvas, pt)
+
+    def projection_view(self, proj: Projection) -> QtProjView:
+        for widget in self.retired:
+            widget.setParent(None)
+            widget.deleteLater()
+        self.retired = []
+        return QtProjView(proj, self)
+
+    def update(self, pos: Position):
+        self.pos = pos
+        self.stale = True
+
+    def frame(self):
+        # Draws whatever changed since the last frame
+        if self.stale and self.pos is not None:
+            self.stale = False
+            pos = self.pos
+            keep = pos.t.maxlen or len(pos.t)
+            if pos is self.shown and pos.count - self.drawn <= len(pos.t):
+                self.canvas.extend(pos.tail(pos.count - self.drawn), keep)
+            if pos is not self.shown or len(self.canvas) != len(pos.t):
+                # A new data source, or cleared
+                self.canvas.clear()
+                self.canvas.extend(pos.tail(len(pos.t)), keep)
+            self.shown = pos
+            self.drawn = pos.count
+            self.canvas.update()
+        for view in self.projections:
+            if view.stale or view.canvas.image.size() != view.canvas.size():
+                view.frame()
+
+    def flush(self):
+        now = time.perf_counter()
+        if now - self.last_frame >= 1 / FPS:
+            self.frame()
+            self.last_frame = now
+        # Only handle events every 10 milliseconds or so (~100Hz)
+        if now - self.last_flush > 0.01:
+            self.app.processEvents()
+            self.last_flush = now
+
+    def show(self):
+        self.frame()
+        if not self.should_exit:
+            self.app.exec_()
+
+
+if __name__ == "__main__":
+    import os
+
+    logging.basicConfig(level=logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    # The samples' calibration, replayed without a cursor
+    plot = QtPlotter("samples/calibrate.csv", "samples/eric.csv", False, False, True)
+    assert plot.data is not None and plot.data.proj is not None
+    proj = plot.data.proj
+    frames = 120
+
+    # n points of a random walk in both views
+    rng = np.random.default_rng(0)
+    walk = np.cumsum(rng.normal(scale=0.002, size=(n, 3)), axis=0) + [0.5, 0.5, 0.05]
+    pos = Position(n)
+    # The projection keeps the last 5000 in memory and the rest in its archive
+    hist = proj.pos
+    for i, (x, y, z) in enumerate(walk.tolist()):
+        pos.append((x, y, z), i * 0.01)
+        hist.append((x, y, z), i * 0.01)
+    view = plot.projections[0]
+
+    def timed(step) -> float:
+        start = time.perf_counter()
+        for i in range(frames):
+            step(i)
+            plot.frame()
+            plot.window.grab()
+        return (time.perf_counter() - start) / frames * 1000
+
+    plot.update(pos)
+    view.update(hist)
+    plot.frame()
+
+    def rotate(i: int):
+        plot.canvas.yaw += 0.05
+        plot.stale = True
+
+    ms = timed(rotate)
+    print(f"3D view, {n} points rotating: {ms:.1f} ms per frame ({1000 / ms:.0f} FPS)")
+
+    def stream(i: int):
+        # A frame's worth of new samples at 100 Hz, in both views
+        t = (n + i) * 0.01
+        for _ in range(2):
+            x, y, z = walk[i % n]
+            pos.append((x, y, z), t)
+            hist.append((x, y, z), t)
+        plot.update(pos)
+        view.update(hist)
+
+    ms = timed(stream)
+    print(f"Streaming with {n} points shown: {ms:.1f} ms per frame ({1000 / ms:.0f} FPS)")
+
+    start = time.perf_counter()
+    view.rebuild = True
+    view.update(hist)
+    view.frame()
+    print(
+        f"Redrawing {n} points of history in 2D: "
+        f"{(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    assert plot.archive is not None
+    plot.archive.close()
@@ -0,0 +1,128 @@
+# Live handwriting recognition (--ocr).
+# Pen-down strokes are handed to the incremental recognizer from ocr/ on a worker
+# thread, so recognition never holds up the tracking loop: the sink only collects the
+# points of the stroke in progress and queues it when the pen comes up. The worker adds
+# every queued stroke and runs a pass, which only re-recognizes the clusters that
+# changed. The board's text (one cluster per line, in reading order) is logged and
+# written to a file if given, e.g. the <recording>.txt the catalog indexes.
+# Replay a recording with python -m ocr.incremental <calibration> <recording>.
+from queue import Queue
+from threading import Thread
+from typing import TYPE_CHECKING, Optional
+import logging
+import time
+
+import numpy as np
+
+from .sink import Sink
+
+if TYPE_CHECKING:
+    from ocr.incremental import IncrementalRecognizer, Recognizer
+
+log = logging.getLogger(__name__)
+
+
+class OcrSink(Sink):
+    # Where the text goes after every pass, if anywhere
+    file: Optional[str]
+    # Points (x, y in the plane) of the stroke in progress
+    stroke: list[tuple[float, float]]
+    # Finished strokes for the worker, None to stop it
+    queue: Queue[Optional[np.ndarray]]
+    recognizer: "IncrementalRecognizer"
+    # Cleared if the recognizer can't be loaded, strokes are dropped from then on
+    enabled: bool
+    thread: Thread
+    # Text of the last pass, one entry per cluster
+    text: list[str]
+    passes: int
+    # Clusters sent to the recognizer, and time spent in passes (s)
+    recognized: int
+    seconds: float
+
+    def __init__(self, file: Optional[str] = None, recognize: Optional["Recognizer"] = None):
+        from ocr.incremental import IncrementalRecognizer
+
+        self.file = file
+        self.stroke = []
+        self.queue = Queue()
+        # pix2text is loaded by the first pass, on the worker thread
+        self.recognizer = IncrementalRecognizer(recognize)
+        self.enabled = True
+        self.text = []
+        self.passes = 0
+        self.recognized = 0
+        self.seconds = 0.0
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def on_sample(self, pos: tuple[float, float, float], t: float, pressed: bool):
+        if pressed:
+            self.stroke.append((pos[0], pos[1]))
+        elif len(self.stroke) > 0:
+            self.end_stroke()
+
+    def end_stroke(self):
+        self.queue.put(np.array(self.stroke))
+        self.stroke = []
+
+    def flush(self):
+        pass
+
+    def finalize(self):
+        # The projection is done; the recognizer keeps the board, in case of a
+        # recalibration
+        if len(self.stroke) > 0:
+            self.end_stroke()
+
+    def run(self):
+        while True:
+            stroke = self.queue.get()
+            if stroke is None:
+                return
+            self.recognizer.add_stroke(stroke)
+            # Strokes that came in during the last pass all go in this one
+            while not self.queue.empty():
+                stroke = self.queue.get()
+                if stroke is None:
+                    self.recognize()
+                    return
+                self.recognizer.add_stroke(stroke)
+            self.recognize()
+
+    def recognize(self):
+        if not self.enabled:
+            self.recognizer.clear()
+            return
+        start = time.perf_counter()
+        try:
+            clusters = self.recognizer.recognize()
+        except ImportError as e:
+            log.error(f"Can't recognize handwriting without pix2text ({e})")
+            self.enabled = False
+            self.recognizer.clear()
+            return
+        self.seconds += time.perf_counter() - start
+        self.passes += 1
+        self.recognized += self.recognizer.recognized
+
+        text = [c.text for c in clusters]
+        before = set(self.text)
+        for line in text:
+            if line not in before:
+                log.info(f"Recognized {line}")
+        self.text = text
+        if self.file is not None:
+            with open(self.file, "w") as f:
+                f.write("".join(line + "\n" for line in text))
+
+    def close(self):
+        # Waits for the strokes still queued to be recognized
+        self.finalize()
+        self.queue.put(None)
+        self.thread.join()
+        log.info(
+            f"Recognized {self.recognized} clusters in {self.passes} passes "
+            f"({1000 * self.seconds / max(self.passes, 1):.0f} ms per pass)"
+            + (f", text in {self.file}" if self.file is not None and self.enabled else "")
+        )
@@ -2,15 +2,17 @@ import socket
 from collections import deque
 import struct
 import selectors
-import csv
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-from .replay import RecordingRow, csvkeys
+from .codec import save
+from .replay import RecordingRow
 from .source import DataSource, Projection
-from .plot import Plotter
 from .state import Position
 
+if TYPE_CHECKING:
+    from .plotter import Plotter
+
 log = logging.getLogger(__name__)
 
 
@@ -22,7 +24,7 @@ class SocketSource(DataSource):
 
     def __init__(
         self,
-        plot: Plotter,
+        plot: "Plotter",
         file: str,
         calibrate: bool = False,
         proj: Optional[Projection] = None,
@@ -41,7 +43,9 @@ class SocketSource(DataSource):
 
         self.rows = deque()
 
-    def on_packet(self, pos: Position):
+    # Returns the number of packets read
+    def on_packet(self, pos: Position) -> int:
+        packets = 0
         while True:
             try:
                 data, _ = self.sock.recvfrom(1024)
@@ -52,6 +56,8 @@ class SocketSource(DataSource):
                 position = unpacked_data[2:5]
                 quaternion = unpacked_data[5:9]
                 toolId = unpacked_data[9]
+                self.plot.latency.on_receive(timestamp)
+                packets += 1
 
                 self.rows.append(
                     {
@@ -69,23 +75,48 @@ class SocketSource(DataSource):
                 )
 
                 # log.debug(f'{timestamp}: Got new position ({position[0]}, {position[1]}, {position[2]})')
-                pos.append(position, timestamp)
+                fusion = self.plot.fusion
+                if fusion is None:
+                    self.append(pos, position, quaternion, timestamp)
+                else:
+                    # IMU estimates since the last packet, then this one unless the
+                    # tracker is just repeating itself
+                    for fused, t in fusion.optical(timestamp, position, quaternion):
+                        self.append(pos, fused, fusion.quat, t)
             except socket.error:
                 # Done, exit
                 break
 
+        return packets
+
+    def append(self, pos: Position, position, quaternion, t: float):
+        # The recording keeps the marker position, the plot gets the pen tip
+        if self.plot.tip is not None:
+            position = self.plot.tip.apply(position, quaternion)
+        pos.append(position, t)
+
     def tick(self, pos: Position) -> bool:
         events = self.sel.select(timeout=0.01)
+        packets = 0
         for key, _ in events:
-            self.on_packet(pos)
+            packets += self.on_packet(pos)
+        self.plot.latency.on_read(packets)
+
+        fusion = self.plot.fusion
+        if len(events) == 0 and fusion is not None:
+            # The tracker went quiet (occluded), the IMU carries on
+            fused = fusion.idle()
+            for position, t in fused:
+                self.append(pos, position, fusion.quat, t)
+            return len(fused) > 0
 
         return not len(events) == 0
 
     def finalize(self):
         # We're only opening the file here so that if calibration fails in the middle,
         # the calibration csv isn't left empty.
-        file = open(self.file, "w")
-        writer = csv.DictWriter(file, fieldnames=csvkeys)
-        writer.writerows(self.rows)
+        # Compressed if the file name ends with .zrec
+        save(self.file, self.rows, header=False)
         self.sel.unregister(self.sock)
         self.sock.close()
+        self.add_to_catalog(self.file)
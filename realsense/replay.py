@@ -2,15 +2,23 @@ import csv
 from datetime import datetime
 from time import sleep
 from collections import deque
-from typing import Optional
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Optional
 
+import numpy as np
+
+from . import codec
 from .source import DataSource, Projection
 from .state import RecordingRow, csvkeys, Position
-from .plot import Plotter
+
+if TYPE_CHECKING:
+    from .plotter import Plotter
 
 
 class FileSource(DataSource):
     rows: deque[RecordingRow]
+    # Blocks of a compressed recording that haven't been read yet
+    blocks: Iterator[codec.Block]
     animate: bool
     recstart: float
     start: datetime
@@ -18,24 +26,69 @@ class FileSource(DataSource):
 
     def __init__(
         self,
-        plot: Plotter,
+        plot: "Plotter",
         animate: bool,
         file: str,
         calibrate: bool = False,
         proj: Optional[Projection] = None,
     ):
         super().__init__(plot, calibrate, proj)
-        with open(file, "r") as input:
-            reader = csv.DictReader(input, fieldnames=csvkeys)
-            self.rows = deque([row for row in reader])
-            # Ignore header
-            self.rows.popleft()
-            if len(self.rows) < 2:
-                raise NotImplementedError("Not enough rows in recording file!")
-            self.animate = animate
-            self.recstart = float(self.rows[1]["time"])
-            self.start = datetime.now()
-            self.done = False
+        if codec.is_compressed(file):
+            # Inflated a block at a time as the replay gets to it
+            self.blocks = codec.blocks(file)
+            self.rows = deque()
+            while len(self.rows) < 2 and self.refill():
+                pass
+        else:
+            self.blocks = iter(())
+            with open(file, "r") as input:
+                reader = csv.DictReader(input, fieldnames=csvkeys)
+                rows = [row for row in reader]
+                # Ignore header
+                self.rows = deque(self.tipped(rows[1:]))
+        if len(self.rows) < 2:
+            raise NotImplementedError("Not enough rows in recording file!")
+        self.animate = animate
+        self.recstart = float(self.rows[1]["time"])
+        self.start = datetime.now()
+        self.done = False
+
+    def refill(self) -> bool:
+        block = next(self.blocks, None)
+        if block is None:
+            return False
+        sno, id, t, poses = block
+        tip = self.plot.tip
+        if tip is not None:
+            poses = poses.copy()
+            poses[:, :3] = tip.apply_all(poses[:, :3], poses[:, 3:])
+        self.rows.extend(codec.rows((sno, id, t, poses)))
+        return True
+
+    def tipped(self, rows: list[RecordingRow]) -> list[RecordingRow]:
+        # Moves the positions to the pen tip, all rows at once
+        tip = self.plot.tip
+        if tip is None or len(rows) == 0:
+            return rows
+        keys = ["x", "y", "z", "qx", "qy", "qz", "qw"]
+        data = np.array([[float(row[k]) for k in keys] for row in rows])  # type: ignore
+        xyz = tip.apply_all(data[:, :3], data[:, 3:]).tolist()
+        for row, (x, y, z) in zip(rows, xyz):
+            row["x"], row["y"], row["z"] = x, y, z
+        return rows
+
+    # Raises IndexError at the end of the recording
+    def pop(self) -> RecordingRow:
+        if len(self.rows) == 0:
+            self.refill()
+        return self.rows.popleft()
+
+    def remaining(self) -> Iterator[RecordingRow]:
+        while True:
+            try:
+                yield self.pop()
+            except IndexError:
+                return
 
     # Process entries that should be processed in the current tick
     # Returns the number of entries processed
@@ -45,7 +98,7 @@ class FileSource(DataSource):
 
         try:
             while True:
-                row = self.rows.popleft()
+                row = self.pop()
                 rectime = float(row["time"])
                 if rectime - self.recstart < (now - self.start).total_seconds():
                     x, y, z = (
@@ -73,7 +126,7 @@ class FileSource(DataSource):
             sleep(0.005)
             return self.chomp(pos) > 0
         elif self.calibrate:
-            row = self.rows.popleft()
+            row = self.pop()
             x, y, z = (float(row["x"]), float(row["y"]), float(row["z"]))
             time = float(row["time"])
             pos.append((x, y, z), time)
@@ -81,7 +134,7 @@ class FileSource(DataSource):
             # Don't update the plot if we're not animating
             return False
         else:
-            for row in self.rows:
+            for row in self.remaining():
                 x, y, z = (float(row["x"]), float(row["y"]), float(row["z"]))
                 time = float(row["time"])
                 pos.append((x, y, z), time)
@@ -0,0 +1,341 @@
+# Live positions in shared memory, for other processes.
+#
+# OCR, analytics or a second display would otherwise have to run in this process and
+# compete with the tracking loop for the GIL. With --shm, the positions are published
+# into two rings in multiprocessing.shared_memory instead:
+# - NAME-raw: t, x, y, z as the data source read them (tracker coordinates, at the
+#   pen tip with -t)
+# - NAME-proj: t, x, y, z, pressed in the calibrated plane, once calibrated
+# Each ring is a header of uint64 counters followed by CAPACITY rows of float64. The
+# publisher copies a frame's worth of rows in at a time and then bumps `seq`, the
+# number of rows ever written, so it never waits for anyone. A `Reader` maps the same
+# memory and copies out whatever is new since its last read, at its own pace. Readers
+# that fall more than CAPACITY rows behind skip ahead and count what they `lost`.
+# Usage: python -m realsense.shm [NAME] (prints the projected stream)
+#        python -m realsense.shm --bench (publish cost, and a reader in another process)
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+import logging
+import time
+
+import numpy as np
+
+from .sink import Sink
+from .state import Position
+
+log = logging.getLogger(__name__)
+
+DEFAULT_NAME = "zotpen"
+# Rows kept, about 10 minutes at 100 Hz
+CAPACITY = 1 << 16
+
+STREAMS = {"raw": ("t", "x", "y", "z"), "proj": ("t", "x", "y", "z", "pressed")}
+
+# Header, in uint64s
+MAGIC = 0x5A50454E53484D31
+VERSION = 1
+(
+    H_MAGIC,
+    H_VERSION,
+    H_CAPACITY,
+    H_COLUMNS,
+    # Rows written once the copy in progress is done
+    H_WRITE,
+    # Rows written
+    H_SEQ,
+    # Set when the publisher has stopped
+    H_CLOSED,
+) = range(7)
+HEADER = 8
+
+
+def segment(name: str, stream: str) -> str:
+    return f"{name}-{stream}"
+
+
+class Ring:
+    # Writer side
+    shm: SharedMemory
+    header: np.ndarray
+    rows: np.ndarray
+    capacity: int
+    seq: int
+
+    def __init__(self, name: str, columns: int, capacity: int = CAPACITY):
+        size = (HEADER + capacity * columns) * 8
+        try:
+            self.shm = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left over from a publisher that didn't get to clean up
+            log.warning(f"Replacing stale shared memory {name}")
+            old = SharedMemory(name)
+            old.unlink()
+            old.close()
+            self.shm = SharedMemory(name, create=True, size=size)
+        self.header = np.ndarray(HEADER, np.uint64, self.shm.buf)
+        self.rows = np.ndarray((capacity, columns), np.float64, self.shm.buf, HEADER * 8)
+        self.capacity = capacity
+        self.seq = 0
+        self.header[:] = 0
+        self.header[H_CAPACITY] = capacity
+        self.header[H_COLUMNS] = columns
+        self.header[H_VERSION] = VERSION
+        # Last, so readers don't take it for a ring before it's set up
+        self.header[H_MAGIC] = MAGIC
+
+    def write(self, rows: np.ndarray):
+        n = len(rows)
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.seq += n - self.capacity
+            rows = rows[n - self.capacity :]
+            n = self.capacity
+        # Readers check this after copying, so they know which rows could have changed
+        self.header[H_WRITE] = self.seq + n
+        i = self.seq % self.capacity
+        first = min(n, self.capacity - i)
+        self.rows[i : i + first] = rows[:first]
+        self.rows[: n - first] = rows[first:]
+        self.seq += n
+        self.header[H_SEQ] = self.seq
+
+    def close(self):
+        self.header[H_CLOSED] = 1
+        del self.header, self.rows
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Reader:
+    # Reads a ring from any process. Rows come back as (N, len(columns)) float64
+    shm: SharedMemory
+    header: np.ndarray
+    # The ring itself, mapped (read() copies out of it, so rows don't change under you)
+    rows: np.ndarray
+    columns: tuple[str, ...]
+    capacity: int
+    # Next row to read
+    seq: int
+    # Rows overwritten before they could be read
+    lost: int
+
+    def __init__(
+        self,
+        name: str = DEFAULT_NAME,
+        stream: str = "proj",
+        timeout: Optional[float] = None,
+        latest: bool = False,
+    ):
+        # Waits up to timeout seconds (forever if None) for the publisher to start.
+        # Starts from the oldest row still in the ring, or only new ones with latest
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                self.shm = attach(segment(name, stream))
+                self.header = np.ndarray(HEADER, np.uint64, self.shm.buf)
+                if self.header[H_MAGIC] == MAGIC:
+                    break
+                # Created but not set up yet
+                del self.header
+                self.shm.close()
+            except FileNotFoundError:
+                pass
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Nothing is publishing {segment(name, stream)}")
+            time.sleep(0.05)
+        if self.header[H_VERSION] != VERSION:
+            raise ValueError(f"{segment(name, stream)} has unsupported version")
+        self.capacity = int(self.header[H_CAPACITY])
+        self.columns = STREAMS[stream]
+        self.rows = np.ndarray(
+            (self.capacity, int(self.header[H_COLUMNS])), np.float64, self.shm.buf, HEADER * 8
+        )
+        seq = int(self.header[H_SEQ])
+        self.seq = seq if latest else max(seq - self.capacity, 0)
+        self.lost = 0
+
+    @property
+    def available(self) -> int:
+        return int(self.header[H_SEQ]) - self.seq
+
+    @property
+    def finished(self) -> bool:
+        # The publisher stopped, and everything it wrote has been read
+        return bool(self.header[H_CLOSED]) and self.available == 0
+
+    def read(self, limit: Optional[int] = None) -> np.ndarray:
+        # Rows written since the last read (at most limit of them), oldest first
+        seq = int(self.header[H_SEQ])
+        start = max(self.seq, seq - self.capacity)
+        self.lost += start - self.seq
+        if limit is not None:
+            seq = min(seq, start + limit)
+        out = self.rows[np.arange(start, seq) % self.capacity]
+        # Rows the writer got to while we copied aren't the ones we wanted anymore
+        valid = int(self.header[H_WRITE]) - self.capacity
+        if valid > start:
+            skip = min(valid - start, len(out))
+            self.lost += skip
+            out = out[skip:]
+        self.seq = seq
+        return out
+
+    def latest(self, n: int) -> np.ndarray:
+        # The newest n rows, without moving on from where read() is
+        seq = int(self.header[H_SEQ])
+        start = max(seq - min(n, self.capacity), 0)
+        out = self.rows[np.arange(start, seq) % self.capacity]
+        valid = int(self.header[H_WRITE]) - self.capacity
+        return out[max(valid - start, 0) :]
+
+    def close(self):
+        del self.header, self.rows
+        self.shm.close()
+
+
+def attach(name: str) -> SharedMemory:
+    # Without registering the segment, or the resource tracker would unlink it when
+    # this process exits, from under the publisher. Python 3.13 has track=False for
+    # this; before that, registering is skipped while attaching. (Unregistering after
+    # would break a reader that shares the publisher's tracker, like a child process.)
+    try:
+        return SharedMemory(name, track=False)  # type: ignore[call-arg]
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class ShmSink(Sink):
+    # Projected samples into a ring, a frame at a time
+    ring: Ring
+    # Samples since the last flush, flattened
+    pending: list[float]
+
+    def __init__(self, ring: Ring):
+        self.ring = ring
+        self.pending = []
+
+    def on_sample(self, pos: tuple[float, float, float], t: float, pressed: bool):
+        self.pending += (t, pos[0], pos[1], pos[2], 1.0 if pressed else 0.0)
+
+    def flush(self):
+        if len(self.pending) > 0:
+            self.ring.write(np.array(self.pending).reshape(-1, len(STREAMS["proj"])))
+            self.pending = []
+
+    def finalize(self):
+        # The ring outlives the projection (recalibrating keeps publishing to it)
+        self.flush()
+
+
+class Publisher:
+    # Both rings, for a whole session
+    name: str
+    raw: Ring
+    proj: Ring
+    # The data source positions last published and how many they had then
+    pos: Optional[Position]
+    count: int
+
+    def __init__(self, name: str = DEFAULT_NAME, capacity: int = CAPACITY):
+        self.name = name
+        self.raw = Ring(segment(name, "raw"), len(STREAMS["raw"]), capacity)
+        self.proj = Ring(segment(name, "proj"), len(STREAMS["proj"]), capacity)
+        self.pos = None
+        self.count = 0
+        log.info(f"Publishing positions to shared memory {name}-raw and {name}-proj")
+
+    def publish(self, pos: Position):
+        # Whatever the data source appended since the last call
+        new = pos.count - self.count if pos is self.pos else pos.count
+        self.raw.write(pos.tail(min(new, len(pos.t))))
+        self.pos = pos
+        self.count = pos.count
+
+    def sink(self) -> ShmSink:
+        return ShmSink(self.proj)
+
+    def close(self):
+        self.raw.close()
+        self.proj.close()
+
+
+def bench_reader(name: str, sleep: float, result):
+    # Checks every row arrives in order, reading every `sleep` seconds
+    reader = Reader(name, "proj", timeout=10)
+    got, bad = 0, 0
+    last = -1.0
+    while not reader.finished:
+        rows = reader.read()
+        if len(rows) > 0:
+            # The bench writes t = row number, so gaps are exactly the losses
+            bad += int((np.diff(np.r_[last, rows[:, 0]]) <= 0).sum())
+            last = rows[-1, 0]
+            got += len(rows)
+        time.sleep(sleep)
+    result.put((got, reader.lost, bad))
+    reader.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+    import sys
+
+    parser = argparse.ArgumentParser(
+        prog="python -m realsense.shm", description="Read the shared memory position stream"
+    )
+    parser.add_argument("name", nargs="?", default=DEFAULT_NAME)
+    parser.add_argument("-s", "--stream", choices=list(STREAMS), default="proj")
+    parser.add_argument(
+        "--bench", action="store_true", help="Time publishing with a reader in another process"
+    )
+    args = parser.parse_args()
+
+    if not args.bench:
+        reader = Reader(args.name, args.stream, latest=True)
+        print(f"Reading {segment(args.name, args.stream)}: {', '.join(reader.columns)}")
+        try:
+            while not reader.finished:
+                for row in reader.read().tolist():
+                    print(" ".join(f"{v:.4f}" for v in row), f"lost={reader.lost}")
+                time.sleep(0.01)
+        except KeyboardInterrupt:
+            pass
+        reader.close()
+        sys.exit()
+
+    logging.basicConfig(level=logging.WARNING)
+    n = 300_000
+    batch = 5
+    for sleep, label in ((0.001, "fast reader"), (0.2, "slow reader")):
+        pub = Publisher("zotpen-bench", capacity=16384)
+        sink = pub.sink()
+        # A fresh interpreter, like a sidecar would be
+        ctx = multiprocessing.get_context("spawn")
+        result = ctx.Queue()
+        proc = ctx.Process(target=bench_reader, args=("zotpen-bench", sleep, result))
+        proc.start()
+        time.sleep(0.5)
+        start = time.perf_counter()
+        for i in range(n):
+            sink.on_sample((0.5, 0.25, 0.01), float(i), i % 100 < 50)
+            if i % batch == batch - 1:
+                sink.flush()
+        elapsed = time.perf_counter() - start
+        sink.finalize()
+        pub.close()
+        got, lost, bad = result.get()
+        proc.join()
+        print(
+            f"{label}: published {n} samples in {elapsed:.2f}s, "
+            f"{elapsed / (n // batch) * 1e6:.1f} us per frame of {batch}; "
+            f"the reader got {got} and lost {lost} ({got + lost} total), {bad} out of order"
+        )
@@ -0,0 +1,211 @@
+# Output sinks
+#
+# Besides moving the local cursor, projected positions can be sent anywhere that
+# implements `Sink`. The broadcaster sends them to every laptop / projector PC on the
+# network that's listening, with one UDP multicast datagram per frame no matter how
+# many subscribers there are.
+# Usage (test client): python -m realsense.sink [GROUP:PORT]
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from struct import Struct
+from typing import TYPE_CHECKING, Optional
+import ipaddress
+import logging
+import socket
+import sys
+
+if TYPE_CHECKING:
+    import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_GROUP = "239.255.42.99"
+DEFAULT_PORT = 5007
+
+
+class Sink(ABC):
+    # Called once with the basis of the calibrated plane (columns x, y, z)
+    def on_calibrate(self, basis: "np.ndarray"):
+        pass
+
+    # Called for every projected sample, so this should be cheap
+    @abstractmethod
+    def on_sample(self, pos: tuple[float, float, float], t: float, pressed: bool):
+        pass
+
+    # Called once per frame, after a batch of samples
+    @abstractmethod
+    def flush(self):
+        pass
+
+    @abstractmethod
+    def finalize(self):
+        pass
+
+
+# Magic, sequence number, tracker time, projected x / y / z, flags
+FRAME = Struct("<4sIdfffB")
+MAGIC = b"ZPEN"
+# Flags
+PRESSED = 1
+# Pen state changed with this frame (sent right away, not coalesced)
+EDGE = 2
+
+
+@dataclass
+class Frame:
+    seq: int
+    t: float
+    x: float
+    y: float
+    z: float
+    pressed: bool
+    edge: bool
+
+
+def parse_addr(addr: str) -> tuple[str, int]:
+    # Host names (localhost...) are resolved, so the address can be checked for multicast
+    host, _, port = addr.rpartition(":")
+    if host == "":
+        host, port = port or DEFAULT_GROUP, str(DEFAULT_PORT)
+    return socket.gethostbyname(host), int(port)
+
+
+def encode(seq: int, pos: tuple[float, float, float], t: float, flags: int) -> bytes:
+    return FRAME.pack(MAGIC, seq & 0xFFFFFFFF, t, pos[0], pos[1], pos[2], flags)
+
+
+def decode(data: bytes) -> Optional[Frame]:
+    if len(data) != FRAME.size:
+        return None
+    magic, seq, t, x, y, z, flags = FRAME.unpack(data)
+    if magic != MAGIC:
+        return None
+    return Frame(seq, t, x, y, z, bool(flags & PRESSED), bool(flags & EDGE))
+
+
+class BroadcastSink(Sink):
+    sock: socket.socket
+    addr: tuple[str, int]
+    seq: int
+    # Latest sample that hasn't been sent yet
+    pending: Optional[tuple[tuple[float, float, float], float, bool]]
+    pressed: bool
+    # Datagrams the kernel refused (socket buffer full)
+    dropped: int
+
+    def __init__(self, addr: str = f"{DEFAULT_GROUP}:{DEFAULT_PORT}", ttl: int = 1):
+        self.addr = parse_addr(addr)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if ipaddress.ip_address(self.addr[0]).is_multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            # So clients on this machine hear it too
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Never let a slow network hold up the tracking loop
+        self.sock.setblocking(False)
+        self.seq = 0
+        self.pending = None
+        self.pressed = False
+        self.dropped = 0
+        log.info(f"Broadcasting pen frames to {self.addr[0]}:{self.addr[1]}")
+
+    def send(self, pos: tuple[float, float, float], t: float, flags: int):
+        try:
+            self.sock.sendto(encode(self.seq, pos, t, flags), self.addr)
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+        self.seq += 1
+
+    def on_sample(self, pos: tuple[float, float, float], t: float, pressed: bool):
+        if pressed != self.pressed:
+            # Clicks can't be coalesced away, send them right away
+            self.pressed = pressed
+            self.send(pos, t, EDGE | (PRESSED if pressed else 0))
+            self.pending = None
+        else:
+            self.pending = (pos, t, pressed)
+
+    def flush(self):
+        if self.pending is not None:
+            pos, t, pressed = self.pending
+            self.send(pos, t, PRESSED if pressed else 0)
+            self.pending = None
+
+    def finalize(self):
+        if self.dropped > 0:
+            log.info(f"Broadcaster dropped {self.dropped} frames")
+        self.sock.close()
+
+
+class BroadcastClient:
+    # Receives frames from a BroadcastSink, mostly for testing
+    sock: socket.socket
+    # Frames that never arrived, judging by the sequence numbers
+    lost: int
+    # Frames that arrived after a newer one (reordered or duplicated)
+    late: int
+    # Newest sequence number seen
+    last_seq: Optional[int]
+
+    def __init__(
+        self, addr: str = f"{DEFAULT_GROUP}:{DEFAULT_PORT}", timeout: Optional[float] = None
+    ):
+        host, port = parse_addr(addr)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if ipaddress.ip_address(host).is_multicast:
+            self.sock.bind(("", port))
+            mreq = socket.inet_aton(host) + socket.inet_aton("0.0.0.0")
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        else:
+            self.sock.bind((host, port))
+        self.sock.settimeout(timeout)
+        self.lost = 0
+        self.late = 0
+        self.last_seq = None
+
+    def recv(self) -> Optional[Frame]:
+        # Late frames are still returned (their seq is behind last_seq), but don't count
+        # towards the lost ones
+        try:
+            data, _ = self.sock.recvfrom(64)
+        except socket.timeout:
+            return None
+        frame = decode(data)
+        if frame is None:
+            return None
+        if self.last_seq is None:
+            self.last_seq = frame.seq
+            return frame
+        # Signed distance, so wrapping around 2^32 and going backwards both work
+        d = ((frame.seq - self.last_seq + 2**31) & 0xFFFFFFFF) - 2**31
+        if d > 0:
+            self.lost += d - 1
+            self.last_seq = frame.seq
+        else:
+            self.late += 1
+        return frame
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    client = BroadcastClient(
+        sys.argv[1] if len(sys.argv) > 1 else f"{DEFAULT_GROUP}:{DEFAULT_PORT}"
+    )
+    try:
+        while True:
+            frame = client.recv()
+            if frame is None:
+                continue
+            state = "down" if frame.pressed else "up"
+            print(
+                f"{frame.seq:>8} {frame.t:.4f} ({frame.x:.4f}, {frame.y:.4f}, {frame.z:.4f}) "
+                f"{state}{' (edge)' if frame.edge else ''} "
+                f"lost={client.lost} late={client.late}"
+            )
+    except KeyboardInterrupt:
+        client.close()
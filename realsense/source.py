@@ -1,16 +1,21 @@
 # Data source
 from abc import abstractmethod, ABC
 from typing import TYPE_CHECKING, Optional
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
 import logging
 import numpy as np
-import sys
 
 if TYPE_CHECKING:
-    from .plot import Plotter, ProjPlotter
+    from .plotter import Marker, Plotter, ProjectionView
 from .state import Position
-from .cursor import Cursor
+from .cursor import Cursor, screen_size
+from .calibration import plane_basis
+from .sink import Sink
+from .pen import PenState
+from .latency import LatencyTracker
+from .predict import Predictor
+from .output import CursorThread
+from .history import Archive
 
 log = logging.getLogger(__name__)
 
@@ -22,47 +27,66 @@ class Projection:
     # Shape (3,)
     origin: np.ndarray
     # Plotter
-    plot: "ProjPlotter"
+    plot: "ProjectionView"
     cursor: Optional[Cursor]
+    # Pixels, to scale relative cursor moves by
+    screen: tuple[int, int]
+    # Moves the cursor at the display rate, if set (otherwise it moves on every sample)
+    output: Optional[CursorThread]
+    # Other outputs (network broadcast etc.)
+    sinks: list[Sink]
+    # Decides when the pen touches the surface
+    pen: PenState
+    # Measures how long samples take from the tracker to the cursor
+    latency: LatencyTracker
+    # Moves the cursor ahead to where the pen is going, if set
+    predictor: Optional[Predictor]
+    # Projected positions: the last 5000 in RAM, the rest spilled to disk
+    pos: Position
+    # The session's archive, shared with the projections before and after this one
+    archive: Archive
+    # Made for this projection alone, so closed with it
+    own_archive: bool
 
-    zthresh: float = 0.065
     last_pos: Optional[np.ndarray] = None
     clicking: bool = False
-    pos: Position = Position(5000)
 
     def __init__(
         self,
         plot: "Plotter",
         pts: list[np.ndarray],
         cursor: bool,
+        sinks: Optional[list[Sink]] = None,
+        # Seconds to predict the cursor ahead by, 0 to turn prediction off
+        predict: float = 0.0,
+        # Cursor updates per second, None for the display rate and 0 to move the
+        # cursor straight from on_append
+        cursor_rate: Optional[float] = None,
+        # Place the cursor like a tablet instead of moving it like a mouse
+        absolute: bool = True,
+        # Where the projected history goes, a temporary file if None
+        archive: Optional[Archive] = None,
     ):
-        # When calibrating, the order of points SHOULD be:
-        # - Bottom left corner
-        # - Top left corner
-        # - Bottom right corner
-        # - Top right corner
-        # So y is clearly top left - bot left
-        # and x is clearly bot right - bot left
-        x = pts[2] - pts[0]
-        y = pts[1] - pts[0]
-        xx = np.dot(x, x)
-        xy = np.dot(x, y)
-        plotxy = (xy / xx) * x
-        # "Rectify" the Y axis by calculating the vector rejection of the Y axis from the X
-        y = y - plotxy
-        # Get normal vector
-        z = np.cross(x, y)
-
-        log.info(f"Got x vector {x}, y vector {y}, z vector {z}")
-
-        self.basis = np.column_stack((x, y, z))
-        self.origin = pts[0]
-        self.cursor = Cursor.default() if cursor else None
-
-        from .plot import ProjPlotter
+        self.basis, self.origin = plane_basis(pts)
+        self.own_archive = archive is None
+        self.archive = Archive() if archive is None else archive
+        self.pos = Position(5000, archive=self.archive)
+        self.screen = screen_size()
+        self.cursor = Cursor.default(absolute, self.screen) if cursor else None
+        self.sinks = [] if sinks is None else sinks
+        for sink in self.sinks:
+            sink.on_calibrate(self.basis)
+        self.pen = PenState()
+        self.latency = plot.latency
+        self.predictor = Predictor(predict) if predict > 0 else None
+        self.output = None
+        if self.cursor is not None and cursor_rate != 0:
+            self.output = CursorThread(
+                self.cursor, cursor_rate, self.screen, latency=self.latency
+            )
 
         # Need to do this last because we're passing ourselves into this function
-        self.plot = ProjPlotter(self, plot)
+        self.plot = plot.projection_view(self)
 
     # Performs a change of basis on a point given a specific basis and origin.
     def change_basis(self, pos: np.ndarray) -> np.ndarray:
@@ -71,36 +95,63 @@ class Projection:
     def on_append(self, pos: tuple[float, float, float], t: float):
         x, y, z = self.change_basis(np.array(pos))
         self.pos.append((x, y, z), t)
-
-        if self.cursor is not None and self.last_pos is not None:
-            lx, ly, lz = self.last_pos
-            # TODO: Get the actual screen resolution instead of hardcoding it
-            dx = int((x - lx) * 1920)
-            dy = int((y - ly) * 1080)
-            self.cursor.move(dx, dy)
-
-            press = z < self.zthresh
-            lpress = lz < self.zthresh
-
-            if not press == lpress:
-                log.info(f"Button {'pressed' if press else 'released'}")
+        press = self.pen.update(z, t)
+
+        for sink in self.sinks:
+            sink.on_sample((x, y, z), t, press)
+
+        # Where the cursor goes, which is ahead of the pen when predicting
+        cx, cy = x, y
+        if self.predictor is not None:
+            cx, cy = self.predictor.update(x, y, t, press)
+
+        if self.output is not None:
+            self.output.push(t, cx, cy, press, self.pen.pressure(z))
+        elif self.cursor is not None:
+            if self.cursor.absolute:
+                self.cursor.move_to(cx, cy, self.pen.pressure(z))
+            elif self.last_pos is not None:
+                lx, ly, lz = self.last_pos
+                w, h = self.screen
+                self.cursor.move(int((cx - lx) * w), int((cy - ly) * h))
+
+            if not press == self.clicking:
+                log.debug(f"Button {'pressed' if press else 'released'}")
                 self.cursor.click(press)
                 self.clicking = press
 
-        self.last_pos = np.array([x, y, z])
+        if self.output is None:
+            self.latency.on_output(t)
+
+        self.last_pos = np.array([cx, cy, z])
 
     def on_clear(self):
-        self.plot.path.set_offsets(np.empty((0, 2)))
+        # The view goes first, so it can still see where the cleared samples end
+        self.plot.clear()
+        self.pos.clear()
 
     def finalize(self):
         log.info("Closing Projection")
+        log.info(self.pen.summary())
+        log.info(self.latency.summary())
+        if self.predictor is not None:
+            log.info(self.predictor.summary())
+        if self.output is not None:
+            self.output.close()
         if self.cursor is not None:
             self.cursor.finalize()
+        for sink in self.sinks:
+            sink.finalize()
+        # The archive ends up with the whole session (the plotter closes it)
+        self.pos.spill()
+        if self.own_archive:
+            self.archive.close()
 
-        for obj in self.plot.objects:
-            obj.remove()
+        self.plot.remove()
 
     def update(self):
+        for sink in self.sinks:
+            sink.flush()
         self.plot.update(self.pos)
 
 
@@ -160,7 +211,24 @@ class DataSource(ABC):
     def finalize(self):
         pass
 
-    def calibrate_point(self) -> tuple[np.ndarray, Poly3DCollection]:
+    def publish(self, pos: Position):
+        if self.plot.publisher is not None:
+            self.plot.publisher.publish(pos)
+
+    def add_to_catalog(self, file: str):
+        # Recordings (not calibrations) are searchable as soon as they're written
+        if self.plot.catalog is None or self.calibrate:
+            return
+        basis = origin = None
+        if self.proj is not None:
+            basis, origin = self.proj.basis, self.proj.origin
+        try:
+            self.plot.catalog.index(file, basis, origin, self.plot.tip)
+            log.info(f"Added {file} to {self.plot.catalog.file}")
+        except (OSError, ValueError) as e:
+            log.error(f"Couldn't add {file} to the catalog: {e}")
+
+    def calibrate_point(self) -> tuple[np.ndarray, "Marker"]:
         # 150 / 30fps is around 5 seconds
         pos = Position(300)
 
@@ -169,6 +237,7 @@ class DataSource(ABC):
                 raise RuntimeError("Program stopped in middle of calibration")
 
             if self.tick(pos):
+                self.publish(pos)
                 self.plot.update(pos)
 
             self.plot.flush()
@@ -176,7 +245,7 @@ class DataSource(ABC):
         pt = np.array([np.mean(pos.x), np.mean(pos.y), np.mean(pos.z)])
         log.debug(f"({pt[0]}, {pt[1]}, {pt[2]})")
 
-        obj = self.plot.ax.scatter(*pt, c="red", s=100)
+        obj = self.plot.mark(pt)
 
         return pt, obj
 
@@ -185,8 +254,8 @@ class DataSource(ABC):
 
         # Point data list
         pts: list[np.ndarray] = []
-        # Objects list (Poly3DCollection)
-        objs: list[Poly3DCollection] = []
+        # Markers of the points found so far
+        objs: list["Marker"] = []
 
         descs = ["bottom left", "top left", "bottom right", "top right"]
 
@@ -213,6 +282,7 @@ class DataSource(ABC):
             else:
                 while not self.should_exit:
                     if self.tick(self.pos):
+                        self.publish(self.pos)
                         if self.proj is not None:
                             self.proj.update()
                         self.plot.update(self.pos)
@@ -0,0 +1,62 @@
+# Measures how long the CLI takes to start, each run in a fresh interpreter.
+# Usage: python -m realsense.startup [runs]
+import subprocess
+import sys
+import time
+
+# Startup is meant to stay under this (ms) up to parsed arguments
+TARGET = 200
+
+CASES = {
+    "interpreter": "pass",
+    "parsed CLI": "from realsense.cli import parse_args; parse_args(['replay'])",
+    # What every start paid before the imports were made lazy
+    "plotting stack": "import realsense.plot, realsense.record, realsense.replay",
+}
+
+
+def run(code: str, runs: int) -> float:
+    # Median wall time in ms
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def heaviest(code: str, n: int = 8) -> list[tuple[int, str]]:
+    # Cumulative import times (us) of the top level imports, from -X importtime
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Only modules imported directly, not their dependencies
+        if not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return imports[:n]
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {name: run(code, runs) for name, code in CASES.items()}
+    for name, ms in results.items():
+        print(f"{name:<16}{ms:>8.0f} ms")
+
+    cli = results["parsed CLI"]
+    print(
+        f"Parsed CLI is {results['plotting stack'] - cli:.0f} ms faster than importing the "
+        f"plotting stack, {'within' if cli < TARGET else 'over'} the {TARGET} ms target"
+    )
+    print("Heaviest imports up to parsed CLI:")
+    for us, name in heaviest(CASES["parsed CLI"]):
+        print(f"  {us / 1000:>7.1f} ms  {name}")
@@ -1,9 +1,12 @@
 from collections import deque
 from dataclasses import dataclass
+from itertools import islice
 from typing import TypedDict, Callable, Optional
 
 import numpy as np
 
+from .history import Archive
+
 
 class RecordingRow(TypedDict):
     sno: float
@@ -28,32 +31,71 @@ class Position:
     z: deque[float]
     t: deque[float]
     on_append: Optional[Callable[[tuple[float, float, float], float], None]]
+    # Where samples go when they fall out of the deques, if anywhere
+    archive: Optional[Archive]
+    # Samples appended so far (clear doesn't reset it), so views can tell what's new
+    count: int
 
     def __init__(
         self,
         len: int = 100,
         on_append: Optional[Callable[[tuple[float, float, float], float], None]] = None,
+        archive: Optional[Archive] = None,
     ):
         self.x = deque(maxlen=len)
         self.y = deque(maxlen=len)
         self.z = deque(maxlen=len)
         self.t = deque(maxlen=len)
         self.on_append = on_append
+        self.archive = archive
+        self.count = 0
 
     def append(self, pos: tuple[float, float, float], t: float):
         x, y, z = pos
+        if self.archive is not None and len(self.t) == self.t.maxlen:
+            # The oldest sample is about to be dropped
+            self.archive.append(self.t[0], self.x[0], self.y[0], self.z[0])
         self.x.append(x)
         self.y.append(y)
         self.z.append(z)
         self.t.append(t)
+        self.count += 1
         if self.on_append is not None:
             self.on_append(pos, t)
 
+    def spill(self):
+        # Copies what's still in the deques to the archive
+        if self.archive is not None:
+            for sample in zip(self.t, self.x, self.y, self.z):
+                self.archive.append(*sample)
+
     def clear(self):
-        self.x = []
-        self.y = []
-        self.z = []
-        self.t = []
+        # Cleared from view, but still in the history
+        self.spill()
+        self.x.clear()
+        self.y.clear()
+        self.z.clear()
+        self.t.clear()
+
+    def range(self, t0: float, t1: float) -> np.ndarray:
+        # (t, x, y, z) rows with t0 <= t < t1, from the archive and the deques
+        if len(self.t) == 0 or t1 <= self.t[0]:
+            hot = np.empty((0, 4))
+        else:
+            hot = np.column_stack((self.t, self.x, self.y, self.z))
+            hot = hot[(hot[:, 0] >= t0) & (hot[:, 0] < t1)]
+        if self.archive is None:
+            return hot
+        return np.concatenate((self.archive.range(t0, t1), hot))
+
+    def tail(self, n: int) -> np.ndarray:
+        # The newest n samples as (n, 4) t, x, y, z rows, without going through the
+        # rest of the deques
+        cols = [
+            np.fromiter(islice(reversed(d), n), float, n)[::-1]
+            for d in (self.t, self.x, self.y, self.z)
+        ]
+        return np.column_stack(cols).reshape(-1, 4)
 
     def stable(self, thresh=0.03) -> bool:
         xstd = np.std(self.x)
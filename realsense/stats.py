@@ -0,0 +1,245 @@
+# Hot-path instrumentation for the tracking loop.
+#
+# `Stats.install()` swaps the methods we care about for timed wrappers, so nothing
+# in the hot path changes (or costs anything) unless --stats is given. Timings are
+# inclusive: Position.append contains Projection.on_append, which contains the
+# Cursor calls.
+# Histograms have fixed log-scale buckets, so recording a sample is a few integer ops.
+# Usage (overhead benchmark): python -m realsense.stats
+from functools import wraps
+from threading import Event, Thread
+from typing import Callable, Optional, TextIO
+import atexit
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Buckets per power of two, and powers of two covered (1 ns up to ~18 minutes)
+SUB = 4
+OCTAVES = 40
+BUCKETS = OCTAVES * SUB
+
+
+def bucket(ns: int) -> int:
+    # Top two bits after the leading one pick the sub bucket
+    n = ns.bit_length()
+    if n < 3:
+        return ns
+    return min((n - 2) * SUB + ((ns >> (n - 3)) & (SUB - 1)), BUCKETS - 1)
+
+
+def bucket_ns(b: int) -> float:
+    # Upper edge of a bucket
+    if b < SUB:
+        return float(b + 1)
+    n, sub = divmod(b, SUB)
+    return float((SUB + sub + 1) << (n - 1))
+
+
+class Histogram:
+    counts: list[int]
+    calls: int
+    total: int
+    max: int
+    # Whether the times are spent in this thread (so a share of wall time makes sense)
+    busy: bool
+
+    def __init__(self):
+        self.busy = True
+        self.counts = [0] * BUCKETS
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns: int):
+        self.counts[bucket(ns)] += 1
+        self.calls += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p: float) -> float:
+        # In ns, accurate to a bucket (~20%)
+        want = self.calls * p / 100
+        seen = 0
+        for b, n in enumerate(self.counts):
+            seen += n
+            if n > 0 and seen >= want:
+                return min(bucket_ns(b), float(self.max))
+        return float(self.max)
+
+    def reset(self):
+        self.counts = [0] * BUCKETS
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+
+
+class Stats:
+    # The installed instance, if --stats was given
+    current: Optional["Stats"] = None
+    stages: dict[str, Histogram]
+    # Where summaries go, None for the log
+    out: Optional[TextIO]
+    # Seconds between summaries
+    interval: float
+    # Only report what happened since the last summary
+    windowed: bool
+    started: float
+    stop: Event
+    thread: Thread
+
+    def __init__(
+        self, file: Optional[str] = None, interval: float = 5.0, windowed: bool = False
+    ):
+        self.stages = {}
+        self.out = None if file is None or file == "-" else open(file, "a")
+        self.interval = interval
+        self.windowed = windowed
+        self.started = time.perf_counter()
+        self.stop = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def stage(self, name: str) -> Histogram:
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = Histogram()
+        return hist
+
+    def timed(self, name: str, fn: Callable) -> Callable:
+        hist = self.stage(name)
+        clock = time.perf_counter_ns
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.add(clock() - start)
+
+        return wrapper
+
+    def timed_tick(self, name: str, fn: Callable) -> Callable:
+        # Ticks that got nothing are mostly waiting in select(), keep them apart
+        busy = self.stage(name)
+        idle = self.stage(f"{name} (idle)")
+        clock = time.perf_counter_ns
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            got = fn(*args, **kwargs)
+            (busy if got else idle).add(clock() - start)
+            return got
+
+        return wrapper
+
+    def wrap(
+        self, cls: type, method: str, name: Optional[str] = None, tick: bool = False
+    ):
+        fn = getattr(cls, method)
+        name = f"{cls.__name__}.{method}" if name is None else name
+        setattr(cls, method, (self.timed_tick if tick else self.timed)(name, fn))
+
+    def install(self):
+        # Patch the classes before any instances hand out bound methods
+        from .cursor import Cursor
+        from .fusion import FusionSource
+        from .plotter import Plotter
+        from .record import SocketSource
+        from .replay import FileSource
+        from .source import Projection
+        from .state import Position
+        from .video import VideoSource
+
+        # Subclasses before their parents, so one that inherits tick (FusionSource)
+        # gets a stage of its own instead of adding to its parent's
+        for cls in (FusionSource, FileSource, SocketSource, VideoSource):
+            self.wrap(cls, "tick", tick=True)
+        self.wrap(Position, "append")
+        self.wrap(Projection, "on_append")
+        for cls in Cursor.__subclasses__():
+            self.wrap(cls, "move", "Cursor.move")
+            self.wrap(cls, "click", "Cursor.click")
+            self.wrap(cls, "move_to", "Cursor.move_to")
+        # Only the renderer that's been imported (cli_main imports it first)
+        for cls in Plotter.__subclasses__():
+            self.wrap(cls, "update", "Plotter.update")
+            self.wrap(cls, "flush", "Plotter.flush")
+
+        Stats.current = self
+        self.thread.start()
+        atexit.register(self.close)
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        lines = [
+            f"Stats over {elapsed:.1f}s",
+            f"{'stage':<28}{'calls':>9}{'/s':>9}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}{'busy':>7}",
+        ]
+        for name, hist in sorted(self.stages.items()):
+            if hist.calls == 0:
+                continue
+            lines.append(
+                f"{name:<28}{hist.calls:>9}{hist.calls / elapsed:>9.1f}"
+                f"{fmt(hist.total / hist.calls):>10}{fmt(hist.percentile(50)):>10}"
+                f"{fmt(hist.percentile(99)):>10}{fmt(hist.max):>10}"
+                + (f"{hist.total / 1e7 / elapsed:>6.1f}%" if hist.busy else f"{'-':>7}")
+            )
+        return "\n".join(lines)
+
+    def report(self):
+        text = self.summary()
+        if self.out is None:
+            log.info(text)
+        else:
+            self.out.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {text}\n\n")
+            self.out.flush()
+        if self.windowed:
+            for hist in self.stages.values():
+                hist.reset()
+            self.started = time.perf_counter()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.report()
+
+    def close(self):
+        if self.stop.is_set():
+            return
+        self.stop.set()
+        self.report()
+        if self.out is not None:
+            self.out.close()
+
+
+def fmt(ns: float) -> str:
+    if ns < 1e3:
+        return f"{ns:.0f}ns"
+    if ns < 1e6:
+        return f"{ns / 1e3:.1f}us"
+    if ns < 1e9:
+        return f"{ns / 1e6:.1f}ms"
+    return f"{ns / 1e9:.2f}s"
+
+
+if __name__ == "__main__":
+    # Cost of the instrumentation itself
+    stats = Stats(interval=1e9)
+
+    def noop():
+        pass
+
+    timed = stats.timed("noop", noop)
+    n = 1_000_000
+    start = time.perf_counter()
+    for _ in range(n):
+        noop()
+    plain = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n):
+        timed()
+    wrapped = time.perf_counter() - start
+    print(f"Overhead per call: {(wrapped - plain) / n * 1e9:.0f}ns")
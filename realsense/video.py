@@ -0,0 +1,232 @@
+# Webcam / video fallback for classrooms without a D415.
+# Tracks the pen marker with the pipeline from cv/ on a worker thread and feeds its
+# position into the same plotting / projection pipeline as the tool tracker.
+# Usage (benchmark): python -m realsense.video <video> [--kcf] [--flow] [--pixels]
+from collections import deque
+from threading import Event, Thread
+from typing import TYPE_CHECKING, Optional, Union
+import logging
+import math
+import sys
+import time
+
+import numpy as np
+
+from .codec import save
+from .source import DataSource, Projection
+from .state import Position, RecordingRow
+
+if TYPE_CHECKING:
+    from .plotter import Plotter
+
+log = logging.getLogger(__name__)
+
+# (t, x, y, z, frame read time in perf_counter seconds)
+Sample = tuple[float, float, float, float, float]
+
+
+def video_source(spec: str) -> Union[str, int]:
+    # Camera indices are given as plain numbers
+    return int(spec) if spec.isdigit() else spec
+
+
+class VideoWorker:
+    # Runs the tracker on its own thread and queues up positions.
+    source: Union[str, int]
+    samples: deque[Sample]
+    # Report pixel coordinates (normalized to [0, 1], y up) instead of estimating 3D
+    pixels: bool
+    # Physical size of the marker (m) and horizontal field of view of the camera (deg),
+    # used to estimate depth from how big the marker looks
+    marker_size: float
+    fov: float
+    kcf: bool
+    # Use Lucas-Kanade optical flow between detections
+    flow: bool
+    stop: Event
+    done: Event
+    # What stopped the thread, if it didn't just run out of frames
+    error: Optional[BaseException]
+    thread: Thread
+    summary: str
+
+    def __init__(
+        self,
+        source: Union[str, int],
+        pixels: bool = False,
+        kcf: bool = False,
+        flow: bool = False,
+        marker_size: float = 0.02,
+        fov: float = 69.0,
+    ):
+        self.source = source
+        self.flow = flow
+        self.samples = deque(maxlen=4096)
+        self.pixels = pixels
+        self.kcf = kcf
+        self.marker_size = marker_size
+        self.fov = fov
+        self.stop = Event()
+        self.done = Event()
+        self.error = None
+        self.summary = ""
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        from cv.pipeline import PenTracker
+
+        tracker = None
+        # perf_counter -> wall clock, so times look like the tool tracker's
+        epoch = time.time() - time.perf_counter()
+        try:
+            # In here, so a source that can't be opened still ends the thread
+            tracker = PenTracker(self.source, kcf=self.kcf, flow=self.flow)
+            for det in tracker:
+                if self.stop.is_set():
+                    break
+                if det.box is None:
+                    continue
+
+                h, w = det.image.shape[:2]
+                x, y, bw, bh = det.box
+                u, v = x + bw / 2, y + bh / 2
+                if self.pixels:
+                    pos = (u / w, 1 - v / h, 0.0)
+                else:
+                    # Pinhole camera: size in pixels = f * size / depth
+                    f = (w / 2) / math.tan(math.radians(self.fov) / 2)
+                    z = f * self.marker_size / max(bw, bh)
+                    pos = ((u - w / 2) * z / f, (v - h / 2) * z / f, z)
+                self.samples.append((epoch + det.t, *pos, det.t))
+        except Exception as e:
+            # Raised again by whoever is reading the samples
+            self.error = e
+        finally:
+            if tracker is not None:
+                tracker.close()
+                self.summary = tracker.summary()
+            self.done.set()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+class VideoSource(DataSource):
+    worker: VideoWorker
+    rows: list[RecordingRow]
+    file: str
+    # Seconds between a frame being read and its position reaching the plot
+    latency: deque[float]
+
+    def __init__(
+        self,
+        plot: "Plotter",
+        file: str,
+        source: Union[str, int],
+        calibrate: bool = False,
+        proj: Optional[Projection] = None,
+        pixels: bool = False,
+        kcf: bool = False,
+        flow: bool = False,
+    ):
+        super().__init__(plot, calibrate, proj)
+        self.file = file
+        self.rows = []
+        self.latency = deque(maxlen=1000)
+        self.worker = VideoWorker(source, pixels, kcf, flow)
+        self.worker.start()
+        log.info(f"Tracking pen in video source {source}")
+
+    def tick(self, pos: Position) -> bool:
+        added = drain(self.worker, pos, self.latency, self.rows)
+        if added == 0:
+            if self.worker.done.is_set() and len(self.worker.samples) == 0:
+                if self.worker.error is not None:
+                    raise self.worker.error
+                raise IndexError("Video finished")
+            time.sleep(0.005)
+        return added > 0
+
+    def finalize(self):
+        self.worker.close()
+        log.info(self.worker.summary)
+        if len(self.latency) > 0:
+            lat = np.array(self.latency) * 1000
+            log.info(
+                f"Frame to plot latency: {np.median(lat):.1f} ms median, "
+                f"{np.percentile(lat, 99):.1f} ms p99"
+            )
+        # Same format as SocketSource, so recordings can be replayed later
+        save(self.file, self.rows)
+        self.add_to_catalog(self.file)
+
+
+def drain(
+    worker: VideoWorker,
+    pos: Position,
+    latency: deque[float],
+    rows: Optional[list[RecordingRow]] = None,
+) -> int:
+    added = 0
+    while True:
+        try:
+            t, x, y, z, read = worker.samples.popleft()
+        except IndexError:
+            break
+        pos.append((x, y, z), t)
+        latency.append(time.perf_counter() - read)
+        if rows is not None:
+            rows.append(
+                {
+                    "sno": 0,
+                    "time": t,
+                    "x": x,
+                    "y": y,
+                    "z": z,
+                    "qx": 0.0,
+                    "qy": 0.0,
+                    "qz": 0.0,
+                    "qw": 1.0,
+                    "id": 0,
+                }
+            )
+        added += 1
+    return added
+
+
+def benchmark(video: str, pixels: bool = False, kcf: bool = False, flow: bool = False):
+    worker = VideoWorker(video, pixels, kcf, flow)
+    pos = Position(5000)
+    latency: deque[float] = deque(maxlen=1 << 20)
+
+    start = time.perf_counter()
+    worker.start()
+    samples = 0
+    while not (worker.done.is_set() and len(worker.samples) == 0):
+        n = drain(worker, pos, latency)
+        samples += n
+        if n == 0:
+            time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    if worker.error is not None:
+        raise worker.error
+
+    print(worker.summary)
+    print(f"{samples} positions in {elapsed:.3f}s ({samples / elapsed:.1f}/s)")
+    if len(latency) > 0:
+        lat = np.array(latency) * 1000
+        print(
+            f"Frame to position latency: {np.median(lat):.2f} ms median, "
+            f"{np.percentile(lat, 99):.2f} ms p99, {lat.max():.2f} ms max"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m realsense.video <video> [--kcf] [--flow] [--pixels]")
+        sys.exit(1)
+    benchmark(sys.argv[1], "--pixels" in sys.argv, "--kcf" in sys.argv, "--flow" in sys.argv)
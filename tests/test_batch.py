@@ -0,0 +1,43 @@
+# Which recordings a batch picks up, and what their outputs are called
+from realsense.batch import expand, output_names
+
+
+def touch(path) -> str:
+    open(path, "w").close()
+    return str(path)
+
+
+def test_output_names():
+    files = ["a/eric.csv", "a/eric.zrec", "b/eric.csv", "a/hi.csv", "c/a_eric.csv"]
+    names = output_names(files)
+    assert names == {
+        "a/eric.csv": "a_eric_csv",
+        "a/eric.zrec": "a_eric_zrec",
+        "b/eric.csv": "b_eric_csv",
+        "a/hi.csv": "hi",
+        "c/a_eric.csv": "a_eric",
+    }
+    assert len(set(names.values())) == len(files)
+
+
+def test_output_names_taken():
+    # Two directories that only differ above the parent still collide
+    files = ["x/a/eric.csv", "y/a/eric.csv", "a_eric_csv.csv"]
+    names = output_names(files)
+    assert names["a_eric_csv.csv"] == "a_eric_csv"
+    assert sorted([names["x/a/eric.csv"], names["y/a/eric.csv"]]) == [
+        "a_eric_csv-2",
+        "a_eric_csv-3",
+    ]
+    assert len(set(names.values())) == len(files)
+
+
+def test_expand(tmp_path):
+    cal = touch(tmp_path / "calibrate.csv")
+    eric = touch(tmp_path / "eric.csv")
+    # Compressed from eric.csv, so the same recording
+    touch(tmp_path / "eric.zrec")
+    hi = touch(tmp_path / "hi.zrec")
+    missing = str(tmp_path / "missing.csv")
+    files = expand([str(tmp_path), str(tmp_path / "*.csv"), missing], exclude=cal)
+    assert files == [eric, hi, missing]
@@ -0,0 +1,85 @@
+# Indexing recordings and searching them by time, region and text
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from realsense.calibration import load_calibration, read_recording
+from realsense.catalog import Catalog
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    files = []
+    for name in ("hi.csv", "eric.csv"):
+        shutil.copy(os.path.join(SAMPLES, name), tmp_path / name)
+        files.append(str(tmp_path / name))
+    with open(tmp_path / "hi.txt", "w") as f:
+        f.write("hi there")
+    return files
+
+
+@pytest.fixture
+def catalog(tmp_path, recordings):
+    cal = load_calibration(os.path.join(SAMPLES, "calibrate.csv"), None)
+    assert cal is not None
+    with Catalog(str(tmp_path / "catalog.db")) as cat:
+        assert cat.index_all(recordings, *cal) == 2
+        # Nothing changed, so nothing is read again
+        assert cat.index_all(recordings, *cal) == 0
+        yield cat
+
+
+def test_time(catalog, recordings):
+    hi, eric = recordings
+    t, _ = read_recording(hi, None)
+    found = catalog.sessions(after=float(t[0]), before=float(t[-1]))
+    assert [s.path for s in found] == [os.path.abspath(hi)]
+    assert found[0].samples == len(t) and found[0].sno == "821212061590"
+    assert len(catalog.sessions()) == 2
+    assert catalog.sessions(after=float(t[-1]) + 1e6) == []
+
+
+def test_region(catalog, recordings):
+    sessions = catalog.sessions()
+    strokes = catalog.strokes()
+    assert len(strokes) == sum(s.strokes for s in sessions) > 0
+    assert all(s.t0 <= s.t1 for s in strokes)
+    # Each stroke is found by a region that only touches its own box
+    for stroke in strokes[:10]:
+        x0, y0, x1, y1 = stroke.box
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        assert stroke in catalog.strokes(region=(cx, cy, cx, cy))
+        assert stroke.path in [s.path for s in catalog.sessions(region=(cx, cy, cx, cy))]
+    boxes = np.array([s.box for s in strokes])
+    far = float(boxes[:, 2].max()) + 1
+    assert catalog.strokes(region=(far, -1e3, far + 1, 1e3)) == []
+
+
+def test_text(catalog, recordings):
+    hi, eric = recordings
+    assert [s.path for s in catalog.sessions(text="there")] == [os.path.abspath(hi)]
+    catalog.add_text(eric, 'e = mc^2 "quoted" OR', (0.1, 0.1, 0.4, 0.2))
+    # Words are taken literally, FTS5 operators and quotes included
+    assert [s.path for s in catalog.sessions(text="OR")] == [os.path.abspath(eric)]
+    assert [s.path for s in catalog.sessions(text='"quoted"')] == [os.path.abspath(eric)]
+    assert catalog.sessions(text="there mc") == []
+
+
+def test_changes(catalog, recordings):
+    hi, eric = recordings
+    # A changed recording is read again, a deleted one is pruned
+    with open(eric, "a") as f:
+        f.write(open(eric).readlines()[-1])
+    assert catalog.index(eric)
+    # Indexed without a calibration this time
+    strokes = {s.path: s.strokes for s in catalog.sessions()}
+    assert strokes[os.path.abspath(eric)] is None
+    assert strokes[os.path.abspath(hi)] == len(catalog.strokes())
+    os.remove(hi)
+    assert catalog.prune() == 1
+    assert [s.path for s in catalog.sessions()] == [os.path.abspath(eric)]
+    assert len(catalog.sessions(text="there")) == 0
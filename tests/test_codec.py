@@ -0,0 +1,72 @@
+# Round trips through the .zrec format
+import filecmp
+import os
+
+import numpy as np
+
+from realsense import codec
+from realsense.state import RecordingRow
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+
+def make_rows(n: int) -> list[RecordingRow]:
+    rng = np.random.default_rng(0)
+    rows: list[RecordingRow] = []
+    pose = rng.normal(size=7)
+    for i in range(n):
+        # The tracker repeats poses, and the tool changes partway through
+        if i % 5 == 0:
+            pose = rng.normal(size=7)
+        x, y, z, qx, qy, qz, qw = pose.tolist()
+        rows.append(
+            {
+                "sno": "821212061590",  # type: ignore
+                "time": 1740868041.0 + i / 90 + rng.uniform(0, 1e-4),
+                "x": x,
+                "y": y,
+                "z": z,
+                "qx": qx,
+                "qy": qy,
+                "qz": qz,
+                "qw": qw,
+                "id": "2" if i < n // 2 else "3",  # type: ignore
+            }
+        )
+    return rows
+
+
+def test_csv_round_trip(tmp_path):
+    src = os.path.join(SAMPLES, "hi.csv")
+    zrec = str(tmp_path / "hi.zrec")
+    back = str(tmp_path / "hi.csv")
+    size = codec.compress(src, zrec, block=100)
+    assert size == os.path.getsize(zrec) < os.path.getsize(src)
+    codec.decompress(zrec, back)
+    assert filecmp.cmp(src, back, shallow=False)
+
+
+def test_writer_round_trip(tmp_path):
+    rows = make_rows(250)
+    file = str(tmp_path / "live.zrec")
+    with open(file, "wb") as out:
+        writer = codec.Writer(out, "lzma", block=64)
+        for row in rows:
+            writer.write(row)
+        writer.close()
+
+    got = [row for block in codec.blocks(file) for row in codec.rows(block)]
+    assert got == rows
+    t, poses = codec.read(file)
+    assert np.array_equal(t, [r["time"] for r in rows])
+    assert poses.shape == (250, 7)
+
+
+def test_save_by_extension(tmp_path):
+    rows = make_rows(20)
+    codec.save(str(tmp_path / "a.zrec"), rows)
+    codec.save(str(tmp_path / "a.csv"), rows)
+    assert codec.is_compressed(str(tmp_path / "a.zrec"))
+    assert not codec.is_compressed(str(tmp_path / "a.csv"))
+    codec.decompress(str(tmp_path / "a.zrec"), str(tmp_path / "b.csv"))
+    assert filecmp.cmp(str(tmp_path / "a.csv"), str(tmp_path / "b.csv"), shallow=False)
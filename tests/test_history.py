@@ -0,0 +1,59 @@
+# Position.range across the in-memory deques and the archive on disk
+import numpy as np
+
+from realsense.history import COLUMNS, Archive
+from realsense.state import Position
+
+
+def fill(pos: Position, times: np.ndarray):
+    for t in times.tolist():
+        pos.append((t, -t, 2 * t), t)
+
+
+def expected(times: np.ndarray, t0: float, t1: float) -> np.ndarray:
+    t = times[(times >= t0) & (times < t1)]
+    return np.column_stack((t, t, -t, 2 * t))
+
+
+def test_range_across_tiers(tmp_path):
+    archive = Archive(str(tmp_path / "h.hist"), chunk=4)
+    pos = Position(10, archive=archive)
+    times = np.arange(52.0)
+    fill(pos, times)
+    # 42 samples fell out of the deques: 40 on disk, 2 waiting for the next chunk
+    assert archive.count == 40 and len(archive) == 42
+    for t0, t1 in ((0, 52), (3, 7), (30, 45), (38, 42), (41, 44), (45, 51), (60, 70), (10, 10)):
+        assert np.array_equal(pos.range(t0, t1), expected(times, t0, t1)), (t0, t1)
+    archive.close()
+
+
+def test_reopen_appends(tmp_path):
+    file = str(tmp_path / "h.hist")
+    archive = Archive(file, chunk=4)
+    for t in range(10):
+        archive.append(t, t, -t, 2 * t)
+    archive.close()
+    # A crash left half a record at the end
+    with open(file, "ab") as f:
+        f.write(b"\0" * 12)
+
+    archive = Archive(file, chunk=4)
+    assert archive.count == 10 and archive.last == 9 and archive.ordered
+    assert len(archive.records()) == 10
+    for t in range(10, 20):
+        archive.append(t, t, -t, 2 * t)
+    assert np.array_equal(archive.range(5, 15), expected(np.arange(20.0), 5, 15))
+    archive.close()
+
+
+def test_unordered(tmp_path):
+    archive = Archive(str(tmp_path / "h.hist"), chunk=4)
+    # A replay of an older recording after a live session
+    times = np.r_[np.arange(100.0, 120.0), np.arange(0.0, 10.0)]
+    for t in times.tolist():
+        archive.append(t, t, -t, 2 * t)
+    assert not archive.ordered
+    got = archive.range(5, 110)
+    assert np.array_equal(got[np.argsort(got[:, 0])], expected(np.sort(times), 5, 110))
+    assert archive.records().shape == (28, COLUMNS)
+    archive.close()
@@ -0,0 +1,107 @@
+# Incremental recognition: what gets recognized again, and how clusters change
+import os
+
+import numpy as np
+
+from ocr.incremental import IncrementalRecognizer
+from realsense.recognize import OcrSink
+
+
+class Stub:
+    # Returns a new text on every call, so cached text is easy to tell apart
+    calls: int
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, img) -> str:
+        self.calls += 1
+        return f"text{self.calls}"
+
+
+def line(x0: float, x1: float, y: float) -> np.ndarray:
+    # A zigzag from x0 to x1, about as high as a letter (from y up)
+    return np.column_stack((np.linspace(x0, x1, 10), y + 0.03 * (np.arange(10) % 2)))
+
+
+def texts(r: IncrementalRecognizer) -> list[str]:
+    return [c.text for c in r.recognize()]
+
+
+def test_only_changed_clusters():
+    stub = Stub()
+    r = IncrementalRecognizer(stub)
+    a = r.add_stroke(line(0.1, 0.2, 0.5))
+    r.add_stroke(line(0.6, 0.7, 0.5))
+    assert texts(r) == ["text1", "text2"]
+    assert r.recognized == 2
+
+    # Nothing changed, so nothing is recognized and the text is served as it was
+    assert texts(r) == ["text1", "text2"]
+    assert r.recognized == 0 and stub.calls == 2
+
+    # Writing next to the second cluster only re-recognizes that one
+    r.add_stroke(line(0.72, 0.8, 0.5))
+    assert texts(r) == ["text1", "text3"]
+    assert r.recognized == 1
+
+    # So does extending a stroke
+    r.extend_stroke(a, np.array([[0.22, 0.52]]))
+    assert texts(r) == ["text4", "text3"]
+    assert r.recognized == 1 and stub.calls == 4
+
+
+def test_bridge():
+    r = IncrementalRecognizer(Stub())
+    left = r.add_stroke(line(0.1, 0.2, 0.5))
+    right = r.add_stroke(line(0.4, 0.5, 0.5))
+    assert sorted(map(sorted, r.clusters())) == [[left], [right]]
+    bridge = r.add_stroke(line(0.2, 0.4, 0.5))
+    assert sorted(map(sorted, r.clusters())) == [[left, right, bridge]]
+    # Erasing the bridge splits the cluster again
+    r.remove_stroke(bridge)
+    assert sorted(map(sorted, r.clusters())) == [[left], [right]]
+    assert len(r.recognize()) == 2
+
+
+def test_reading_order():
+    r = IncrementalRecognizer(Stub())
+    # Second line, then the end and the start of the first one (a little lower)
+    below = r.add_stroke(line(0.1, 0.2, 0.3))
+    end = r.add_stroke(line(0.6, 0.7, 0.6))
+    start = r.add_stroke(line(0.1, 0.2, 0.59))
+    assert r.clusters() == [[start], [end], [below]]
+
+
+def test_rows_reused():
+    r = IncrementalRecognizer(Stub())
+    ids = [r.add_stroke(line(0.1 * i, 0.1 * i + 0.02, 0.5)) for i in range(8)]
+    for id in ids[:4]:
+        r.remove_stroke(id)
+    # Erased strokes make room for new ones
+    for i in range(4):
+        r.add_stroke(line(0.1 * i, 0.1 * i + 0.02, 0.2))
+    assert len(r.ids) == 8 and len(r.clusters()) == 8
+    r.clear()
+    assert (r.ids, r.row, r.free, r.clusters()) == ([], {}, [], [])
+
+
+def test_sink(tmp_path):
+    file = str(tmp_path / "board.txt")
+    sink = OcrSink(file, Stub())
+    t = 0.0
+    for stroke in (line(0.1, 0.2, 0.5), line(0.6, 0.7, 0.5)):
+        for x, y in stroke.tolist():
+            sink.on_sample((x, y, 0.0), t, True)
+            t += 0.01
+        sink.on_sample((0.0, 0.0, 0.1), t, False)
+    # The pen is still down when the projection ends
+    sink.on_sample((0.1, 0.2, 0.0), t, True)
+    sink.on_sample((0.1, 0.25, 0.0), t + 0.01, True)
+    sink.close()
+    assert len(sink.recognizer.strokes) == 3
+    assert sink.passes >= 1 and os.path.exists(file)
+    with open(file) as f:
+        assert f.read().splitlines() == sink.text
+    # The last stroke is a cluster of its own, below the others
+    assert len(sink.text) == 3
@@ -0,0 +1,110 @@
+# Stroke decimation and the SVG / InkML encodings
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from realsense.ink import InkmlSink, SvgSink, rdp
+
+
+def segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> float:
+    ab = b - a
+    u = 0.0 if not ab.any() else float(np.clip(np.dot(p - a, ab) / np.dot(ab, ab), 0, 1))
+    return float(np.linalg.norm(p - (a + u * ab)))
+
+
+def test_rdp():
+    rng = np.random.default_rng(0)
+    # A corner with some jitter on both legs
+    leg = np.linspace(0, 100, 50)
+    pts = np.r_[
+        np.column_stack((leg, np.zeros(50))), np.column_stack((np.full(50, 100), leg))
+    ]
+    pts += rng.uniform(-0.4, 0.4, pts.shape)
+    keep = rdp(pts, 1.0)
+    assert keep[0] and keep[-1] and keep[49:51].any()
+    assert keep.sum() < 10
+    # No dropped point is further than eps from the segment that replaced it
+    kept = np.flatnonzero(keep)
+    for a, b in zip(kept[:-1], kept[1:]):
+        for i in range(a + 1, b):
+            assert segment_distance(pts[i], pts[a], pts[b]) <= 1.0
+
+    assert rdp(np.zeros((1, 2)), 1.0).tolist() == [True]
+    # Points that all coincide
+    assert rdp(np.zeros((5, 2)), 1.0).tolist() == [True, False, False, False, True]
+
+
+def draw(sink, strokes: list[np.ndarray]):
+    t = 100.0
+    for stroke in strokes:
+        for x, y in stroke.tolist():
+            sink.on_sample((x, y, 0.0), t, True)
+            t += 0.01
+        sink.on_sample((0.0, 0.0, 0.1), t, False)
+        t += 0.01
+
+
+def strokes() -> list[np.ndarray]:
+    s = np.linspace(0, 1, 40)
+    return [
+        np.column_stack((0.1 + 0.8 * s, 0.5 + 0.3 * np.sin(6 * s))),
+        np.array([[0.25, 0.75]]),
+        np.column_stack((np.full(30, 0.5), np.linspace(0.9, 0.1, 30))),
+    ]
+
+
+def to_grid(stroke: np.ndarray, w: int, h: int) -> np.ndarray:
+    return np.column_stack((np.rint(stroke[:, 0] * w), np.rint((1 - stroke[:, 1]) * h)))
+
+
+def test_svg(tmp_path):
+    file = str(tmp_path / "a.svg")
+    sink = SvgSink(file)
+    sink.on_calibrate(np.diag([2.0, 1.0, 1.0]))
+    draw(sink, strokes()[:2])
+    sink.write()
+    # Valid in the middle of the session, and recalibrating carries on in the file
+    assert len(ET.parse(file).getroot()[0]) == 2
+    sink.finalize()
+    sink.on_calibrate(np.diag([1.0, 1.0, 1.0]))
+    draw(sink, strokes()[2:])
+    sink.close()
+
+    root = ET.parse(file).getroot()
+    assert root.get("viewBox") == "0 0 1000 500"
+    paths = [p.get("d") for p in root.iter("{http://www.w3.org/2000/svg}path")]
+    assert len(paths) == 3
+    for d, stroke in zip(paths, strokes()):
+        # Dots are drawn as a zero length line
+        nums = [float(v) for v in re.findall(r"-?\d+", d.removesuffix("h0"))]
+        start, rel = np.array(nums[:2]), np.array(nums[2:]).reshape(-1, 2)
+        pts = start + np.cumsum(np.r_[[[0, 0]], rel], axis=0)
+        grid = to_grid(stroke, 1000, 500)
+        assert np.array_equal(pts[0], grid[0]) and np.array_equal(pts[-1], grid[-1])
+        # Every point is on the original stroke
+        assert all((grid == p).all(axis=1).any() for p in pts)
+
+
+def test_inkml(tmp_path):
+    file = str(tmp_path / "a.inkml")
+    sink = InkmlSink(file)
+    draw(sink, strokes())
+    sink.close()
+
+    root = ET.parse(file).getroot()
+    traces = [t.text for t in root.iter("{http://www.w3.org/2003/InkML}trace")]
+    assert len(traces) == 3
+    for text, stroke in zip(traces, strokes()):
+        points = text.split(",")
+        rows = [np.array(points[0].split(), dtype=float)]
+        if len(points) > 1:
+            rows.append(np.array(points[1].split("'")[1:], dtype=float))
+            rows += [np.array(p.split(), dtype=float) for p in points[2:]]
+        decoded = np.cumsum(rows, axis=0)
+        grid = to_grid(stroke, 1000, 1000)
+        assert np.array_equal(decoded[0, :2], grid[0])
+        assert np.array_equal(decoded[-1, :2], grid[-1])
+        # Times in ms since the first sample, going forward
+        assert (np.diff(decoded[:, 2]) > 0).all()
+    assert sink.points_out < sink.points_in
@@ -0,0 +1,70 @@
+# The shared memory ring: wrapping around, and readers that fall behind
+import os
+
+import numpy as np
+import pytest
+
+from realsense.shm import H_WRITE, Reader, Ring, segment
+
+NAME = f"zotpen-test-{os.getpid()}"
+CAPACITY = 8
+
+
+@pytest.fixture
+def ring():
+    ring = Ring(segment(NAME, "raw"), 4, CAPACITY)
+    yield ring
+    ring.close()
+
+
+def rows(start: int, n: int) -> np.ndarray:
+    # Row i is all i, so it's easy to see which ones came back
+    return np.repeat(np.arange(start, start + n, dtype=np.float64), 4).reshape(n, 4)
+
+
+def reader() -> Reader:
+    return Reader(NAME, "raw", timeout=1.0)
+
+
+def test_wrap(ring):
+    r = reader()
+    ring.write(rows(0, 5))
+    assert np.array_equal(r.read(), rows(0, 5))
+    # Goes past the end of the buffer and around
+    ring.write(rows(5, 6))
+    assert r.available == 6
+    assert np.array_equal(r.read(limit=4), rows(5, 4))
+    assert np.array_equal(r.read(), rows(9, 2))
+    assert np.array_equal(r.latest(3), rows(8, 3))
+    assert r.lost == 0
+    r.close()
+
+
+def test_overrun(ring):
+    r = reader()
+    ring.write(rows(0, 5))
+    # More than fits in the ring, some of it in a single write
+    ring.write(rows(5, 3))
+    ring.write(rows(8, 12))
+    assert np.array_equal(r.read(), rows(20 - CAPACITY, CAPACITY))
+    assert r.lost == 20 - CAPACITY
+    r.close()
+
+
+def test_write_in_progress(ring):
+    r = reader()
+    ring.write(rows(0, CAPACITY))
+    # The writer is partway through copying 3 more rows over the oldest ones
+    ring.header[H_WRITE] = CAPACITY + 3
+    assert np.array_equal(r.read(), rows(3, CAPACITY - 3))
+    assert r.lost == 3
+    r.close()
+
+
+def test_start_latest(ring):
+    ring.write(rows(0, 5))
+    r = Reader(NAME, "raw", timeout=1.0, latest=True)
+    assert r.available == 0
+    ring.write(rows(5, 2))
+    assert np.array_equal(r.read(), rows(5, 2))
+    r.close()
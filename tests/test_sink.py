@@ -0,0 +1,89 @@
+# The broadcaster's frames, through a client on the loopback interface
+import socket
+
+import pytest
+
+from realsense.sink import FRAME, MAGIC, BroadcastClient, BroadcastSink, decode, encode
+
+
+@pytest.fixture
+def pair():
+    # Host names are resolved, and port 0 lets the client pick a free one
+    client = BroadcastClient("localhost:0", timeout=1.0)
+    port = client.sock.getsockname()[1]
+    sink = BroadcastSink(f"localhost:{port}")
+    yield sink, client
+    sink.finalize()
+    client.close()
+
+
+def test_coalesce(pair):
+    sink, client = pair
+    # Samples between flushes only send the newest one
+    for i in range(5):
+        sink.on_sample((i, 2 * i, 0.1), 10.0 + i, False)
+    sink.flush()
+    sink.flush()
+    frame = client.recv()
+    assert frame is not None
+    assert (frame.seq, frame.t, frame.x, frame.y, frame.pressed, frame.edge) == (
+        0,
+        14.0,
+        4.0,
+        8.0,
+        False,
+        False,
+    )
+    client.sock.settimeout(0.05)
+    assert client.recv() is None
+
+
+def test_edges(pair):
+    sink, client = pair
+    sink.on_sample((0.1, 0.1, 0.1), 1.0, False)
+    # Sent right away, and the sample before it isn't sent at all
+    sink.on_sample((0.2, 0.2, 0.0), 2.0, True)
+    frame = client.recv()
+    assert frame is not None and frame.pressed and frame.edge and frame.t == 2.0
+    sink.on_sample((0.3, 0.3, 0.0), 3.0, True)
+    sink.on_sample((0.4, 0.4, 0.1), 4.0, False)
+    frame = client.recv()
+    assert frame is not None and not frame.pressed and frame.edge and frame.t == 4.0
+    sink.flush()
+    client.sock.settimeout(0.05)
+    assert client.recv() is None
+    assert client.lost == 0
+
+
+def send(seqs: list[int]) -> BroadcastClient:
+    client = BroadcastClient("127.0.0.1:0", timeout=1.0)
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for seq in seqs:
+        out.sendto(encode(seq, (0.0, 0.0, 0.0), 0.0, 0), client.sock.getsockname())
+    out.close()
+    for seq in seqs:
+        frame = client.recv()
+        assert frame is not None and frame.seq == seq & 0xFFFFFFFF
+    return client
+
+
+def test_lost_and_late():
+    client = send([5, 4, 5, 8, 2**32 - 1])
+    # 6 and 7 went missing, 4 and the second 5 were late, and 2^32 - 1 is behind 8
+    assert (client.lost, client.late, client.last_seq) == (2, 3, 8)
+    client.close()
+
+    # Going forward across the wrap, with 0 missing
+    client = send([2**32 - 2, 2**32 - 1, 1])
+    assert (client.lost, client.late, client.last_seq) == (1, 0, 1)
+    client.close()
+
+
+def test_decode():
+    data = encode(7, (1.0, 2.0, 3.0), 4.0, 3)
+    frame = decode(data)
+    assert frame is not None and frame.seq == 7 and frame.pressed and frame.edge
+    assert decode(b"XPEN" + data[4:]) is None
+    assert decode(data[:-1]) is None
+    assert decode(data + b"\0") is None
+    assert len(data) == FRAME.size and data[:4] == MAGIC